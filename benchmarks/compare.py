@@ -0,0 +1,53 @@
+import argparse
+import json
+import sys
+
+# Compare two result files from the same benchmark and flag regressions:
+#   python -m benchmarks.compare before.json after.json --threshold 0.10
+# Latencies (*_ms) regress when they grow, throughputs (*_rps) when they shrink.
+
+
+def _metrics(results, prefix=''):
+    # Flatten nested results into {'endpoints./events.p95_ms': value}
+    metrics = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            metrics.update(_metrics(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and (key.endswith('_ms') or key.endswith('_rps')):
+            metrics[name] = value
+    return metrics
+
+
+def compare(before, after, threshold):
+    # (metric, before, after, relative change, regressed) for metrics present in both
+    old, new = _metrics(before['results']), _metrics(after['results'])
+    rows = []
+    for name in sorted(old.keys() & new.keys()):
+        if not old[name]:
+            continue
+        change = (new[name] - old[name]) / old[name]
+        worse = change > threshold if name.endswith('_ms') else change < -threshold
+        rows.append((name, old[name], new[name], change, worse))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change that counts as a regression')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before['kind'] != after['kind']:
+        sys.exit(f"cannot compare a {before['kind']} run with a {after['kind']} run")
+
+    rows = compare(before, after, args.threshold)
+    for name, old, new, change, worse in rows:
+        print(f"{'REGRESSION' if worse else '':10s} {name:45s} {old:12.2f} -> {new:12.2f} ({change:+.1%})")
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
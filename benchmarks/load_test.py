@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.results import latency_summary, save_results
+from benchmarks.synthetic import stroop_events, survey_events
+
+# Replays participant traffic against the API backed by a temp SQLite file.
+#
+# Each simulated subject runs a Stroop session (start, a burst of events, finish), a
+# daily_core survey, and uploads speech recordings. Subjects run concurrently, and
+# latency is recorded per endpoint.
+#
+#   python -m benchmarks.load_test --subjects 50 --out bench_load.json
+#
+# --server uvicorn (default) runs src.main in a uvicorn subprocess and talks HTTP to it;
+# --server asgi calls the app in-process, which leaves out the network and server.
+# --shards N backs it with a new N-shard layout (src/shards.py) instead of one file.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _server_env(workdir, shards=0):
+    env = dict(os.environ)
+    env.update(DB_PATH=os.path.join(workdir, 'bench.db'), SPEECH_ROOT=os.path.join(workdir, 'raw'),
+               TASKS_DIR=os.path.join(REPO_ROOT, 'tasks'))
+    if shards:
+        env.update(SHARD_DIR=os.path.join(workdir, 'shards'), SHARD_COUNT=str(shards))
+    return env
+
+
+async def _timed(stats, name, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        response, ok = None, False
+    stats[name].append((time.perf_counter() - start, ok))
+    return response if ok else None
+
+
+async def _events(client, stats, session_id, events, batch):
+    # A burst: every event of the session in flight at once, or one /events/batch call
+    bodies = [{'session_id': session_id, 'event_index': i, 'ts_utc': '2025-08-01T12:00:00Z', 'tz': 'UTC',
+               'event_type': 'task_trial', 'item_id': item_id, 'payload_json': payload}
+              for i, (item_id, payload) in enumerate(events)]
+    if batch:
+        await _timed(stats, '/events/batch', client.post('/events/batch', json=bodies))
+    else:
+        await asyncio.gather(*(_timed(stats, '/events', client.post('/events', json=body)) for body in bodies))
+
+
+async def _session(client, stats, subject_id, app_id, app_type, events, batch):
+    response = await _timed(stats, '/sessions/start', client.post('/sessions/start', json={
+        'subject_id': subject_id, 'app_id': app_id, 'app_type': app_type, 'tz': 'UTC'}))
+    if response is None:
+        return None
+    session_id = response.json()['session_id']
+    await _events(client, stats, session_id, events, batch)
+    await _timed(stats, '/sessions/finish', client.post('/sessions/finish', json={
+        'session_id': session_id, 'ts_end_utc': '2025-08-01T12:05:00Z'}))
+    return session_id
+
+
+async def _subject(client, stats, index, args):
+    rng = random.Random(args.seed + index)
+    subject_id = f'load{index:05d}'
+    session_id = await _session(client, stats, subject_id, 'stroop', 'task', stroop_events(rng, args.trials), args.batch)
+    await _session(client, stats, subject_id, 'daily_core', 'survey', survey_events(rng, 'daily_core'), args.batch)
+    for upload in range(args.uploads):
+        audio = os.urandom(args.upload_kb * 1024)
+        await _timed(stats, '/upload-speech', client.post('/upload-speech', data={
+            'subject_id': subject_id, 'session_id': session_id or '', 'prompt_id': f'prompt{upload}'},
+            files={'speechFile': (f'rec{upload}.m4a', audio, 'audio/mp4')}))
+
+
+async def _run(client, args):
+    stats = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def subject(index):
+        async with semaphore:
+            await _subject(client, stats, index, args)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(subject(i) for i in range(args.subjects)))
+    return stats, time.perf_counter() - start
+
+
+def _start_uvicorn(workdir, shards=0):
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'src.main:create_app', '--factory', '--port', str(port), '--log-level', 'warning'],
+                            cwd=REPO_ROOT, env=_server_env(workdir, shards))
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('uvicorn exited during startup')
+        try:
+            if httpx.get(f'{base_url}/health').status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError('uvicorn did not become healthy within 30s')
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='osh-bench-')
+    limits = httpx.Limits(max_connections=args.concurrency * 4)
+    if args.server == 'uvicorn':
+        proc, base_url = _start_uvicorn(workdir, args.shards)
+        try:
+            async def main():
+                async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+                    return await _run(client, args)
+            stats, wall_s = asyncio.run(main())
+        finally:
+            proc.terminate()
+            proc.wait()
+    else:
+        from src.config import Config
+        from src.main import create_app
+
+        app = create_app(Config.from_env(_server_env(workdir, args.shards)))
+
+        async def main():
+            # ASGITransport does not send lifespan events, so start the app by hand
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url='http://bench', limits=limits, timeout=60) as client:
+                    return await _run(client, args)
+        stats, wall_s = asyncio.run(main())
+
+    n_requests = sum(len(samples) for samples in stats.values())
+    return {
+        'wall_s': wall_s,
+        'requests': n_requests,
+        'throughput_rps': n_requests / wall_s,
+        'endpoints': {name: latency_summary(samples, wall_s) for name, samples in sorted(stats.items())},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load-test the ingestion API with simulated subjects.')
+    parser.add_argument('--subjects', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=25, help='subjects active at the same time')
+    parser.add_argument('--trials', type=int, default=12, help='Stroop trials per session (the task page runs 2 + 10)')
+    parser.add_argument('--uploads', type=int, default=1, help='speech uploads per subject')
+    parser.add_argument('--upload-kb', type=int, default=256)
+    parser.add_argument('--batch', action='store_true', help='send events through /events/batch like tasks/common.js')
+    parser.add_argument('--server', choices=['uvicorn', 'asgi'], default='uvicorn')
+    parser.add_argument('--shards', type=int, default=0, help='use a sharded layout with this many shards')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write results JSON here')
+    args = parser.parse_args()
+
+    results = run(args)
+    for name, summary in results['endpoints'].items():
+        print(f"{name:18s} n={summary['count']:6d} err={summary['errors']:4d} {summary['throughput_rps']:8.1f}/s "
+              f"p50={summary['p50_ms']:7.1f}ms p95={summary['p95_ms']:7.1f}ms p99={summary['p99_ms']:7.1f}ms")
+    print(f"total {results['requests']} requests in {results['wall_s']:.2f}s ({results['throughput_rps']:.1f}/s)")
+    if args.out:
+        save_results(args.out, 'load', vars(args), results)
@@ -0,0 +1,100 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from benchmarks.results import save_results, time_call
+from benchmarks.synthetic import make_database, make_oura_export
+
+# Micro-benchmarks on synthetic data of configurable size:
+#   wide_*     GET /wide for every (subject, app), with the wide table cold (folded on read) and warm
+#   parse_*    scripts.parse_database loading and scoring
+#   oura_*     load_oura_data with and without its Parquet cache
+#
+#   python -m benchmarks.micro --subjects 20 --days 30 --out bench_micro.json
+
+
+def bench_wide(workdir, db_path, repeat):
+    from fastapi.testclient import TestClient
+    from src.config import Config
+    from src.main import create_app
+
+    app = create_app(Config(db_path=db_path, speech_root=os.path.join(workdir, 'raw')))
+    pairs = sqlite3.connect(db_path).execute('SELECT DISTINCT subject_id, app_id FROM sessions').fetchall()
+
+    def read_all():
+        for subject_id, app_id in pairs:
+            assert client.get('/wide', params={'subject_id': subject_id, 'app_id': app_id}).status_code == 200
+
+    def clear_wide_rows():
+        with sqlite3.connect(db_path) as conn:
+            conn.execute('DELETE FROM wide_rows')
+
+    with TestClient(app) as client:
+        return {
+            'wide_cold': time_call(read_all, repeat, setup=clear_wide_rows),
+            'wide_warm': time_call(read_all, repeat),
+        }
+
+
+def bench_parse(db_path, repeat):
+    from scripts import parse_database
+
+    conn = sqlite3.connect(db_path)
+    events_df = parse_database.load_data(conn)
+    return {
+        'parse_load_data': time_call(lambda: parse_database.load_data(conn), repeat),
+        'parse_surveys': time_call(lambda: [parse_database.parse_survey_data(events_df, app_id)
+                                            for app_id in ('behavioral', 'wellbeing', 'daily_core')], repeat),
+        'parse_pvt': time_call(lambda: parse_database.parse_pvt(events_df), repeat),
+        'parse_stroop': time_call(lambda: parse_database.parse_stroop(events_df), repeat),
+        'parse_build_features': time_call(lambda: parse_database.build_features(events_df), repeat),
+    }
+
+
+def bench_oura(workdir, n_days, hr_interval_s, repeat):
+    from wearables.oura.oura import load_oura_data
+
+    data_dir = os.path.join(workdir, 'oura_export')
+    cache_dir = os.path.join(workdir, 'oura_cache')
+    n_samples = make_oura_export(data_dir, n_days, hr_interval_s)
+    return {
+        'oura_uncached': time_call(lambda: load_oura_data(data_dir, cache_dir), repeat,
+                                   setup=lambda: shutil.rmtree(cache_dir, ignore_errors=True)),
+        'oura_cached': time_call(lambda: load_oura_data(data_dir, cache_dir), repeat),
+    }, n_samples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the wide table, the feature parsers and the Oura loader.')
+    parser.add_argument('--subjects', type=int, default=20)
+    parser.add_argument('--days', type=int, default=14, help='days of sessions per subject')
+    parser.add_argument('--trials', type=int, default=12, help='Stroop and PVT trials per session')
+    parser.add_argument('--oura-days', type=int, default=30)
+    parser.add_argument('--hr-interval-s', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', choices=['wide', 'parse', 'oura'], action='append', help='run only these groups')
+    parser.add_argument('--out', help='write results JSON here')
+    args = parser.parse_args()
+
+    groups = args.only or ['wide', 'parse', 'oura']
+    workdir = tempfile.mkdtemp(prefix='osh-micro-')
+    db_path = os.path.join(workdir, 'bench.db')
+    results = {'dataset': {}}
+    if 'wide' in groups or 'parse' in groups:
+        results['dataset']['events'] = make_database(db_path, args.subjects, args.days, args.trials)
+    if 'wide' in groups:
+        results.update(bench_wide(workdir, db_path, args.repeat))
+    if 'parse' in groups:
+        results.update(bench_parse(db_path, args.repeat))
+    if 'oura' in groups:
+        oura_results, results['dataset']['hr_samples'] = bench_oura(workdir, args.oura_days, args.hr_interval_s, args.repeat)
+        results.update(oura_results)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, timing in results.items():
+        if name != 'dataset':
+            print(f"{name:22s} median={timing['median_ms']:9.1f}ms min={timing['min_ms']:9.1f}ms")
+    if args.out:
+        save_results(args.out, 'micro', vars(args), results)
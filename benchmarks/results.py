@@ -0,0 +1,66 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Shared timing helpers and the JSON layout every benchmark writes:
+# {"kind", "meta": {commit, timestamp, python, platform, params}, "results": {...}}
+
+
+def latency_summary(samples, wall_s):
+    # samples: (seconds, ok) per request
+    seconds = np.array([s for s, _ in samples], dtype=float) * 1000
+    errors = sum(1 for _, ok in samples if not ok)
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) if len(seconds) else (float('nan'),) * 3
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'throughput_rps': len(samples) / wall_s if wall_s else float('nan'),
+        'mean_ms': float(seconds.mean()) if len(seconds) else float('nan'),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(seconds.max()) if len(seconds) else float('nan'),
+    }
+
+
+def time_call(fn, repeat=5, setup=None):
+    # Wall time of fn() over `repeat` runs; setup() runs untimed before each one
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'runs': repeat, 'min_ms': min(timings), 'median_ms': float(np.median(timings)), 'max_ms': max(timings)}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, kind, params, results):
+    payload = {
+        'kind': kind,
+        'meta': {
+            'commit': _commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'params': params,
+        },
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+    print(f"results written to {path}")
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.results import save_results
+
+# Cold-start cost of an API worker, each run in a fresh interpreter against an
+# already-migrated database:
+#   import      import src.main
+#   create      create_app(config)
+#   startup     the lifespan startup: open the database, check the schema, start services
+#   first_request  the first GET /health, which starts the ingest writer thread
+#   total       all of the above
+# It also records which heavy modules (pandas, pyarrow, numpy) were loaded by the import.
+#
+#   python -m benchmarks.startup --runs 10 --out startup.json
+#
+# --repo measures another checkout, e.g. a `git worktree add /tmp/old <commit>`, for a
+# before/after comparison with benchmarks.compare. A checkout without create_app does its
+# setup at import time, so it is measured by importing src.main and requesting /health.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('pandas', 'pyarrow', 'numpy')
+STEPS = ('import', 'create', 'startup', 'first_request', 'total')
+
+_CHILD = r'''
+import asyncio, json, sys, time
+start = time.perf_counter()
+import src.main as main
+timings = {'import': time.perf_counter() - start}
+heavy = [name for name in %(heavy)r if name in sys.modules]
+import httpx
+
+async def first_request(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://startup') as client:
+        return (await client.get('/health')).status_code
+
+mark = time.perf_counter()
+if hasattr(main, 'create_app'):
+    from src.config import Config
+    app = main.create_app(Config.from_env())
+    timings['create'] = time.perf_counter() - mark
+
+    async def run():
+        mark = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            timings['startup'] = time.perf_counter() - mark
+            mark = time.perf_counter()
+            status = await first_request(app)
+            timings['first_request'] = time.perf_counter() - mark
+        return status
+    status = asyncio.run(run())
+else:
+    timings['create'] = timings['startup'] = 0.0
+    status = asyncio.run(first_request(main.app))
+    timings['first_request'] = time.perf_counter() - mark
+    main.ingest.stop()
+timings['total'] = sum(timings.values())
+print(json.dumps({'ms': {step: seconds * 1000 for step, seconds in timings.items()}, 'heavy': heavy, 'status': status}))
+'''
+
+
+def _run_child(repo, env):
+    out = subprocess.run([sys.executable, '-c', _CHILD % {'heavy': HEAVY_MODULES}], cwd=repo, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(repo, roles, runs):
+    workdir = tempfile.mkdtemp(prefix='osh-startup-')
+    results = {}
+    try:
+        for role in roles:
+            env = dict(os.environ, PYTHONPATH=repo, APP_ROLE=role, LOG_EVENTS_PER_S='0',
+                       DB_PATH=os.path.join(workdir, 'startup.db'), SPEECH_ROOT=os.path.join(workdir, 'raw'),
+                       TASKS_DIR=os.path.join(repo, 'tasks'))
+            _run_child(repo, env)  # creates and migrates the database, warms the file cache
+            samples = [_run_child(repo, env) for _ in range(runs)]
+            if any(sample['status'] != 200 for sample in samples):
+                raise RuntimeError(f"/health failed during the {role} runs")
+            results[role] = {step: {'runs': runs,
+                                    'min_ms': min(s['ms'][step] for s in samples),
+                                    'median_ms': float(np.median([s['ms'][step] for s in samples])),
+                                    'max_ms': max(s['ms'][step] for s in samples)} for step in STEPS}
+            results[role]['heavy_modules'] = samples[0]['heavy']
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure API worker import and startup time.')
+    parser.add_argument('--repo', default=REPO_ROOT, help='checkout to measure (default: this one)')
+    parser.add_argument('--roles', nargs='+', default=['ingest', 'all'], help='APP_ROLE values to measure')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--out', help='write results JSON here')
+    args = parser.parse_args()
+
+    results = run(os.path.abspath(args.repo), args.roles, args.runs)
+    for role, steps in results.items():
+        print(f"{role:7s} " + ' '.join(f"{step}={steps[step]['median_ms']:7.1f}ms" for step in STEPS)
+              + f"  heavy imports: {', '.join(steps['heavy_modules']) or 'none'}")
+    if args.out:
+        save_results(args.out, 'startup', vars(args), results)
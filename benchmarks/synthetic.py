@@ -0,0 +1,135 @@
+import datetime
+import json
+import os
+import random
+import sqlite3
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from src.item_registry import DEFAULTS_PATH
+from src.migrations import migrate
+
+# Synthetic participants for the benchmarks. Payloads have the shape the pages in
+# tasks/ send and pass the item registry, so they exercise the same paths as real data.
+
+COLORS = {'red': 'ArrowLeft', 'green': 'ArrowUp', 'blue': 'ArrowRight', 'yellow': 'ArrowDown'}
+STROOP_PRACTICE_TRIALS = 2
+SURVEY_APPS = ['daily_core', 'behavioral', 'wellbeing']
+
+with open(DEFAULTS_PATH) as f:
+    APP_SCHEMAS = json.load(f)
+
+
+def _field_value(rng, spec):
+    if 'enum' in spec:
+        return rng.choice(spec['enum'])
+    return rng.randint(spec.get('min', 0), spec.get('max', 10))
+
+
+def survey_events(rng, app_id):
+    # (item_id, payload) per item; form posts send values as strings
+    return [(item_id, {'value': str(_field_value(rng, fields['value']))}) for item_id, fields in APP_SCHEMAS[app_id]['items'].items()]
+
+
+def stroop_events(rng, n_trials):
+    events = []
+    for i in range(n_trials):
+        word, color = rng.choice(list(COLORS)), rng.choice(list(COLORS))
+        key = rng.choice([COLORS[color]] * 8 + [COLORS[rng.choice(list(COLORS))], None])
+        events.append((f'stroop_trial_{i}', {
+            'condition': 'congruent' if word == color else 'incongruent',
+            'rt_ms': None if key is None else rng.randint(400, 1200),
+            'correct': int(key == COLORS[color]),
+            'key_pressed': key,
+            'expected_key': COLORS[color],
+            'word': word.upper(),
+            'font_color': color,
+            'stim_id': f'{word.upper()}_{color}',
+            'phase': 'practice' if i < STROOP_PRACTICE_TRIALS else 'test',
+        }))
+    return events
+
+
+def pvt_events(rng, n_trials, ts_utc):
+    events = []
+    for i in range(n_trials):
+        rt = rng.choice([None] + [rng.randint(200, 500)] * 9)
+        events.append(('pvt_trial', {
+            'phase': 'practice' if i < 2 else 'main',
+            'trial_index': 2 * i + 1,
+            'stimulus_id': f'circle_{i}',
+            'rt_ms': rt,
+            'correct': int(rt is not None),
+            'ts_utc': ts_utc,
+            'tz': 'UTC',
+        }))
+    return events
+
+
+def make_database(path, n_subjects=20, n_days=14, n_trials=12, seed=0):
+    # One session per app per subject per day, all finished; returns the number of events
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    sessions, events = [], []
+    start = datetime.datetime(2025, 8, 1, tzinfo=datetime.timezone.utc)
+    for s in range(n_subjects):
+        subject_id = f'bench{s:04d}'
+        for day in range(n_days):
+            base = start + datetime.timedelta(days=day, hours=rng.randint(8, 20))
+            apps = [(app_id, 'survey', survey_events(rng, app_id)) for app_id in SURVEY_APPS]
+            apps.append(('stroop', 'task', stroop_events(rng, n_trials)))
+            apps.append(('pvt_1min_v1', 'task', pvt_events(rng, n_trials, base.isoformat())))
+            for app_id, app_type, app_events in apps:
+                session_id = str(uuid.uuid4())
+                sessions.append((session_id, subject_id, app_id, app_type, base.isoformat(),
+                                 (base + datetime.timedelta(minutes=3)).isoformat(), 'UTC'))
+                for i, (item_id, payload) in enumerate(app_events):
+                    ts = (base + datetime.timedelta(seconds=2 * i)).isoformat()
+                    events.append((session_id, subject_id, app_id, app_type, i, ts, 'UTC', 'task_trial' if app_type == 'task' else 'survey_item',
+                                   item_id, json.dumps({'item_id': item_id, **payload})))
+    conn.executemany('''
+    INSERT INTO sessions (session_id, subject_id, app_id, app_type, ts_start_utc, ts_end_utc, tz) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', sessions)
+    conn.executemany('''
+    INSERT INTO events (session_id, subject_id, app_id, app_type, event_index, ts_utc, tz, event_type, item_id, payload_json)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', events)
+    conn.commit()
+    conn.close()
+    return len(events)
+
+
+def make_oura_export(data_dir, n_days=30, hr_interval_s=60, seed=0):
+    # Oura-style export folder: heart rate every hr_interval_s plus a few daily CSVs
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    days = pd.date_range('2025-07-01', periods=n_days, freq='D')
+    span = f"{days[0]:%Y-%m-%d}_{days[-1]:%Y-%m-%d}"
+
+    n = n_days * 86400 // hr_interval_s
+    timestamps = days[0].tz_localize('UTC') + pd.to_timedelta(np.arange(n) * hr_interval_s, unit='s')
+    hour = timestamps.hour.to_numpy()
+    asleep = (hour < 7) | (hour >= 23)
+    keep = rng.random(n) < 0.85  # gaps where the ring was off
+    hr = pd.DataFrame({
+        'timestamp': timestamps.strftime('%Y-%m-%dT%H:%M:%S.000+00:00'),
+        'bpm': np.where(asleep, 55, 72) + rng.normal(0, 6, n).round(),
+        'source': np.where(asleep, 'sleep', rng.choice(['awake', 'rest', 'workout'], n, p=[0.8, 0.15, 0.05])),
+    })[keep]
+    hr.to_csv(os.path.join(data_dir, f'heartrate_{span}.csv'), index=False)
+
+    day_strings = days.strftime('%Y-%m-%d')
+    daily = {
+        'dailysleep': {'score': rng.integers(60, 95, n_days)},
+        'dailyreadiness': {'score': rng.integers(55, 95, n_days), 'temperature_deviation': rng.normal(0, 0.3, n_days).round(2)},
+        'dailyactivity': {'score': rng.integers(50, 100, n_days), 'steps': rng.integers(2000, 15000, n_days),
+                          'active_calories': rng.integers(100, 900, n_days)},
+        'dailystress': {'stress_high': rng.integers(0, 10000, n_days), 'recovery_high': rng.integers(0, 10000, n_days)},
+    }
+    for key, columns in daily.items():
+        pd.DataFrame({'id': [uuid.uuid4().hex for _ in range(n_days)], 'day': day_strings, **columns}).to_csv(
+            os.path.join(data_dir, f'{key}_{span}.csv'), index=False)
+    return len(hr)
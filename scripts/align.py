@@ -0,0 +1,195 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from scripts.cohort import oura_exports
+from scripts.parse_database import build_features, load_data
+from wearables.oura.oura import HR_KEY, load_oura_data, read_export
+from wearables.oura.sleep_series import load_sleep_series
+
+# Time-aligned join of session features with wearable features.
+#
+# Every session row (one per survey or task session, as build_features) gets
+#   sleep_*       the last main sleep period that ended before the session (as-of join on
+#                 bedtime_end, within sleep_max_gap_h), from SleepSeries.night_features
+#   hr_<N>h_*     mean, sd and minutes with data of heart rate in the N hours before the session
+#   daily columns the load_oura_data row for the session's local calendar day
+#
+# Everything is keyed per subject and computed for all sessions at once: the sleep join
+# is pandas.merge_asof, and the heart-rate windows are differences of prefix sums over
+# minute samples sorted by (subject, minute), found with two binary searches per
+# session. Cost grows as (sessions + samples) * log(samples), not sessions * samples.
+#
+# The local day of a session comes from its tz when that names a real zone. Sessions
+# logged as UTC or without a tz (the API's default) fall back to the UTC offset Oura
+# recorded for the matched night, so the day lines up with Oura's own `day`.
+#
+#   python -m scripts.align path/to/database.db notebooks/features.csv --oura-root exports/
+
+SUBJECT_SHIFT = 32  # sample keys are subject code << 32 | epoch minute
+
+
+def _epoch_minutes(timestamps):
+    timestamps = pd.to_datetime(timestamps, utc=True)
+    return timestamps.dt.tz_localize(None).to_numpy().astype('datetime64[m]').astype(np.int64)
+
+
+def minute_heart_rate(heart_rate):
+    # (sorted sample keys, subject index, per-minute bpm) from a subject_id/timestamp/bpm frame
+    subjects = pd.Index(heart_rate['subject_id'].unique())
+    codes = subjects.get_indexer(heart_rate['subject_id']).astype(np.int64)
+    bpm = heart_rate['bpm'].to_numpy(dtype=np.float64)
+    keys = (codes << SUBJECT_SHIFT) | _epoch_minutes(heart_rate['timestamp'])
+    valid = ~np.isnan(bpm)
+    keys, bpm = keys[valid], bpm[valid]
+    order = np.argsort(keys, kind='stable')
+    keys, bpm = keys[order], bpm[order]
+    keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    minute_bpm = np.add.reduceat(bpm, first) / counts if len(keys) else bpm
+    return keys, subjects, minute_bpm
+
+
+def heart_rate_windows(subject_ids, minutes, heart_rate, hours=(1, 3, 24)):
+    # {column: array} of heart-rate stats over [minute - N h, minute) for each query
+    keys, subjects, bpm = minute_heart_rate(heart_rate)
+    sums = np.concatenate([[0.0], np.cumsum(bpm)])
+    squares = np.concatenate([[0.0], np.cumsum(bpm * bpm)])
+    codes = subjects.get_indexer(subject_ids).astype(np.int64)
+    known = codes >= 0
+    base = np.where(known, codes, 0) << SUBJECT_SHIFT
+    hi = np.searchsorted(keys, base | minutes)
+
+    columns = {}
+    for n_hours in hours:
+        lo = np.searchsorted(keys, base | np.maximum(minutes - n_hours * 60, 0))
+        n = np.where(known, hi - lo, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (sums[hi] - sums[lo]) / n
+            var = (squares[hi] - squares[lo]) / n - mean * mean
+        columns[f'hr_{n_hours}h_mean'] = np.where(n > 0, mean, np.nan)
+        columns[f'hr_{n_hours}h_sd'] = np.where(n > 1, np.sqrt(np.maximum(var, 0) * n / np.maximum(n - 1, 1)), np.nan)
+        columns[f'hr_{n_hours}h_minutes'] = n
+    return columns
+
+
+def asof_sleep(sessions, nights, max_gap_h=24):
+    # Night features of the last sleep that ended at most max_gap_h before each session,
+    # aligned to sessions' index; nights has subject_id, bedtime_start, bedtime_end (epoch s)
+    left = pd.DataFrame({'subject_id': sessions['subject_id'].to_numpy(), '_t': sessions['_t'].to_numpy(),
+                         '_row': np.arange(len(sessions))}).sort_values('_t', kind='stable')
+    right = nights.rename(columns=lambda col: col if col == 'subject_id' else f'sleep_{col}')
+    right = right.assign(_t=right['sleep_bedtime_end'].astype(np.int64)).sort_values('_t', kind='stable')
+    merged = pd.merge_asof(left, right, on='_t', by='subject_id', direction='backward',
+                           tolerance=int(max_gap_h * 3600), allow_exact_matches=True)
+    merged = merged.sort_values('_row').drop(columns=['subject_id', '_t', '_row'])
+    merged.index = sessions.index
+    return merged
+
+
+def local_timestamps(utc, tz, fallback_offset_min):
+    # Naive local wall-clock times: the row's tz when it is a real zone, otherwise
+    # utc + fallback_offset_min (NaN -> UTC)
+    utc = pd.to_datetime(utc, utc=True)
+    offsets = pd.to_timedelta(pd.Series(fallback_offset_min, index=utc.index).fillna(0), unit='m')
+    local = (utc + offsets).dt.tz_localize(None)
+    zones = pd.Series(tz, index=utc.index)
+    for zone in zones.dropna().unique():
+        if zone in ('UTC', 'Z', ''):
+            continue
+        rows = zones == zone
+        try:
+            local[rows] = utc[rows].dt.tz_convert(zone).dt.tz_localize(None)
+        except Exception:
+            # Not a zone name pandas knows; keep the fallback for these rows
+            continue
+    return local
+
+
+def align_features(sessions, heart_rate=None, nights=None, daily=None, hr_hours=(1, 3, 24),
+                   sleep_max_gap_h=24, sleep_type='long_sleep', daily_offset_days=0):
+    # sessions: subject_id, session_id, session_timestamp (UTC) and tz, plus any features
+    # heart_rate: subject_id, timestamp, bpm     nights: subject_id, bedtime_start, bedtime_end,
+    # utc_offset_min, type and night features    daily: subject_id, day and daily features.
+    # daily_offset_days=-1 joins the previous day instead, e.g. to keep the future out
+    out = sessions.reset_index(drop=True).copy()
+    out['_t'] = _epoch_minutes(out['session_timestamp']) * 60
+
+    offset_min = np.full(len(out), np.nan)
+    if nights is not None and len(nights):
+        if sleep_type is not None:
+            nights = nights[nights['type'] == sleep_type]
+        sleep = asof_sleep(out, nights.drop(columns=['type']), sleep_max_gap_h)
+        offset_min = sleep['sleep_utc_offset_min'].to_numpy(dtype=np.float64)
+        out = pd.concat([out, sleep.drop(columns=['sleep_utc_offset_min'])], axis=1)
+
+    tz = out['tz'] if 'tz' in out else pd.Series(np.nan, index=out.index)
+    out['local_timestamp'] = local_timestamps(out['session_timestamp'], tz, offset_min)
+    out['local_date'] = out['local_timestamp'].dt.normalize()
+
+    if daily is not None and len(daily):
+        daily = daily.assign(day=pd.to_datetime(daily['day']).dt.normalize() - pd.Timedelta(days=daily_offset_days))
+        daily = daily.rename(columns={'day': 'local_date', 'bpm': 'hr_day_bpm',
+                                      'minutes_with_data': 'hr_day_minutes', 'compliance': 'hr_day_compliance'})
+        out = out.merge(daily, on=['subject_id', 'local_date'], how='left')
+
+    if heart_rate is not None and len(heart_rate):
+        windows = heart_rate_windows(out['subject_id'], out['_t'].to_numpy() // 60, heart_rate, hr_hours)
+        out = pd.concat([out, pd.DataFrame(windows, index=out.index)], axis=1)
+    return out.drop(columns=['_t'])
+
+
+def load_wearables(oura_root, subject_ids=None):
+    # heart_rate, nights and daily frames for the per-subject exports under oura_root
+    heart_rate, nights, daily = [], [], []
+    for subject_id, path in oura_exports(oura_root).items():
+        if subject_ids is not None and subject_id not in subject_ids:
+            continue
+        frames = read_export(path, [HR_KEY])
+        if HR_KEY in frames:
+            heart_rate.append(frames[HR_KEY][['timestamp', 'bpm']].assign(subject_id=subject_id))
+            day = load_oura_data(path)
+            daily.append(day.rename_axis('day').reset_index().assign(subject_id=subject_id))
+        try:
+            series = load_sleep_series(path)
+        except FileNotFoundError:
+            continue
+        night = series.nights.set_index('id')[['bedtime_start', 'bedtime_end', 'utc_offset_min']]
+        night = night.join(series.night_features())
+        nights.append(night.reset_index(drop=True).assign(subject_id=subject_id))
+    concat = lambda frames: pd.concat(frames, ignore_index=True) if frames else None
+    return concat(heart_rate), concat(nights), concat(daily)
+
+
+def session_frame(conn, features):
+    # build_features output with the session tz attached
+    tz = pd.read_sql_query('SELECT session_id, tz FROM sessions', conn)
+    if 'subject_id' not in features.columns:
+        features = features.reset_index()
+    return features.drop(columns=['tz'], errors='ignore').merge(tz, on='session_id', how='left')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Join session features with time-aligned Oura features.')
+    parser.add_argument('database')
+    parser.add_argument('output', help='.csv or .parquet')
+    parser.add_argument('--oura-root', required=True, help='folder holding one Oura export per subject: <subject_id>/ or <subject_id>.zip')
+    parser.add_argument('--features', help='session features from scripts.cohort (features.parquet); built from the database if omitted')
+    parser.add_argument('--hr-hours', type=int, nargs='+', default=[1, 3, 24])
+    parser.add_argument('--sleep-max-gap-h', type=float, default=24)
+    parser.add_argument('--previous-day', action='store_true', help="join the previous day's daily features instead of the same day's")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    features = pd.read_parquet(args.features) if args.features else build_features(load_data(conn))
+    sessions = session_frame(conn, features)
+    heart_rate, nights, daily = load_wearables(args.oura_root, set(sessions['subject_id']))
+    aligned = align_features(sessions, heart_rate, nights, daily, args.hr_hours, args.sleep_max_gap_h,
+                             daily_offset_days=-1 if args.previous_day else 0)
+    if os.path.splitext(args.output)[1] == '.parquet':
+        aligned.to_parquet(args.output, index=False)
+    else:
+        aligned.to_csv(args.output, index=False)
+    print(f"{len(aligned)} sessions x {aligned.shape[1]} columns written to {args.output}")
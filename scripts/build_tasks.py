@@ -0,0 +1,207 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import urllib.request
+from urllib.parse import urlparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from src.static_assets import MANIFEST, MANIFEST_VERSION
+
+# Build step for the task pages, served by src.static_assets.PrecompressedStatic:
+#
+#   python -m scripts.build_tasks tasks build/tasks [--fetch]
+#
+# Every file under tasks/ is copied to the same path in the build directory. The scripts
+# and stylesheets the pages load are written once more as assets/<name>.<hash>.<ext> and
+# the pages are rewritten to point there, so a changed file gets a new URL and the old
+# one can be cached forever. That covers /tasks/ files and CDN files (jsPsych, its
+# plugins, uuid, SurveyJS) that have a copy at tasks/vendor/<host>/<path>; --fetch
+# downloads the missing copies first. A CDN file with no copy keeps its CDN URL. A script
+# a page includes twice is kept only the first time.
+#
+# Every output also gets a .gz variant, and a .br variant when the brotli package is
+# installed, whenever that is smaller than the file itself.
+
+VENDOR_DIR = 'vendor'
+ASSETS_DIR = 'assets'
+HASH_LENGTH = 10
+_SCRIPT = re.compile(r'<script\b[^>]*\bsrc="([^"]+)"[^>]*>\s*</script>\s*', re.I)
+_LINK = re.compile(r'<link\b[^>]*\bhref="([^"]+)"[^>]*>', re.I)
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.json': 'application/json',
+}
+
+
+def content_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    return CONTENT_TYPES.get(ext) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def vendor_path(src_dir, url, ext):
+    # Local copy of a CDN URL: tasks/vendor/<host>/<path>, with ext added when the URL
+    # has none (unpkg serves a package's main file at its bare name)
+    parsed = urlparse(url)
+    path = os.path.join(src_dir, VENDOR_DIR, parsed.netloc, *[part for part in parsed.path.split('/') if part])
+    return path if path.endswith(ext) else path + ext
+
+
+def fetch(url, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = response.read()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    logging.info(f"Fetched {url} ({len(data)} bytes) to {path}")
+
+
+def compress(path, data):
+    # Writes the smaller-than-identity variants next to path; returns their codings
+    encodings = []
+    variants = [('gzip', '.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.insert(0, ('br', '.br', lambda: brotli.compress(data, quality=11)))
+    for coding, suffix, fn in variants:
+        compressed = fn()
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            encodings.append(coding)
+    return encodings
+
+
+class _Build:
+    def __init__(self, src_dir, out_dir, fetch_missing):
+        self.src_dir = src_dir
+        self.out_dir = out_dir
+        self.fetch_missing = fetch_missing
+        self.files = {}
+        self.assets = {}  # source URL -> build path (relative to out_dir), or None when it stays as is
+
+    def write(self, rel_path, data, immutable):
+        path = os.path.join(self.out_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.files[rel_path] = {
+            'etag': hashlib.sha256(data).hexdigest()[:16],
+            'content_type': content_type(rel_path),
+            'immutable': immutable,
+            'encodings': compress(path, data),
+        }
+
+    def source(self, url, ext):
+        # Local file for a page's script or stylesheet URL, or None to leave it alone
+        if url.startswith('/tasks/'):
+            path = os.path.join(self.src_dir, *url[len('/tasks/'):].split('/'))
+            return path if os.path.isfile(path) else None
+        if urlparse(url).scheme not in ('http', 'https'):
+            return None
+        path = vendor_path(self.src_dir, url, ext)
+        if not os.path.isfile(path) and self.fetch_missing:
+            try:
+                fetch(url, path)
+            except OSError as e:
+                logging.warning(f"Could not fetch {url}: {e}")
+        return path if os.path.isfile(path) else None
+
+    def asset(self, url, ext):
+        # /tasks/ URL of the hashed copy of url, or None
+        if url not in self.assets:
+            path = self.source(url, ext)
+            if path is None:
+                self.assets[url] = None
+                if not url.startswith('/tasks/'):
+                    logging.warning(f"No local copy of {url}; pages keep loading it from the CDN")
+            else:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                name = os.path.basename(path)
+                name = re.sub(r'[^A-Za-z0-9._-]', '-', name[:-len(ext)] if name.endswith(ext) else name)
+                rel_path = f'{ASSETS_DIR}/{name}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+                self.write(rel_path, data, immutable=True)
+                self.assets[url] = rel_path
+        rel_path = self.assets[url]
+        return f'/tasks/{rel_path}' if rel_path else None
+
+    def page(self, html):
+        seen = set()
+
+        def script(match):
+            url = match.group(1)
+            if url in seen:
+                return ''
+            seen.add(url)
+            new_url = self.asset(url, '.js')
+            return match.group(0).replace(url, new_url) if new_url else match.group(0)
+
+        def stylesheet(match):
+            if 'stylesheet' not in match.group(0).lower():
+                return match.group(0)
+            new_url = self.asset(match.group(1), '.css')
+            return match.group(0).replace(match.group(1), new_url) if new_url else match.group(0)
+
+        return _LINK.sub(stylesheet, _SCRIPT.sub(script, html))
+
+
+def build(src_dir, out_dir, fetch_missing=False):
+    # Builds into a fresh out_dir and returns the manifest
+    tmp_dir = out_dir.rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    builder = _Build(src_dir, tmp_dir, fetch_missing)
+    for root, dirs, names in os.walk(src_dir):
+        dirs[:] = sorted(d for d in dirs if not (root == src_dir and d == VENDOR_DIR))
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, src_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            if name.endswith('.html'):
+                data = builder.page(data.decode('utf-8')).encode('utf-8')
+            builder.write(rel_path, data, immutable=False)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'files': dict(sorted(builder.files.items())),
+        'assets': {url: rel_path for url, rel_path in sorted(builder.assets.items()) if rel_path},
+    }
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return manifest
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Build precompressed, content-hashed task pages for the API to serve.')
+    parser.add_argument('src_dir', help='the tasks/ folder')
+    parser.add_argument('out_dir', help='build folder, e.g. build/tasks (replaced)')
+    parser.add_argument('--fetch', action='store_true', help=f'download CDN scripts and stylesheets missing from <src_dir>/{VENDOR_DIR}/')
+    args = parser.parse_args()
+
+    if brotli is None:
+        logging.warning("brotli is not installed; only gzip variants are written")
+    manifest = build(args.src_dir, args.out_dir, args.fetch)
+    codings = [('gzip', '.gz')] + ([('br', '.br')] if brotli is not None else [])
+    n_bytes = {coding: 0 for coding in ['identity'] + [coding for coding, _ in codings]}
+    for rel_path, info in manifest['files'].items():
+        path = os.path.join(args.out_dir, rel_path)
+        n_bytes['identity'] += os.path.getsize(path)
+        for coding, suffix in codings:
+            n_bytes[coding] += os.path.getsize(path + suffix if coding in info['encodings'] else path)
+    print(f"{len(manifest['files'])} files ({len(manifest['assets'])} hashed assets) written to {args.out_dir}; "
+          f"bytes: {', '.join(f'{coding} {n}' for coding, n in n_bytes.items())}")
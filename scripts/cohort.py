@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from scripts.feature_store import _arrow_safe
+from scripts.parse_database import FEATURE_PARSERS, build_features, load_data
+from wearables.oura.oura import load_oura_data
+
+# Cohort feature extraction, sharded by subject across a process pool.
+#
+# A feature shard is a few subjects: the worker loads their events over its own
+# read-only connection, runs build_features and writes the result as Parquet. Only the
+# path and row count travel back to the driver, so no DataFrame is pickled. Oura exports
+# (one per subject under --oura-root, as <subject_id>/ or <subject_id>.zip) are one task
+# each through load_oura_data and its content-keyed cache.
+#
+# Feature shards are named by a key over their subjects' event count and largest
+# event_id, so a rerun after a failure (or after new data arrives) only recomputes the
+# shards that are missing or stale. The shards are then merged into
+#   <out>/features.parquet    one row per session, as build_features
+#   <out>/oura_daily.parquet  one row per subject and day, as load_oura_data
+#
+#   python -m scripts.cohort path/to/database.db cohort_out --oura-root exports/ --workers 8
+
+# Bump when the features change so shards from older runs are recomputed
+PIPELINE_VERSION = 1
+
+
+def _subject_stats(db_path):
+    # {subject_id: (events, largest event_id, app_ids)} for every subject with events,
+    # hot or archived
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute('''
+        SELECT subject_id, SUM(n), MAX(max_id), GROUP_CONCAT(DISTINCT app_id) FROM (
+            SELECT subject_id, app_id, COUNT(*) AS n, MAX(event_id) AS max_id FROM events
+            WHERE subject_id IS NOT NULL GROUP BY subject_id, app_id
+            UNION ALL
+            SELECT subject_id, app_id, SUM(events_count), MAX(max_event_id) FROM archived_sessions
+            WHERE subject_id IS NOT NULL GROUP BY subject_id, app_id
+        ) GROUP BY subject_id ORDER BY subject_id
+        ''').fetchall()
+    finally:
+        conn.close()
+    return {subject_id: (count, max_id, sorted((app_ids or '').split(','))) for subject_id, count, max_id, app_ids in rows}
+
+
+def plan_shards(stats, subjects_per_shard=1):
+    # [(shard key, subject ids, app ids)] in subject order
+    subject_ids = sorted(stats)
+    shards = []
+    for start in range(0, len(subject_ids), subjects_per_shard):
+        chunk = subject_ids[start:start + subjects_per_shard]
+        raw = json.dumps([PIPELINE_VERSION, [[s, stats[s][0], stats[s][1]] for s in chunk]])
+        app_ids = sorted({app_id for s in chunk for app_id in stats[s][2]})
+        shards.append((hashlib.sha256(raw.encode()).hexdigest()[:16], chunk, app_ids))
+    return shards
+
+
+def _write_parquet(df, path):
+    # Written under a temp name and renamed, so a killed worker never leaves a partial shard
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def feature_shard(db_path, subject_ids, app_ids, path):
+    # Runs in a worker process; returns the number of feature rows written
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        events_df = load_data(conn, subject_ids)
+    finally:
+        conn.close()
+    if any(app_id in FEATURE_PARSERS for app_id in app_ids):
+        features = build_features(events_df, app_ids).reset_index()
+    else:
+        features = pd.DataFrame({'subject_id': pd.Series(dtype=str)})
+    _write_parquet(_arrow_safe(features), path)
+    return len(features)
+
+
+def oura_shard(subject_id, export_path, cache_dir, path):
+    daily = load_oura_data(export_path, cache_dir)
+    daily = daily.set_axis(pd.to_datetime(daily.index), axis=0).rename_axis('day').reset_index()
+    daily.insert(0, 'subject_id', subject_id)
+    _write_parquet(daily, path)
+    return len(daily)
+
+
+def oura_exports(oura_root):
+    # {subject_id: export folder or .zip} under oura_root
+    exports = {}
+    for name in sorted(os.listdir(oura_root)):
+        path = os.path.join(oura_root, name)
+        if os.path.isdir(path):
+            exports[name] = path
+        elif name.endswith('.zip'):
+            exports[name[:-len('.zip')]] = path
+    return exports
+
+
+def _merge(paths, out_path):
+    frames = [pd.read_parquet(path) for path in paths]
+    merged = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    _write_parquet(_arrow_safe(merged), out_path)
+    return len(merged)
+
+
+def _remove_stale(directory, keep):
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if path not in keep:
+            os.remove(path)
+
+
+def run_cohort(db_path, out_dir, oura_root=None, workers=None, subjects_per_shard=1):
+    # Returns {'features': rows, 'oura_daily': rows, 'computed': shards run, 'reused': shards kept};
+    # raises RuntimeError naming the failed shards if any failed, after finishing the rest
+    shard_dir = os.path.join(out_dir, 'shards', 'features')
+    oura_dir = os.path.join(out_dir, 'shards', 'oura')
+    tasks = {}
+    feature_paths = []
+    reused = 0
+    for key, subject_ids, app_ids in plan_shards(_subject_stats(db_path), subjects_per_shard):
+        path = os.path.join(shard_dir, f'shard-{key}.parquet')
+        feature_paths.append(path)
+        if os.path.exists(path):
+            reused += 1
+            continue
+        tasks[f'features {subject_ids[0]}..{subject_ids[-1]}'] = (feature_shard, (db_path, subject_ids, app_ids, path))
+
+    oura_paths = []
+    if oura_root:
+        # load_oura_data's cache makes unchanged exports cheap, so these always run
+        for subject_id, export_path in oura_exports(oura_root).items():
+            path = os.path.join(oura_dir, f'subject_id={subject_id}.parquet')
+            oura_paths.append(path)
+            cache_dir = os.path.join(out_dir, 'oura_cache', subject_id)
+            tasks[f'oura {subject_id}'] = (oura_shard, (subject_id, export_path, cache_dir, path))
+
+    failed = {}
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(fn, *args): name for name, (fn, args) in tasks.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                name = futures[future]
+                try:
+                    rows = future.result()
+                    logging.info(f"[{done}/{len(futures)}] {name}: {rows} rows")
+                except Exception as e:
+                    failed[name] = e
+                    logging.error(f"[{done}/{len(futures)}] {name} failed: {e!r}")
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(tasks)} shards failed ({', '.join(sorted(failed))}); "
+                           f"rerun to retry them, completed shards are kept")
+
+    summary = {'computed': len(tasks), 'reused': reused}
+    summary['features'] = _merge(feature_paths, os.path.join(out_dir, 'features.parquet'))
+    _remove_stale(shard_dir, set(feature_paths))
+    if oura_root:
+        summary['oura_daily'] = _merge(oura_paths, os.path.join(out_dir, 'oura_daily.parquet'))
+        _remove_stale(oura_dir, set(oura_paths))
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Extract session and Oura features for a cohort in parallel.')
+    parser.add_argument('database')
+    parser.add_argument('out_dir')
+    parser.add_argument('--oura-root', help='folder holding one Oura export per subject: <subject_id>/ or <subject_id>.zip')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--subjects-per-shard', type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        summary = run_cohort(args.database, args.out_dir, args.oura_root, args.workers, args.subjects_per_shard)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print(json.dumps(summary))
@@ -0,0 +1,37 @@
+import argparse
+import os
+
+from src.export import EXPORT_TABLES, FORMATS, DEFAULT_BATCH_SIZE, export_chunks
+from src.shards import ShardLayout
+
+# Same streams as GET /export, written straight to a file:
+# python -m scripts.export_data path/to/database.db events.parquet --table events --format parquet
+# The database may also be a sharded layout directory (src/shards.py), e.g. data/shards
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream events or sessions out of the database.')
+    parser.add_argument('database', help='database file or sharded layout directory')
+    parser.add_argument('output')
+    parser.add_argument('--table', choices=list(EXPORT_TABLES), default='events')
+    parser.add_argument('--format', choices=list(FORMATS), help='defaults to the output file extension')
+    parser.add_argument('--subject-id')
+    parser.add_argument('--app-id')
+    parser.add_argument('--ts-from', help='inclusive lower bound on ts_utc (events) or ts_start_utc (sessions)')
+    parser.add_argument('--ts-to', help='exclusive upper bound')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or {ext: name for name, (_, ext) in FORMATS.items()}.get(os.path.splitext(args.output)[1][1:], 'ndjson')
+    layout = ShardLayout.load(args.database) if os.path.isdir(args.database) else ShardLayout.single(args.database)
+    # A subject's rows are all in its own shard
+    paths = [layout.path_of(args.subject_id)] if args.subject_id else layout.paths
+    chunks = export_chunks(paths, args.table, fmt, args.batch_size,
+                           subject_id=args.subject_id, app_id=args.app_id, ts_from=args.ts_from, ts_to=args.ts_to)
+    n_bytes = 0
+    tmp_path = args.output + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            n_bytes += len(chunk)
+    os.replace(tmp_path, args.output)
+    print(f"{args.table}: {n_bytes} bytes of {fmt} written to {args.output}")
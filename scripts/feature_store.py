@@ -0,0 +1,160 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+from scripts.payloads import decode_payloads
+from scripts.utils import save_to_parquet
+from src.archive import _safe, archive_paths, new_sessions_query, read_archive_table
+
+# Incremental, partitioned store of decoded event payloads.
+#
+# Layout: <root>/<app_id>/subject_id=<id>/date=<YYYY-MM-DD>/part-<high water mark>.parquet
+# The directory holds the id made path-safe (archive._safe); the subject_id column keeps
+# the id as logged, and readers filter on it.
+# The manifest keeps one high-water mark (largest events.event_id seen) per app_id.
+# A refresh only decodes sessions with events past that mark; a session that gets
+# more events later is written again in a newer part, and readers keep the newest.
+
+ID_COLS = ['subject_id', 'session_id', 'session_timestamp']
+MANIFEST = '_manifest.json'
+SQL_CHUNK = 500
+
+
+def with_archived(events_df, paths, columns=None):
+    # events_df plus the events in the archive files at paths, one row per event_id in event_id order
+    if not paths:
+        return events_df
+    archived = read_archive_table(paths, columns).to_pandas()
+    archived = archived.rename(columns={'payload_json': 'payload'}) if 'payload' in events_df.columns else archived
+    df = pd.concat([archived, events_df], ignore_index=True) if len(events_df) else archived
+    return df.drop_duplicates('event_id', keep='last').sort_values('event_id', kind='stable').reset_index(drop=True)
+
+
+def _arrow_safe(df):
+    # Parquet needs one type per column; nested values become JSON text and
+    # columns mixing types (e.g. survey answers) become strings
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        values = df[col].dropna()
+        if values.map(lambda v: isinstance(v, (dict, list))).any():
+            df[col] = df[col].map(lambda v: json.dumps(v) if isinstance(v, (dict, list)) else v)
+            values = df[col].dropna()
+        if pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty', 'boolean', 'integer', 'floating'):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+class FeatureStore:
+    def __init__(self, root):
+        self.root = root
+        self._manifest_path = os.path.join(root, MANIFEST)
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'high_water': {}}
+
+    def high_water(self, app_id):
+        return self.manifest['high_water'].get(app_id, 0)
+
+    def _save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path)
+
+    def refresh(self, conn, app_ids=None):
+        # Decode and append sessions with new events; returns {app_id: sessions written}
+        if app_ids is None:
+            app_ids = [row[0] for row in conn.execute('''
+            SELECT app_id FROM events WHERE app_id IS NOT NULL
+            UNION SELECT app_id FROM archived_sessions WHERE app_id IS NOT NULL
+            ''')]
+        written = {}
+        for app_id in app_ids:
+            written[app_id] = self._refresh_app(conn, app_id)
+        return written
+
+    def _refresh_app(self, conn, app_id):
+        # Archived sessions count too, so a store built after compaction still picks them up
+        rows = conn.execute(*new_sessions_query(app_id, self.high_water(app_id))).fetchall()
+        if not rows:
+            return 0
+        session_ids = [row[0] for row in rows]
+        new_mark = max(row[1] for row in rows)
+
+        # Whole sessions are reloaded so session_timestamp and the part stay complete
+        chunks = []
+        for start in range(0, len(session_ids), SQL_CHUNK):
+            chunk = session_ids[start:start + SQL_CHUNK]
+            hot = pd.read_sql_query(f'''
+            SELECT event_id, subject_id, session_id, ts_utc, payload_json AS payload FROM events
+            WHERE session_id IN ({','.join('?' * len(chunk))}) ORDER BY event_id
+            ''', conn, params=chunk)
+            archived = archive_paths(conn.cursor(), session_ids=chunk)
+            chunks.append(with_archived(hot, archived, ['event_id', 'subject_id', 'session_id', 'ts_utc', 'payload_json']))
+        events_df = pd.concat(chunks, ignore_index=True).sort_values('event_id')
+        events_df['ts_utc'] = pd.to_datetime(events_df['ts_utc'])
+        events_df['session_timestamp'] = events_df.groupby('session_id')['ts_utc'].transform('first')
+
+        decoded = decode_payloads(events_df, ID_COLS + ['event_id']).reset_index()
+        decoded['subject_id'] = decoded['subject_id'].fillna('unknown')
+        decoded['date'] = decoded['session_timestamp'].dt.strftime('%Y-%m-%d')
+        # Ids that differ only in unsafe characters share a directory, and so one part
+        decoded['subject_dir'] = decoded['subject_id'].map(_safe)
+        for (subject_dir, date), part in decoded.groupby(['subject_dir', 'date']):
+            path = os.path.join(self.root, _safe(app_id), f'subject_id={subject_dir}', f'date={date}',
+                                f'part-{new_mark:012d}.parquet')
+            save_to_parquet(_arrow_safe(part.drop(columns=['date', 'subject_dir'])), path)
+
+        self.manifest['high_water'][app_id] = new_mark
+        self._save_manifest()
+        return len(session_ids)
+
+    def parts(self, app_id, subject_ids=None, date_from=None, date_to=None):
+        # Partition pruning on the directory names; dates are inclusive YYYY-MM-DD strings
+        subject_dirs = None if subject_ids is None else {_safe(subject_id) for subject_id in subject_ids}
+        paths = []
+        for path in glob.glob(os.path.join(self.root, _safe(app_id), 'subject_id=*', 'date=*', 'part-*.parquet')):
+            subject_dir, date_dir = path.split(os.sep)[-3:-1]
+            subject_dir = subject_dir[len('subject_id='):]
+            date = date_dir[len('date='):]
+            if subject_dirs is not None and subject_dir not in subject_dirs:
+                continue
+            if (date_from and date < date_from) or (date_to and date > date_to):
+                continue
+            paths.append(path)
+        return sorted(paths)
+
+    def read(self, app_id, subject_ids=None, date_from=None, date_to=None):
+        # Decoded events for app_id, keeping only the newest part of each session
+        frames = []
+        for path in self.parts(app_id, subject_ids, date_from, date_to):
+            part = pd.read_parquet(path)
+            part['_part'] = os.path.basename(path)
+            frames.append(part)
+        if not frames:
+            return pd.DataFrame(columns=ID_COLS)
+        df = pd.concat(frames, ignore_index=True)
+        if subject_ids is not None:
+            # A directory can hold other ids with the same safe form
+            df = df[df['subject_id'].isin(subject_ids)]
+        newest = df.groupby('session_id')['_part'].transform('max')
+        df = df[df['_part'] == newest].drop(columns=['_part']).sort_values('event_id')
+        return df.drop(columns=['event_id']).set_index(ID_COLS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Append newly logged sessions to the feature store.')
+    parser.add_argument('database')
+    parser.add_argument('root')
+    parser.add_argument('--app-id', action='append', dest='app_ids')
+    args = parser.parse_args()
+    written = FeatureStore(args.root).refresh(sqlite3.connect(args.database), args.app_ids)
+    for app_id, n_sessions in written.items():
+        print(f"{app_id}: {n_sessions} sessions")
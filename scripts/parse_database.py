@@ -2,12 +2,27 @@
 import pandas as pd
 import numpy as np
 import json
+import os
 import ast
 import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
-def load_data(conn):
-    events_df = pd.read_sql_query("SELECT * FROM events", conn)
+from scripts.feature_store import FeatureStore, with_archived
+from scripts.payloads import decode_payloads
+from src.archive import archive_paths
+
+def load_data(conn, subject_ids=None):
+    # subject_ids limits the load to those subjects' events (e.g. one cohort shard);
+    # events of archived sessions are read from their files
+    if subject_ids is None:
+        events_df = pd.read_sql_query("SELECT * FROM events", conn)
+    else:
+        subject_ids = list(subject_ids)
+        events_df = pd.read_sql_query(f"SELECT * FROM events WHERE subject_id IN ({','.join('?' * len(subject_ids))})", conn, params=subject_ids)
+    events_df = with_archived(events_df, archive_paths(conn.cursor(), subject_ids))
+    events_df = events_df.rename(columns={'payload_json': 'payload'})
     events_df['ts_utc'] = pd.to_datetime(events_df['ts_utc'])
     first_timestamps = events_df.groupby('session_id')['ts_utc'].first().reset_index()
     events_df = events_df.merge(first_timestamps, on='session_id', suffixes=('', '_first'))
@@ -15,6 +30,36 @@ def load_data(conn):
     return events_df
 
 
+def load_layout_data(path, subject_ids=None):
+    # load_data over a database file or a sharded layout directory (src/shards.py); the
+    # shards are read at once, each on its own connection, and concatenated in shard order
+    from src.shards import ShardLayout
+    layout = ShardLayout.load(path) if os.path.isdir(path) else ShardLayout.single(path)
+    paths = layout.paths
+    if subject_ids is not None:
+        subject_ids = list(subject_ids)
+        paths = sorted({layout.path_of(subject_id) for subject_id in subject_ids}, key=layout.paths.index) or paths[:1]
+
+    def load(shard_path):
+        conn = sqlite3.connect(f'file:{shard_path}?mode=ro', uri=True)
+        try:
+            return load_data(conn, subject_ids)
+        finally:
+            conn.close()
+    if len(paths) == 1:
+        return load(paths[0])
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        frames = list(executor.map(load, paths))
+    return pd.concat(frames, ignore_index=True)
+
+
+def app_payloads(source, app_id, id_cols):
+    # Decoded payloads for one app, read from a FeatureStore or decoded from a load_data frame
+    if isinstance(source, FeatureStore):
+        return source.read(app_id).reset_index().set_index(id_cols)
+    return decode_payloads(source.query("app_id == @app_id"), id_cols)
+
+
 def parse_survey_data(
         events_df,
         app_id,
@@ -22,9 +67,8 @@ def parse_survey_data(
         id_cols = ['subject_id', 'session_id', 'session_timestamp'],
 ):
 
-    app_df = events_df.query("app_id == @app_id").set_index(id_cols)
     res_df = (
-        app_df['payload'].apply(json.loads).apply(pd.Series)
+        app_payloads(events_df, app_id, id_cols)
         .query("item_id not in @drop_items")
         .reset_index()
         .pivot(index=id_cols, columns='item_id', values='value')
@@ -41,15 +85,15 @@ def parse_pvt(
         trial_level = False
 ):
 
-    app_df = events_df.query("app_id == @app_id").set_index(id_cols)
     res_df = (
-        app_df['payload'].apply(json.loads).apply(pd.Series)
+        app_payloads(events_df, app_id, id_cols)
         .query("phase != 'practice'")[use_items]
     )
+    # Renumber trials 1..n within each session in trial_index order
     res_df["trial_index"] = (
-        res_df.sort_values(["session_id", "trial_index"])
-            .groupby("session_id")
-            .cumcount() + 1
+        res_df.groupby(level="session_id")["trial_index"]
+            .rank(method="first", na_option="bottom")
+            .astype("int64")
     )
     if not trial_level:
         res_df = (
@@ -60,6 +104,37 @@ def parse_pvt(
     return res_df    
 
 
+def score_stroop(res_df, id_cols):
+    # Accuracy, RT, interference and IES per session as grouped aggregations
+    sessions = res_df.groupby(id_cols).size().index
+
+    # keep only real task trials; RT uses correct trials only
+    task_df = res_df.query("phase != 'practice'")
+    rt_correct = task_df[task_df["correct"] == 1]
+
+    acc = task_df.groupby(id_cols + ["congruent"])["correct"].mean().unstack("congruent").reindex(index=sessions, columns=[1, 0])
+    rt = rt_correct.groupby(id_cols + ["congruent"])["rt_ms"].mean().unstack("congruent").reindex(index=sessions, columns=[1, 0])
+
+    results = pd.DataFrame(index=sessions)
+    # accuracy
+    results["acc_overall"] = task_df.groupby(id_cols)["correct"].mean()
+    results["acc_congruent"] = acc[1]
+    results["acc_incongruent"] = acc[0]
+    results["acc_interference"] = results["acc_incongruent"] - results["acc_congruent"]
+
+    # RT (ms)
+    results["rt_mean_congruent"] = rt[1]
+    results["rt_mean_incongruent"] = rt[0]
+    results["rt_interference"] = results["rt_mean_incongruent"] - results["rt_mean_congruent"]
+
+    # IES
+    results["ies_congruent"] = results["rt_mean_congruent"] / results["acc_congruent"]
+    results["ies_incongruent"] = results["rt_mean_incongruent"] / results["acc_incongruent"]
+    results["ies_interference"] = results["ies_incongruent"] - results["ies_congruent"]
+
+    return results.astype(float)
+
+
 def parse_stroop(
         events_df,
         app_id = 'stroop',
@@ -67,40 +142,54 @@ def parse_stroop(
         id_cols = ['subject_id', 'session_id', 'session_timestamp'],
 ):
 
-    app_df = events_df.query("app_id == @app_id").set_index(id_cols)
-    res_df = app_df['payload'].apply(json.loads).apply(pd.Series)
+    res_df = app_payloads(events_df, app_id, id_cols)
     res_df['correct'] = (res_df['key_pressed'] == res_df['expected_key']).astype(int)
     res_df['congruent'] = (res_df['word'].str.lower() == res_df['font_color'].str.lower()).astype(int)
-    
-    def score_stroop(trials_df):
-        # keep only real task, correct trials for RT
-        task_df = trials_df.query("phase != 'practice'")
-        rt_correct = task_df[task_df["correct"] == 1]
-
-        results = {}
-        # accuracy
-        results["acc_overall"] = task_df["correct"].mean()
-        results["acc_congruent"] = task_df.loc[task_df["congruent"]==1,"correct"].mean()
-        results["acc_incongruent"] = task_df.loc[task_df["congruent"]==0,"correct"].mean()
-        results["acc_interference"] = results["acc_incongruent"] - results["acc_congruent"]
-
-        # RT (ms)
-        results["rt_mean_congruent"] = rt_correct.loc[rt_correct["congruent"]==1,"rt_ms"].mean()
-        results["rt_mean_incongruent"] = rt_correct.loc[rt_correct["congruent"]==0,"rt_ms"].mean()
-        results["rt_interference"] = results["rt_mean_incongruent"] - results["rt_mean_congruent"]
-
-        # IES
-        results["ies_congruent"] = results["rt_mean_congruent"] / results["acc_congruent"]
-        results["ies_incongruent"] = results["rt_mean_incongruent"] / results["acc_incongruent"]
-        results["ies_interference"] = results["ies_incongruent"] - results["ies_congruent"]
-
-        return pd.Series(results)
-
-    stroop_scores = (
-        res_df
-        .groupby(id_cols)
-        .apply(score_stroop)
-        .reset_index([1,2])
-    )
 
-    return stroop_scores
\ No newline at end of file
+    stroop_scores = score_stroop(res_df, id_cols).reset_index([1,2])
+
+    return stroop_scores
+
+
+def load_summaries(
+        conn,
+        app_id,
+        id_cols = ['subject_id', 'session_id', 'session_timestamp'],
+):
+    # Scores stored in sessions.summary by /sessions/finish, one row per session; the same
+    # columns as parse_stroop / parse_pvt / parse_survey_data without decoding any events.
+    # session_timestamp is the server's session start rather than the first event's ts_utc
+    df = pd.read_sql_query('''
+    SELECT subject_id, session_id, ts_start_utc AS session_timestamp, summary FROM sessions
+    WHERE app_id = ? AND summary IS NOT NULL ORDER BY ts_start_utc
+    ''', conn, params=[app_id])
+    records, keep = [], []
+    for summary in df['summary']:
+        try:
+            summary = json.loads(summary)
+        except ValueError:
+            summary = None  # legacy /api/session_complete rows hold a Python repr
+        keep.append(isinstance(summary, dict) and 'scores' in summary)
+        if keep[-1]:
+            records.append(summary['scores'])
+    df = df[keep]
+    df['session_timestamp'] = pd.to_datetime(df['session_timestamp'], format='ISO8601', utc=True)
+    index = pd.MultiIndex.from_frame(df[id_cols])
+    return pd.DataFrame.from_records(records, index=index).reset_index([1,2])
+
+
+# Parsers behind build_features, keyed by the app whose events they read
+FEATURE_PARSERS = {
+    'behavioral': lambda events_df: parse_survey_data(events_df, 'behavioral'),
+    'wellbeing': lambda events_df: parse_survey_data(events_df, 'wellbeing'),
+    'daily_core': lambda events_df: parse_survey_data(events_df, 'daily_core'),
+    'pvt_1min_v1': parse_pvt,
+    'stroop': parse_stroop,
+}
+
+
+def build_features(events_df, app_ids=None):
+    # Session-level feature table (notebooks/features.csv); events_df may be a load_data frame or a FeatureStore.
+    # app_ids limits it to the apps that have events, e.g. for a subset of subjects
+    return pd.concat([parse(events_df) for app_id, parse in FEATURE_PARSERS.items()
+                      if app_ids is None or app_id in app_ids], axis=0)
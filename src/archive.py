@@ -0,0 +1,283 @@
+import argparse
+import logging
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+from src.shards import ShardLayout
+
+# pyarrow is imported on first use (_require_pyarrow): it takes longer to import than the
+# whole ingest path, and most requests never read an archive
+pa = pq = None
+
+# Cold tier for events of sessions that closed long ago.
+#
+# The compactor writes all of a closed session's events to one zstd Parquet file under
+#   <root>/<subject_id>/apps/<app_id>/<YYYY-MM-DD of the start>/<session_id>.<max event_id>.parquet
+# then, in one transaction, records the file in archived_sessions, points
+# sessions.session_file_path at it and deletes the rows from events. Events that arrive
+# for an archived session land in events again; once the session is old enough they are
+# merged with the archived ones into a new file and the old file is removed.
+#
+# Readers take the union of both tiers. They read the hot rows before the manifest, so
+# a compaction committing in between can only show a row twice, never hide it; the
+# event_id (never reused) drops the duplicate.
+#
+#   python -m src.archive path/to/database.db data/raw --older-than-days 30
+
+EVENT_COLUMNS = ['event_id', 'session_id', 'subject_id', 'app_id', 'app_type', 'event_index', 'ts_utc', 'tz',
+                 'server_ts', 'event_type', 'item_id', 'payload_json']
+EVENT_TYPES = {'event_id': 'int64', 'event_index': 'int64'}
+_TS_UTC = EVENT_COLUMNS.index('ts_utc')
+COMPRESSION = 'zstd'
+
+
+def _require_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required to read and write event archives")
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def _schema():
+    return pa.schema([(column, pa.type_for_alias(EVENT_TYPES.get(column, 'string'))) for column in EVENT_COLUMNS])
+
+
+def _safe(part):
+    # Client-supplied ids become path components; keep them inside the archive root
+    part = re.sub(r'[^A-Za-z0-9._-]', '_', str(part))
+    return '_' if part in ('', '.', '..') else part
+
+
+def archive_path(root, subject_id, app_id, ts_start_utc, session_id, max_event_id):
+    day = (ts_start_utc or '')[:10] or 'unknown'
+    return os.path.join(root, _safe(subject_id), 'apps', _safe(app_id), _safe(day), f'{_safe(session_id)}.{max_event_id}.parquet')
+
+
+def write_archive(path, rows):
+    # rows are tuples in EVENT_COLUMNS order; written under a temp name and renamed
+    _require_pyarrow()
+    schema = _schema()
+    columns = list(zip(*rows)) if rows else [[] for _ in EVENT_COLUMNS]
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_string(field.type):
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    pq.write_table(pa.Table.from_arrays(arrays, schema=schema), tmp_path, compression=COMPRESSION)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def read_archive_table(paths, columns=None):
+    # One pyarrow Table of the events in the given archive files
+    _require_pyarrow()
+    tables = [pq.read_table(path, columns=columns) for path in paths]
+    if not tables:
+        schema = _schema()
+        return schema.empty_table() if columns is None else pa.schema([schema.field(c) for c in columns]).empty_table()
+    return pa.concat_tables(tables)
+
+
+def read_archive(path, columns=None):
+    # Rows of one archive file as tuples in the order of columns (default EVENT_COLUMNS)
+    columns = columns or EVENT_COLUMNS
+    table = read_archive_table([path], list(dict.fromkeys(columns)))
+    values = {name: table.column(name).to_pylist() for name in table.column_names}
+    return list(zip(*[values[column] for column in columns]))
+
+
+def archived_path_query(session_id):
+    return 'SELECT path FROM archived_sessions WHERE session_id = ?', (session_id,)
+
+
+def archived_path(cur, session_id):
+    row = cur.execute(*archived_path_query(session_id)).fetchone()
+    return row[0] if row else None
+
+
+def archive_paths_query(subject_ids=None, app_id=None, session_ids=None, ts_from=None, ts_to=None):
+    conditions, params = [], []
+    for column, values in (('subject_id', subject_ids), ('session_id', session_ids)):
+        if values is not None:
+            values = list(values)
+            conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    for condition, value in (('app_id = ?', app_id), ('max_ts_utc >= ?', ts_from), ('min_ts_utc < ?', ts_to)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'SELECT path FROM archived_sessions{where} ORDER BY min_event_id', params
+
+
+def archive_paths(cur, subject_ids=None, app_id=None, session_ids=None, ts_from=None, ts_to=None):
+    # Archive files matching the filters, oldest events first; ts bounds prune on the
+    # files' event time range
+    return [row[0] for row in cur.execute(*archive_paths_query(subject_ids, app_id, session_ids, ts_from, ts_to)).fetchall()]
+
+
+def session_events_query(session_id, columns=('item_id', 'payload_json')):
+    return f'''
+    SELECT event_index, event_id, {', '.join(columns)} FROM events WHERE session_id = ? ORDER BY event_index, event_id
+    ''', (session_id,)
+
+
+def session_events(cur, session_id, columns=('item_id', 'payload_json')):
+    # One session's events from both tiers as tuples of columns, ordered by (event_index, event_id)
+    hot = cur.execute(*session_events_query(session_id, columns)).fetchall()
+    path = archived_path(cur, session_id)
+    if path is None:
+        return [row[2:] for row in hot]
+    hot_ids = {row[1] for row in hot}
+    rows = [row for row in read_archive(path, ['event_index', 'event_id', *columns]) if row[1] not in hot_ids] + hot
+    # SQLite sorts NULL event indexes first
+    rows.sort(key=lambda row: (row[0] is not None, row[0] or 0, row[1]))
+    return [row[2:] for row in rows]
+
+
+def new_sessions_query(app_id, after_event_id):
+    # (session_id, largest event_id) of app_id's sessions with events past after_event_id in
+    # either tier; archived sessions count by their largest archived event_id
+    return '''
+    SELECT session_id, MAX(max_id) FROM (
+        SELECT session_id, MAX(event_id) AS max_id FROM events WHERE app_id = ? AND event_id > ? GROUP BY session_id
+        UNION ALL
+        SELECT session_id, max_event_id FROM archived_sessions WHERE app_id = ? AND max_event_id > ?
+    ) GROUP BY session_id
+    ''', (app_id, after_event_id, app_id, after_event_id)
+
+
+def closed_sessions_query(closed_before, limit=None):
+    query = '''
+    SELECT session_id FROM sessions
+    WHERE ts_end_utc < ? AND EXISTS (SELECT 1 FROM events e WHERE e.session_id = sessions.session_id)
+    ORDER BY ts_end_utc
+    '''
+    params = [closed_before]
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return query, params
+
+
+def closed_sessions(cur, closed_before, limit=None):
+    # Sessions that ended before closed_before and still have events in the hot table
+    return [row[0] for row in cur.execute(*closed_sessions_query(closed_before, limit)).fetchall()]
+
+
+def cutoff(older_than_days):
+    # ts_end_utc bound for sessions closed more than older_than_days ago, in the API's format
+    return (datetime.utcnow() - timedelta(days=older_than_days)).isoformat() + 'Z'
+
+
+class SessionArchive:
+    """One session's move to the cold tier: write the file, commit, then clean up.
+
+    ``prepare`` reads and writes files only; ``commit(cur)`` is the database half and
+    runs inside the caller's transaction (e.g. on the ingest writer). After it commits
+    call ``finish``; if it fails call ``discard``.
+    """
+
+    def __init__(self, session_id, path, previous_path, rows, n_hot, max_hot_id, n_bytes, session):
+        self.session_id = session_id
+        self.path = path
+        self.previous_path = previous_path
+        self.rows = rows
+        self.n_hot = n_hot
+        self.max_hot_id = max_hot_id
+        self.n_bytes = n_bytes
+        self.subject_id, self.app_id, self.ts_start_utc = session
+
+    @classmethod
+    def prepare(cls, cur, root, session_id):
+        # Returns None when the session has no hot events left
+        session = cur.execute('SELECT subject_id, app_id, ts_start_utc FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        hot = cur.execute(f'SELECT {", ".join(EVENT_COLUMNS)} FROM events WHERE session_id = ? ORDER BY event_id', (session_id,)).fetchall()
+        if session is None or not hot:
+            return None
+        previous_path = archived_path(cur, session_id)
+        hot_ids = {row[0] for row in hot}
+        archived = [row for row in read_archive(previous_path) if row[0] not in hot_ids] if previous_path else []
+        rows = sorted(archived + hot, key=lambda row: row[0])
+        path = archive_path(root, *session, session_id, rows[-1][0])
+        n_bytes = write_archive(path, rows)
+        return cls(session_id, path, previous_path, rows, len(hot), hot[-1][0], n_bytes, session)
+
+    def commit(self, cur):
+        # Event ids only grow and events are never updated, so the rows up to max_hot_id
+        # are exactly the ones written to the file unless another compactor got there first
+        cur.execute('DELETE FROM events WHERE session_id = ? AND event_id <= ?', (self.session_id, self.max_hot_id))
+        if cur.rowcount != self.n_hot:
+            raise RuntimeError(f"Session {self.session_id} changed while it was being archived")
+        ts = [row[_TS_UTC] for row in self.rows if row[_TS_UTC] is not None]
+        cur.execute('''
+        INSERT OR REPLACE INTO archived_sessions (session_id, subject_id, app_id, ts_start_utc, path, events_count,
+            min_event_id, max_event_id, min_ts_utc, max_ts_utc, bytes, archived_at_utc)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (self.session_id, self.subject_id, self.app_id, self.ts_start_utc, self.path, len(self.rows),
+              self.rows[0][0], self.rows[-1][0], min(ts) if ts else None, max(ts) if ts else None,
+              self.n_bytes, datetime.utcnow().isoformat() + 'Z'))
+        cur.execute('UPDATE sessions SET session_file_path = ? WHERE session_id = ?', (self.path, self.session_id))
+        return len(self.rows)
+
+    def finish(self):
+        if self.previous_path and self.previous_path != self.path and os.path.exists(self.previous_path):
+            os.remove(self.previous_path)
+
+    def discard(self):
+        if self.path != self.previous_path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def compact(db_path, root, closed_before, limit=None):
+    # Archive sessions closed before closed_before over a direct connection (API stopped
+    # or not compacting); returns (sessions archived, events moved)
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    cur = conn.cursor()
+    n_sessions = n_events = 0
+    try:
+        for session_id in closed_sessions(cur, closed_before, limit):
+            archive = SessionArchive.prepare(cur, root, session_id)
+            if archive is None:
+                continue
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                archive.commit(cur)
+                cur.execute('COMMIT')
+            except Exception as e:
+                cur.execute('ROLLBACK')
+                archive.discard()
+                logging.error(f"Archiving session {session_id} failed: {e}")
+                continue
+            archive.finish()
+            n_sessions += 1
+            n_events += archive.n_hot
+    finally:
+        conn.close()
+    return n_sessions, n_events
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Move the events of long-closed sessions into per-session Parquet archives.')
+    parser.add_argument('database', help='database file or sharded layout directory')
+    parser.add_argument('root', help='archive root, e.g. data/raw')
+    parser.add_argument('--older-than-days', type=float, default=30)
+    parser.add_argument('--limit', type=int, help='archive at most this many sessions')
+    args = parser.parse_args()
+    # Each shard of a layout is compacted in turn, up to --limit sessions each
+    paths = ShardLayout.load(args.database).paths if os.path.isdir(args.database) else [args.database]
+    n_sessions = n_events = 0
+    for path in paths:
+        shard_sessions, shard_events = compact(path, args.root, cutoff(args.older_than_days), args.limit)
+        n_sessions += shard_sessions
+        n_events += shard_events
+    print(f"{n_sessions} sessions ({n_events} events) archived under {args.root}")
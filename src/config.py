@@ -0,0 +1,57 @@
+import os
+from dataclasses import dataclass, fields
+from typing import Optional
+
+# Settings for create_app. Each field can be set with the environment variable of the
+# same name in upper case (DB_PATH, SPEECH_ROOT, ...); paths default to folders in the repo.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROLES = ('all', 'ingest')
+
+
+@dataclass
+class Config:
+    db_path: str = os.path.join(REPO_ROOT, 'data', 'database.db')
+    # Sharded storage (src/shards.py): when shard_dir is set it replaces db_path, and a new
+    # layout there gets shard_count shards
+    shard_dir: Optional[str] = None
+    shard_count: int = 4
+    shard_read_pool_size: int = 4
+    speech_root: str = os.path.join(REPO_ROOT, 'data', 'raw')
+    tasks_dir: str = os.path.join(REPO_ROOT, 'tasks')
+    tasks_build_dir: str = os.path.join(REPO_ROOT, 'build', 'tasks')
+    tasks_page_max_age_s: int = 600
+    # 'ingest' serves sessions, events, uploads, due tasks, /health and /metrics only: no task
+    # pages, listings, /wide or /export, and no archiver
+    app_role: str = 'all'
+    ingest_max_batch_size: int = 256
+    ingest_max_latency_ms: float = 5
+    ingest_max_queue_size: int = 10000
+    session_cache_size: int = 10000
+    session_cache_ttl_s: float = 6 * 3600
+    # How often schema edits are looked for; 0 leaves them to POST /apps/reload
+    item_registry_reload_s: float = 5
+    # Per-event log lines per second; 0 silences them
+    log_events_per_s: float = 10
+    # Archive tier (src/archive.py); archive_after_days=0 keeps every event in SQLite
+    archive_root: Optional[str] = None  # defaults to speech_root
+    archive_after_days: float = 0
+    archive_interval_s: float = 3600
+    archive_batch_size: int = 500
+
+    def __post_init__(self):
+        if self.app_role not in ROLES:
+            raise ValueError(f"app_role must be one of {', '.join(ROLES)}, not '{self.app_role}'")
+        if self.archive_root is None:
+            self.archive_root = self.speech_root
+
+    @classmethod
+    def from_env(cls, environ=None, **overrides):
+        environ = os.environ if environ is None else environ
+        values = {}
+        for field in fields(cls):
+            value = environ.get(field.name.upper())
+            if value is not None:
+                values[field.name] = value if field.default is None or isinstance(field.default, str) else type(field.default)(value)
+        values.update(overrides)
+        return cls(**values)
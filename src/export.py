@@ -0,0 +1,231 @@
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import closing
+
+from src.archive import EVENT_COLUMNS, EVENT_TYPES, archive_paths, read_archive
+
+# Streaming export of events and sessions.
+#
+# Rows come off a dedicated read-only connection with fetchmany(), so at most one
+# batch is in memory at a time, and each batch is encoded and handed on before the
+# next is read. Both tables are walked in primary-key order, so the scan needs no sort.
+# Parquet gets one row group per batch; Arrow is the IPC stream format. Events of
+# archived sessions (src/archive.py) come first, file by file, then the hot table.
+# A sharded database (src/shards.py) is read by one thread per shard at once and the
+# batches are encoded in the order they arrive, so rows are ordered within a shard only.
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Imported by the first Parquet or Arrow export (_require_pyarrow), not at startup
+pa = pq = None
+
+# table: (select without WHERE, ORDER BY, arrow types of the columns)
+EXPORT_TABLES = {
+    'events': (
+        f"SELECT {', '.join(EVENT_COLUMNS)} FROM events",
+        'event_id',
+        EVENT_TYPES,
+    ),
+    'sessions': (
+        'SELECT session_id, subject_id, app_id, app_type, app_version, ts_start_utc, ts_end_utc, tz, '
+        'device_info, meta_json, summary, events_count, server_ts FROM sessions',
+        'rowid',
+        {'app_version': 'int64', 'events_count': 'int64'},
+    ),
+}
+# The time filter applies to the event time or the session start
+TIME_COLUMNS = {'events': 'ts_utc', 'sessions': 'ts_start_utc'}
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def export_query(table, subject_id=None, app_id=None, ts_from=None, ts_to=None):
+    select, order_by, _ = EXPORT_TABLES[table]
+    conditions, params = [], []
+    for condition, value in (('subject_id = ?', subject_id), ('app_id = ?', app_id),
+                             (f'{TIME_COLUMNS[table]} >= ?', ts_from), (f'{TIME_COLUMNS[table]} < ?', ts_to)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'{select}{where} ORDER BY {order_by}', params
+
+
+def archived_batches(cur, batch_size, subject_id=None, app_id=None, ts_from=None, ts_to=None):
+    # Rows of archived events matching the export filters, in batches
+    paths = archive_paths(cur, None if subject_id is None else [subject_id], app_id, ts_from=ts_from, ts_to=ts_to)
+    ts_index = EVENT_COLUMNS.index('ts_utc')
+    batch = []
+    for path in paths:
+        for row in read_archive(path):
+            ts = row[ts_index]
+            if (ts_from is not None and (ts is None or ts < ts_from)) or (ts_to is not None and (ts is None or ts >= ts_to)):
+                continue
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def iter_batches(db_path, table, batch_size=DEFAULT_BATCH_SIZE, **filters):
+    # (column names, rows) per batch; one read transaction, so the export is a consistent snapshot
+    query, params = export_query(table, **filters)
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+    try:
+        conn.execute('BEGIN')
+        if table == 'events':
+            for rows in archived_batches(conn.cursor(), batch_size, **filters):
+                yield EVENT_COLUMNS, rows
+        cur = conn.execute(query, params)
+        columns = [column[0] for column in cur.description]
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield columns, rows
+    finally:
+        conn.close()
+
+
+_DONE = object()
+
+
+def shard_batches(db_paths, table, batch_size=DEFAULT_BATCH_SIZE, **filters):
+    # iter_batches of every database, read concurrently; each is its own snapshot
+    if len(db_paths) == 1:
+        yield from iter_batches(db_paths[0], table, batch_size, **filters)
+        return
+    # A couple of batches per shard in flight bounds memory as in the single-file case
+    out = queue.Queue(maxsize=2 * len(db_paths))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(path):
+        error = None
+        try:
+            with closing(iter_batches(path, table, batch_size, **filters)) as batches:
+                for batch in batches:
+                    if not put(batch):
+                        return
+        except Exception as e:
+            error = e
+        put((_DONE, error))
+
+    threads = [threading.Thread(target=read, args=(path,), name='export-reader', daemon=True) for path in db_paths]
+    for thread in threads:
+        thread.start()
+    try:
+        remaining = len(threads)
+        while remaining:
+            item = out.get()
+            if item[0] is _DONE:
+                remaining -= 1
+                if item[1] is not None:
+                    raise item[1]
+                continue
+            yield item
+    finally:
+        # Stops the readers when the consumer goes away early (e.g. the client disconnects)
+        stop.set()
+
+
+def ndjson_chunks(batches):
+    for columns, rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows).encode()
+
+
+class _Sink:
+    # Write-only file object whose contents are taken after every batch
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _require_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for Parquet and Arrow exports")
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def _schema(table):
+    select, _, types = EXPORT_TABLES[table]
+    columns = [column.strip() for column in select[len('SELECT '):select.index(' FROM ')].split(',')]
+    return pa.schema([(column, pa.type_for_alias(types.get(column, 'string'))) for column in columns])
+
+
+def _record_batch(schema, rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_string(field.type):
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def arrow_chunks(table, batches, fmt):
+    # Parquet or Arrow IPC bytes, emitted batch by batch
+    _require_pyarrow()
+    schema = _schema(table)
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema) if fmt == 'parquet' else pa.ipc.new_stream(sink, schema)
+    for _, rows in batches:
+        batch = _record_batch(schema, rows)
+        if fmt == 'parquet':
+            writer.write_batch(batch, row_group_size=len(rows))
+        else:
+            writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_chunks(db_paths, table, fmt, batch_size=DEFAULT_BATCH_SIZE, **filters):
+    # Encoded bytes of the whole export, one chunk per batch; db_paths is a database file
+    # or the list of a sharded layout's files
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table '{table}'")
+    if fmt != 'ndjson':
+        _require_pyarrow()
+    batches = shard_batches([db_paths] if isinstance(db_paths, str) else list(db_paths), table, batch_size, **filters)
+    if fmt == 'ndjson':
+        return ndjson_chunks(batches)
+    return arrow_chunks(table, batches, fmt)
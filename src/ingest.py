@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+
+class IngestQueueFull(Exception):
+    """Raised when the write queue stays full for longer than the submit timeout."""
+
+
+class IngestWriter:
+    """Single writer thread that owns the SQLite write connection.
+
+    Handlers submit callables that take a cursor; the writer runs them in
+    arrival order and group-commits up to ``max_batch_size`` of them in one
+    transaction, waiting at most ``max_latency_ms`` for a batch to fill.
+    Each callable runs inside its own savepoint, so one failing write does not
+    abort the rest of the batch. The awaiting handler is resumed once the
+    transaction holding its write has committed.
+
+    ``on_commit(batch_size, execute_s, commit_s)``, if given, is called from the
+    writer thread after every committed batch.
+    """
+
+    def __init__(self, db_path, max_batch_size=256, max_latency_ms=5, max_queue_size=10000, submit_timeout_s=2.0, on_commit=None):
+        self.db_path = db_path
+        self.on_commit = on_commit
+        self.max_batch_size = max_batch_size
+        self.max_latency_s = max_latency_ms / 1000
+        self.submit_timeout_s = submit_timeout_s
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        # Drain everything already queued, then exit the writer thread
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    async def submit(self, fn):
+        # Enqueue fn(cursor) and wait for the commit that includes it
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        deadline = time.monotonic() + self.submit_timeout_s
+        while True:
+            try:
+                self._queue.put_nowait((fn, loop, future))
+                break
+            except queue.Full:
+                # Backpressure: hold the caller instead of growing the queue without bound
+                if time.monotonic() >= deadline:
+                    raise IngestQueueFull(f"ingest queue full ({self._queue.maxsize} pending writes)")
+                await asyncio.sleep(0.005)
+        return await future
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        cursor = conn.cursor()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency_s
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(cursor, batch)
+        conn.close()
+
+    def _commit_batch(self, cursor, batch):
+        outcomes = []
+        timings = None
+        start = time.perf_counter()
+        try:
+            cursor.execute('BEGIN')
+            for fn, _, _ in batch:
+                cursor.execute('SAVEPOINT ingest_item')
+                try:
+                    outcomes.append((fn(cursor), None))
+                    cursor.execute('RELEASE ingest_item')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO ingest_item')
+                    cursor.execute('RELEASE ingest_item')
+                    outcomes.append((None, e))
+            executed = time.perf_counter()
+            cursor.execute('COMMIT')
+            timings = (executed - start, time.perf_counter() - executed)
+        except sqlite3.Error as e:
+            logging.error(f"Ingest batch of {len(batch)} writes failed: {e}")
+            if cursor.connection.in_transaction:
+                cursor.execute('ROLLBACK')
+            outcomes = [(None, e)] * len(batch)
+        if timings is not None and self.on_commit is not None:
+            try:
+                self.on_commit(len(batch), *timings)
+            except Exception as e:
+                logging.warning(f"Ingest on_commit hook failed: {e}")
+
+        for (_, loop, future), (result, error) in zip(batch, outcomes):
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                # The submitting event loop has already shut down
+                pass
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
@@ -1,17 +1,236 @@
-# Item registry listing allowed item_id values per app_id
-item_registry = {
-    "demo_all_inputs_v1": [
-        "mood_happiness_1to5",
-        "mood_sadness_1to5",
-        "attention_focus_1to5"
-    ],
-    "nback_v2": [
-        "nback_trial__rt",
-        "nback_trial__correct"
-    ]
-    # Add more app_id and item_id lists as needed
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+
+# Registry of the items each app may log, with a payload validator compiled per item.
+#
+# Schemas are merged from three sources, later ones winning per (app_id, app_version):
+#   experiment_LLM/library.json  library entries, keyed by their id (e.g. survey.daily_core.v1)
+#   src/app_schemas.json         the apps served from tasks/
+#   apps.schema_json             per-deployment overrides, edited in the database
+#
+# A schema is {"strict": bool, "items": {item_id: {payload field: field spec}}}, where a
+# field spec has a type (number, integer, string, boolean, any) and optionally min, max,
+# enum, nullable and required. An item_id ending in '#' matches ids with a numeric suffix
+# (stroop_trial_# matches stroop_trial_12). Strict apps reject item ids they do not list;
+# apps without any schema are accepted as before.
+# An app_schemas.json entry may also name the library entry it implements (library_id),
+# which src/schedule.py uses to match sessions to scheduled tasks.
+#
+# check_for_changes() fingerprints the sources and recompiles them when they change, so
+# schema edits take effect without a restart; src/main.py calls it every
+# item_registry_reload_s from a background task. Lookups only read the compiled schemas.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIBRARY_PATH = os.path.join(REPO_ROOT, 'experiment_LLM', 'library.json')
+DEFAULTS_PATH = os.path.join(REPO_ROOT, 'src', 'app_schemas.json')
+
+_VERSION_SUFFIX = re.compile(r'\.v(\d+)$')
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        raise ValueError
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError
+    return value
+
+
+def _to_integer(value):
+    number = _to_number(value)
+    if not number.is_integer():
+        raise ValueError
+    return int(number)
+
+
+def _to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ('true', 'false', '0', '1'):
+        return value.lower() in ('true', '1')
+    raise ValueError
+
+
+def _to_string(value):
+    if not isinstance(value, str):
+        raise ValueError
+    return value
+
+
+# Form posts send numbers as strings, so numeric types accept numeric text
+_CONVERTERS = {
+    'number': _to_number,
+    'integer': _to_integer,
+    'boolean': _to_boolean,
+    'string': _to_string,
+    'any': lambda value: value,
 }
 
-# Function to check if an item_id is valid for a given app_id
-def is_valid_item(app_id: str, item_id: str) -> bool:
-    return item_id in item_registry.get(app_id, [])
+
+def _compile_field(name, spec):
+    kind = spec.get('type', 'any')
+    convert = _CONVERTERS[kind]
+    nullable = spec.get('nullable', False)
+    required = spec.get('required', True)
+    low, high = spec.get('min'), spec.get('max')
+    allowed = frozenset(convert(value) for value in spec['enum']) if 'enum' in spec else None
+
+    def check(payload):
+        if name not in payload:
+            return f"missing '{name}'" if required else None
+        value = payload[name]
+        if value is None:
+            return None if nullable else f"'{name}' may not be null"
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            return f"'{name}' must be {kind}"
+        if allowed is not None and value not in allowed:
+            return f"'{name}' must be one of {sorted(allowed, key=str)}"
+        if (low is not None and value < low) or (high is not None and value > high):
+            return f"'{name}' must be between {low} and {high}"
+        return None
+    return check
+
+
+def _compile_item(fields):
+    checks = tuple(_compile_field(name, spec) for name, spec in fields.items())
+
+    def validate(payload):
+        for check in checks:
+            error = check(payload)
+            if error:
+                return error
+        return None
+    return validate
+
+
+class AppSchema:
+    __slots__ = ('strict', 'item_ids', 'validators')
+
+    def __init__(self, schema):
+        if isinstance(schema, list):
+            # Plain list of item ids, no payload checks
+            schema = {'items': {item_id: {} for item_id in schema}}
+        self.strict = schema.get('strict', True)
+        self.validators = {item_id: _compile_item(fields) for item_id, fields in schema.get('items', {}).items()}
+        self.item_ids = frozenset(self.validators)
+
+    def validator(self, item_id):
+        validator = self.validators.get(item_id)
+        if validator is None and item_id[-1:].isdigit():
+            validator = self.validators.get(item_id.rstrip('0123456789') + '#')
+        return validator
+
+
+def library_schemas(library):
+    # {(library id, version): schema} for the surveys in library.json; tasks only declare
+    # session-level metrics there, so their trial events are not restricted
+    schemas = {}
+    for section in ('surveys', 'cognition'):
+        for entry in library.get(section, []):
+            match = _VERSION_SUFFIX.search(entry['id'])
+            version = int(match.group(1)) if match else 1
+            items = {}
+            scale = entry.get('scale')
+            for item in entry.get('items', []):
+                items[item['id']] = {'value': {'type': 'integer', 'min': scale['min'], 'max': scale['max']}} if scale else {}
+            for field in entry.get('fields', []):
+                items[field['id']] = {'value': {'type': field.get('type', 'any'), 'nullable': field.get('nullable', False)}}
+            schemas[(entry['id'], version)] = {'strict': bool(items), 'items': items}
+    return schemas
+
+
+class ItemRegistry:
+    def __init__(self, conn, library_path=LIBRARY_PATH, defaults_path=DEFAULTS_PATH):
+        self.conn = conn
+        self.library_path = library_path
+        self.defaults_path = defaults_path
+        # (schemas, latest version per app_id), swapped as one so a reload never shows half of each
+        self._compiled = ({}, {})
+        self._fingerprint = None
+        self._warned = set()
+        self.reload()
+
+    def _db_rows(self, cur=None):
+        return (cur or self.conn).execute('SELECT app_id, app_version, schema_json FROM apps WHERE schema_json IS NOT NULL ORDER BY app_id, app_version').fetchall()
+
+    def _file_stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _current_fingerprint(self, rows):
+        raw = json.dumps([self._file_stamp(self.library_path), self._file_stamp(self.defaults_path), rows])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def reload(self, cur=None):
+        # Recompile every schema, reading apps through cur (default: the registry's connection);
+        # returns the number of (app_id, app_version) entries
+        sources = {}
+        if os.path.exists(self.library_path):
+            with open(self.library_path) as f:
+                sources.update(library_schemas(json.load(f)))
+        if os.path.exists(self.defaults_path):
+            with open(self.defaults_path) as f:
+                for app_id, schema in json.load(f).items():
+                    sources[(app_id, schema.get('app_version', 1))] = schema
+        rows = self._db_rows(cur)
+        for app_id, app_version, schema_json in rows:
+            try:
+                sources[(app_id, app_version or 1)] = json.loads(schema_json)
+            except ValueError:
+                logging.warning(f"Ignoring malformed apps.schema_json for app_id '{app_id}'")
+
+        schemas, latest = {}, {}
+        for (app_id, app_version), schema in sources.items():
+            try:
+                schemas[(app_id, app_version)] = AppSchema(schema)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                logging.warning(f"Ignoring invalid schema for app_id '{app_id}' v{app_version}: {e}")
+                continue
+            latest[app_id] = max(latest.get(app_id, app_version), app_version)
+        self._compiled = schemas, latest
+        self._fingerprint = self._current_fingerprint(rows)
+        logging.info(f"Item registry loaded {len(schemas)} app schemas")
+        return len(schemas)
+
+    def check_for_changes(self, cur=None):
+        # Reload if a source changed since the last load; True if it did. Blocking (a
+        # query and two stats), so the server runs it in a worker thread
+        if self._current_fingerprint(self._db_rows(cur)) == self._fingerprint:
+            return False
+        self.reload(cur)
+        return True
+
+    def schema(self, app_id, app_version=None):
+        schemas, latest = self._compiled
+        if app_version is None or (app_id, app_version) not in schemas:
+            app_version = latest.get(app_id)
+        return schemas.get((app_id, app_version))
+
+    def validate(self, app_id, app_version, item_id, payload):
+        # None if the event is acceptable, otherwise the reason it is not
+        schema = self.schema(app_id, app_version)
+        if schema is None:
+            if app_id not in self._warned:
+                self._warned.add(app_id)
+                logging.warning(f"No item schema for app_id '{app_id}'; its events are not validated")
+            return None
+        validator = schema.validator(item_id)
+        if validator is None:
+            return f"Unknown item_id '{item_id}' for app_id '{app_id}'" if schema.strict else None
+        error = validator(payload)
+        return f"Invalid payload for item_id '{item_id}': {error}" if error else None
+
+    def is_valid_item(self, app_id, item_id):
+        schema = self.schema(app_id)
+        return schema is not None and schema.validator(item_id) is not None
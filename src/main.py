@@ -1,80 +1,316 @@
-from fastapi import FastAPI, HTTPException, Request, File, UploadFile, Form, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Request, File, UploadFile, Form, Header, Query
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import sqlite3
 from fastapi.staticfiles import StaticFiles
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime
 import os
+import time
+import asyncio
 import uuid
-from fastapi.responses import JSONResponse
-import pandas as pd
-from src.item_registry import is_valid_item
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from src.config import Config
+from src.item_registry import ItemRegistry
+from src.ingest import IngestQueueFull
+from src.session_cache import SessionCache, SessionState
+from src.session_summary import new_summary, summary_dict
+from src.shards import ShardLayout, ShardedStore
+from src.migrations import hot_queries as storage_queries
+from src.wide_table import fold_session, invalidate_session, pending_sessions, read_wide_rows, decode_payload
+from src.uploads import UploadStore, UploadOffsetMismatch, write_chunks, read_upload_file, remove_files
+from src.pagination import KeysetPage, InvalidCursor, keyset_page, keyset_query, merge_pages, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.export import FORMATS, DEFAULT_BATCH_SIZE, export_chunks
+from src.archive import SessionArchive, session_events, closed_sessions, cutoff
+from src.schedule import TS_FORMAT, library_apps, completed_by, mark_done, due_slots, next_slot, utc_key
+from src.metrics import Registry, MetricsMiddleware, SampledLog, CONTENT_TYPE
+from src.static_assets import PrecompressedStatic, MANIFEST as STATIC_MANIFEST
 import logging
-from fastapi_pagination import Page, paginate
-from fastapi_pagination.paginator import paginate as custom_paginate
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = FastAPI()
-
-db_path = '/Users/guhansundar/Documents/GuData/ObjectiveSubjectiveHealth/data/database.db'
-
-# Database setup
-conn = sqlite3.connect(db_path, check_same_thread=False)
-cursor = conn.cursor()
-
-# Create tables if they don't exist
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS events (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    subject_id TEXT,
-    session_id TEXT,
-    app_id TEXT,
-    app_type TEXT,
-    event_type TEXT,
-    event_index INTEGER,
-    ts_utc TEXT,
-    tz TEXT,
-    payload TEXT,
-    server_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS sessions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    subject_id TEXT,
-    session_id TEXT,
-    app_id TEXT,
-    app_type TEXT,
-    started_ts_utc TEXT,
-    ended_ts_utc TEXT,
-    tz TEXT,
-    summary TEXT,
-    events_count INTEGER,
-    session_file_path TEXT,
-    server_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS assets (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    subject_id TEXT,
-    session_id TEXT,
-    modality TEXT,
-    subtype TEXT,
-    ts_utc TEXT,
-    tz TEXT,
-    path TEXT,
-    meta_json TEXT,
-    server_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-''')
-
-conn.commit()
+# Importing this module only defines the routes. create_app(config) builds the app; the
+# databases are opened and migrated and the ingest writers created when it starts up:
+#   uvicorn src.main:create_app --factory
+router = APIRouter()  # sessions, events, uploads, due tasks, /health and /metrics
+analytics = APIRouter()  # listings, /wide and /export; left out of ingest-only workers
+
+# Metrics exposed at /metrics; the gauges read their values only when scraped
+metrics = Registry()
+request_seconds = metrics.histogram('http_request_duration_seconds', 'Request latency by route', ['method', 'route'])
+responses_total = metrics.counter('http_responses_total', 'Responses by route and status code', ['method', 'route', 'status'])
+db_seconds = metrics.histogram('db_query_duration_seconds', 'Time spent in SQLite statements by operation', ['op'])
+ingest_execute_seconds = metrics.histogram('ingest_batch_execute_seconds', 'Time to run the writes of a group-commit batch')
+ingest_commit_seconds = metrics.histogram('ingest_batch_commit_seconds', 'Time to COMMIT a group-commit batch')
+ingest_batch_size = metrics.histogram('ingest_batch_size', 'Writes per group-commit batch', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+wide_rows_returned = metrics.histogram('wide_rows_returned', 'Rows returned by GET /wide', buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000))
+archived_sessions_total = metrics.counter('archived_sessions_total', 'Sessions whose events moved to the archive tier')
+archived_events_total = metrics.counter('archived_events_total', 'Events moved to the archive tier')
+metrics.gauge('ingest_queue_depth', 'Writes waiting for the ingest writers', lambda: store.depth)
+metrics.gauge('session_cache_sessions', 'Sessions held in the session cache', lambda: len(session_cache))
+metrics.counter_callback('session_cache_hits_total', 'Session cache hits', lambda: session_cache.hits)
+metrics.counter_callback('session_cache_misses_total', 'Session cache misses', lambda: session_cache.misses)
+metrics.gauge('session_cache_hit_ratio', 'Session cache hits over lookups since startup',
+              lambda: session_cache.hits / max(1, session_cache.hits + session_cache.misses))
+metrics.counter_callback('log_records_suppressed_total', 'Per-event log records dropped by sampling', lambda: event_log.suppressed)
+
+SESSION_LOOKUP = 'SELECT subject_id, app_id, app_type, app_version, ts_end_utc FROM sessions WHERE session_id = ?'
+ASSET_BY_SHA256 = "SELECT id, path FROM assets WHERE json_extract(meta_json, '$.sha256') = ? ORDER BY id LIMIT 1"
+# Listings: (select without WHERE, key columns)
+LISTINGS = {
+    'subjects': ('SELECT subject_id, created_at_utc, demographics_json, meta_json FROM subjects', ['subject_id']),
+    'sessions': ('SELECT session_id, subject_id, app_id, app_version, ts_start_utc, ts_end_utc, tz, device_info, meta_json FROM sessions',
+                 ['ts_start_utc', 'session_id']),
+    'apps': ('SELECT app_id, app_type, app_version, schema_json FROM apps', ['app_id']),
+}
+
+def session_filters(subject_id=None, app_id=None, ts_from=None, ts_to=None):
+    filters = []
+    if subject_id:
+        filters.append(('subject_id = ?', subject_id))
+    if app_id:
+        filters.append(('app_id = ?', app_id))
+    if ts_from:
+        filters.append(('ts_start_utc >= ?', ts_from))
+    if ts_to:
+        filters.append(('ts_start_utc < ?', ts_to))
+    return filters
+
+def hot_queries():
+    # The storage modules' hot queries plus the API's lookups and listing pages, checked
+    # for full scans on every shard at startup (and by tests/test_query_plans.py)
+    queries = storage_queries()
+    queries['session_lookup'] = (SESSION_LOOKUP, ('s',))
+    queries['asset_by_sha256'] = (ASSET_BY_SHA256, ('0' * 64,))
+    for name in ('subjects', 'apps'):
+        select, key_cols = LISTINGS[name]
+        queries[f'{name}_page'] = keyset_query(select, key_cols, key=['k'])
+    # /sessions pages for each combination of filters, first pages included except the
+    # unfiltered one, which reads its rows off the start of an index
+    select, key_cols = LISTINGS['sessions']
+    ts = '2025-01-01T00:00:00Z'
+    for subject_id in (None, 'subj'):
+        for app_id in (None, 'app'):
+            for ts_range in ((None, None), (ts, ts)):
+                filters = session_filters(subject_id, app_id, *ts_range)
+                label = 'sessions_page' + ''.join(part for part, value in (('_subject', subject_id), ('_app', app_id), ('_range', ts_range[0])) if value)
+                queries[label] = keyset_query(select, key_cols, filters, key=[ts, 's'])
+                if filters:
+                    queries[f'{label}_first'] = keyset_query(select, key_cols, filters)
+    return queries
+
+# Per-process services, set by start_services() when the app starts; one app runs per process
+config = None
+store = None
+session_cache = None
+uploads = None
+item_registry = None
+event_log = None
+library_app_ids = None
+archiver_task = None
+registry_task = None
+
+def start_services(app_config):
+    global config, store, session_cache, uploads, item_registry, event_log, library_app_ids
+    config = app_config
+    event_log = SampledLog(config.log_events_per_s)
+
+    # Database setup (src/shards.py): config.db_path, or the shard databases under
+    # config.shard_dir, each created or upgraded in place and checked for full scans.
+    # Each shard has read connections and a write-behind ingest writer: one thread that
+    # group-commits the writes queued for that shard
+    layout = ShardLayout.open(config.shard_dir, config.shard_count) if config.shard_dir else ShardLayout.single(config.db_path)
+    store = ShardedStore(
+        layout,
+        pool_size=config.shard_read_pool_size,
+        queries=hot_queries(),
+        max_batch_size=config.ingest_max_batch_size,
+        max_latency_ms=config.ingest_max_latency_ms,
+        max_queue_size=config.ingest_max_queue_size,
+        on_commit=lambda size, execute_s, commit_s: (ingest_batch_size.observe(size), ingest_execute_seconds.observe(execute_s), ingest_commit_seconds.observe(commit_s)),
+    )
+
+    # Hot session state for the /events path: metadata plus the event indexes already logged
+    session_cache = SessionCache(max_sessions=config.session_cache_size, ttl_s=config.session_cache_ttl_s)
+
+    # Speech recordings; in-progress uploads are assembled under <speech_root>/.uploads
+    uploads = UploadStore(config.speech_root)
+
+    # Allowed items and compiled payload validators per app; run_registry_checks picks up schema edits
+    item_registry = ItemRegistry(store.home.conn)
+
+    # Served app -> the library entries its sessions complete in the due-task index
+    library_app_ids = library_apps()
+
+def stop_services():
+    global archiver_task, registry_task
+    for task in (archiver_task, registry_task):
+        if task is not None:
+            task.cancel()
+    archiver_task = registry_task = None
+    store.close()
+
+@asynccontextmanager
+async def lifespan(app):
+    global archiver_task, registry_task
+    start_services(app.state.config)
+    loop = asyncio.get_running_loop()
+    if config.app_role == 'all' and config.archive_after_days > 0:
+        archiver_task = loop.create_task(run_archiver())
+    if config.item_registry_reload_s > 0:
+        registry_task = loop.create_task(run_registry_checks())
+    try:
+        yield
+    finally:
+        stop_services()
+
+def create_app(app_config=None):
+    # app_config defaults to Config.from_env()
+    app_config = app_config or Config.from_env()
+    app = FastAPI(lifespan=lifespan)
+    app.state.config = app_config
+    app.add_middleware(MetricsMiddleware, latency=request_seconds, responses=responses_total)
+    app.include_router(router)
+    if app_config.app_role == 'all':
+        app.include_router(analytics)
+        # Serve the task pages from the scripts/build_tasks.py output when there is one (hashed,
+        # precompressed assets with long-lived caching), otherwise straight from the tasks directory
+        if os.path.exists(os.path.join(app_config.tasks_build_dir, STATIC_MANIFEST)):
+            app.mount("/tasks", PrecompressedStatic(app_config.tasks_build_dir, page_max_age_s=app_config.tasks_page_max_age_s), name="tasks")
+        else:
+            app.mount("/tasks", StaticFiles(directory=app_config.tasks_dir), name="tasks")
+    return app
+
+async def submit_write(subject_id, fn):
+    # Queue fn(cursor) on the writer of the subject's shard and wait for its commit
+    return await submit_to(store.for_subject(subject_id), fn)
+
+async def submit_to(shard, fn):
+    try:
+        return await shard.writer.submit(fn)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+def timed(op, fn):
+    # Wrap a write so the time its statements take on the writer thread is recorded under op
+    observe = db_seconds.labels(op).observe
+    def run(cur):
+        start = time.perf_counter()
+        try:
+            return fn(cur)
+        finally:
+            observe(time.perf_counter() - start)
+    return run
+
+def read_session(cur, session_id):
+    # The session's SessionState from one shard, or None if it is not there; replays the
+    # stored events (archived ones are read from Parquet) into the seen indexes and summary
+    row = cur.execute(SESSION_LOOKUP, (session_id,)).fetchone()
+    if not row:
+        return None
+    subject_id, app_id, app_type, app_version, ts_end_utc = row
+    summary = new_summary(app_id, app_type)
+    event_indexes = []
+    for event_index, item_id, payload_json in session_events(cur, session_id, ('event_index', 'item_id', 'payload_json')):
+        if event_index is not None:
+            event_indexes.append(event_index)
+        summary.add(item_id, decode_payload(payload_json))
+    return SessionState(subject_id, app_id, app_type, event_indexes, finished=ts_end_utc is not None,
+                        app_version=app_version, summary=summary)
+
+async def resolve_session(session_id):
+    # Serve from the cache; on a miss each shard is read in a worker thread until one has the session
+    state = session_cache.get(session_id)
+    if state is None:
+        with db_seconds.labels('session_lookup').time():
+            for shard in store.shards:
+                state = await run_in_threadpool(with_read_conn, shard, read_session, session_id)
+                if state is not None:
+                    break
+            else:
+                return None
+        state = session_cache.setdefault(session_id, state)
+    return state
+
+def complete_slot(cur, session_id, subject_id, app_id, ts_end_utc):
+    # Mark the scheduled task this session fulfils as done (src/schedule.py)
+    row = cur.execute('SELECT ts_start_utc FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+    if row and row[0] and ts_end_utc:
+        mark_done(cur, subject_id, completed_by(app_id, library_app_ids), row[0], ts_end_utc, session_id)
+
+async def update_summaries(states):
+    # Events logged after a session finished: rewrite its stored summary and drop its
+    # wide row, which is rebuilt on the next read
+    by_shard = {}
+    for session_id, state in states.items():
+        by_shard.setdefault(store.for_subject(state.subject_id), []).append((json.dumps(summary_dict(state.summary)), session_id))
+
+    def write(summaries):
+        def run(cur):
+            cur.executemany('UPDATE sessions SET summary = ? WHERE session_id = ?', summaries)
+            for _, session_id in summaries:
+                invalidate_session(cur, session_id)
+        return run
+    await asyncio.gather(*[submit_to(shard, write(summaries)) for shard, summaries in by_shard.items()])
+
+# Tiered storage: the events of sessions closed more than config.archive_after_days ago
+# move to per-session Parquet files under config.archive_root; readers see both tiers
+def with_read_conn(shard, fn, *args):
+    # Runs fn(cursor, *args) on one of the shard's pooled connections, for reads off the event loop
+    with shard.pool.connection() as read_conn:
+        return fn(read_conn.cursor(), *args)
+
+async def archive_closed_sessions(limit=None):
+    # One compaction pass over every shard: files are written off the event loop and
+    # each session's delete and manifest update commit through its shard's ingest writer
+    archived = 0
+    for shard in store.shards:
+        archived += await archive_shard(shard, limit)
+    return archived
+
+async def archive_shard(shard, limit=None):
+    session_ids = await run_in_threadpool(with_read_conn, shard, closed_sessions, cutoff(config.archive_after_days), limit)
+    archived = 0
+    for session_id in session_ids:
+        archive = await run_in_threadpool(with_read_conn, shard, SessionArchive.prepare, config.archive_root, session_id)
+        if archive is None:
+            continue
+        try:
+            await submit_to(shard, timed('archive_commit', archive.commit))
+        except Exception as e:
+            await run_in_threadpool(archive.discard)
+            logging.error(f"Archiving session {session_id} failed: {e}")
+            continue
+        await run_in_threadpool(archive.finish)
+        archived_sessions_total.inc()
+        archived_events_total.inc(archive.n_hot)
+        archived += 1
+    return archived
+
+async def run_archiver():
+    while True:
+        archived = 0
+        try:
+            archived = await archive_closed_sessions(config.archive_batch_size)
+            if archived:
+                logging.info(f"Archived {archived} closed sessions to {config.archive_root}")
+        except Exception as e:
+            logging.error(f"Archive pass failed: {e}")
+        # A full batch means more are waiting; keep going without the pause
+        await asyncio.sleep(0 if archived >= config.archive_batch_size else config.archive_interval_s)
+
+async def run_registry_checks():
+    # Schema edits (apps.schema_json, the schema files) are picked up here, off the event loop,
+    # so validating an event only reads the compiled schemas
+    while True:
+        await asyncio.sleep(config.item_registry_reload_s)
+        try:
+            await run_in_threadpool(with_read_conn, store.home, item_registry.check_for_changes)
+        except Exception as e:
+            logging.error(f"Item registry check failed: {e}")
 
 # Models
 class LogEvent(BaseModel):
@@ -104,6 +340,7 @@ class SessionStart(BaseModel):
     subject_id: str
     app_id: str
     app_type: str = Field(..., pattern='^(survey|task)$')
+    app_version: Optional[int] = None
     tz: Optional[str] = None
     device_info: Optional[str] = None
     session_meta: Optional[dict] = None
@@ -122,7 +359,7 @@ class SessionFinish(BaseModel):
     ts_end_utc: str
 
 # Endpoints
-@app.get("/")
+@router.get("/")
 async def read_root():
     return {"message": "Welcome to the FastAPI application!"}
 
@@ -134,68 +371,159 @@ class StartBody(BaseModel):
     device_info: Optional[str] = None
     session_meta: Optional[dict] = None
 
-@app.post("/start-survey")
+@router.post("/start-survey")
 async def start_survey(body: StartBody):
     # Back-compat shim that calls /sessions/start
     return await start_session(SessionStart(**body.dict()))
 
-@app.post("/api/log")
+@router.post("/api/log")
 async def legacy_log_event(event: LogEvent):
     # For legacy callers that still send subject/app fields, write into current events schema
     try:
         # Resolve session metadata if present
-        cursor.execute('SELECT subject_id, app_id, app_type FROM sessions WHERE session_id = ?', (event.session_id,))
-        row = cursor.fetchone()
-        subject_id, app_id, app_type = (row if row else (None, None, None))
+        state = await resolve_session(event.session_id)
+        subject_id, app_id, app_type = (state.subject_id, state.app_id, state.app_type) if state else (event.subject_id, event.app_id, event.app_type)
         tz_val = event.tz or 'UTC'
-        payload_text = json.dumps(event.payload_json)
-        cursor.execute('''
-        INSERT INTO events (subject_id, session_id, app_id, app_type, event_type, event_index, ts_utc, tz, payload)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (subject_id, event.session_id, app_id, app_type, event.event_type, event.event_index, event.ts_utc, tz_val, payload_text))
-        conn.commit()
+        server_ts = datetime.utcnow().isoformat() + 'Z'
+        item_id = str(event.payload.get('item_id', ''))
+        payload_text = json.dumps(event.payload)
+        def write(cur):
+            cur.execute('''
+            INSERT INTO events (subject_id, session_id, app_id, app_type, event_type, event_index, ts_utc, tz, server_ts, item_id, payload_json)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (subject_id, event.session_id, app_id, app_type, event.event_type, event.event_index, event.ts_utc, tz_val, server_ts, item_id, payload_text))
+            if state and state.finished:
+                invalidate_session(cur, event.session_id)
+
+        await submit_write(subject_id, write)
+        if state:
+            state.mark_event(event.event_index)
+            state.summary.add(item_id, event.payload)
+            if state.finished:
+                await update_summaries({event.session_id: state})
         return {"status": "success"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/session_complete")
+@router.post("/api/session_complete")
 async def session_complete(session: SessionComplete):
     try:
-        session_file_path = f"/data/raw/{session.subject_id}/apps/{session.app_id}/{session.started_ts_utc[:10]}/{session.session_id}.json"
-        cursor.execute('''
-        INSERT INTO sessions (subject_id, session_id, app_id, app_type, started_ts_utc, ended_ts_utc, tz, summary, events_count, session_file_path)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (session.subject_id, session.session_id, session.app_id, session.app_type, session.started_ts_utc, session.ended_ts_utc, session.tz, str(session.summary), session.events_count, session_file_path))
-        conn.commit()
+        # session_file_path is set by the archiver once the events are written out
+        def write(cur):
+            cur.execute('''
+            INSERT INTO sessions (subject_id, session_id, app_id, app_type, ts_start_utc, ts_end_utc, tz, summary, events_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                ts_end_utc = excluded.ts_end_utc, summary = excluded.summary, events_count = excluded.events_count
+            ''', (session.subject_id, session.session_id, session.app_id, session.app_type, session.started_ts_utc, session.ended_ts_utc, session.tz, str(session.summary), session.events_count))
+            complete_slot(cur, session.session_id, session.subject_id, session.app_id, session.ended_ts_utc)
+        await submit_write(session.subject_id, write)
         return {"status": "success"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/upload-speech")
-async def upload_speech(subject_id: str = Form(...), session_id: str = Form(...), prompt_id: str = Form(...), speechFile: UploadFile = File(...)):
-    # Define the directory path
-    directory_path = f"/Users/guhansundar/Documents/GuData/ObjectiveSubjectiveHealth/data/raw/{subject_id}/speech/{datetime.utcnow().strftime('%Y-%m-%d')}"
-    os.makedirs(directory_path, exist_ok=True)
-
-    # Define the file path
-    file_location = f"{directory_path}/{prompt_id}_{datetime.utcnow().strftime('%H%M%S')}_{speechFile.filename}"
-    with open(file_location, "wb") as file:
-        file.write(await speechFile.read())
+async def store_speech(tmp_path, sha256, size, subject_id, session_id, prompt_id, filename):
+    # Move a complete upload into place (or drop it if the same bytes are already stored
+    # for a subject of the same shard) and record the asset
+    shard = store.for_subject(subject_id)
+    existing = shard.cursor.execute(ASSET_BY_SHA256, (sha256,)).fetchone()
+    meta = {"sha256": sha256, "size": size, "filename": filename}
+    if existing and await run_in_threadpool(os.path.exists, existing[1]):
+        await run_in_threadpool(os.remove, tmp_path)
+        file_location = existing[1]
+        meta["duplicate_of"] = existing[0]
+    else:
+        directory_path = f"{config.speech_root}/{subject_id}/speech/{datetime.utcnow().strftime('%Y-%m-%d')}"
+        file_location = f"{directory_path}/{prompt_id}_{datetime.utcnow().strftime('%H%M%S')}_{os.path.basename(filename)}"
+        await run_in_threadpool(os.makedirs, directory_path, exist_ok=True)
+        await run_in_threadpool(os.replace, tmp_path, file_location)
+
+    # Log the upload event to the database; a prompt with a library id completes its scheduled task
+    ts = datetime.utcnow().isoformat()
+    def write(cur):
+        cur.execute('''
+        INSERT INTO assets (subject_id, session_id, modality, subtype, ts_utc, tz, path, meta_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (subject_id, session_id, "speech", prompt_id, ts, "UTC", file_location, json.dumps(meta)))
+        mark_done(cur, subject_id, completed_by(prompt_id, library_app_ids), ts, ts, session_id)
+    await submit_to(shard, write)
+    return file_location, meta
 
-    # Log the upload event to the database
-    cursor.execute('''
-    INSERT INTO assets (subject_id, session_id, modality, subtype, ts_utc, tz, path, meta_json)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (subject_id, session_id, "speech", prompt_id, datetime.utcnow().isoformat(), "UTC", file_location, "{}"))
-    conn.commit()
+@router.post("/upload-speech")
+async def upload_speech(subject_id: str = Form(...), session_id: str = Form(...), prompt_id: str = Form(...), speechFile: UploadFile = File(...)):
+    # Stream the recording to a temp file on the same filesystem in chunks, hashing as it goes
+    await run_in_threadpool(os.makedirs, uploads.partial_dir, exist_ok=True)
+    tmp_path = os.path.join(uploads.partial_dir, f"{uuid.uuid4().hex}.tmp")
+    try:
+        hasher, size = await write_chunks(read_upload_file(speechFile), tmp_path)
+        file_location, meta = await store_speech(tmp_path, hasher.hexdigest(), size, subject_id, session_id, prompt_id, speechFile.filename)
+    finally:
+        await run_in_threadpool(remove_files, tmp_path)
 
-    return {"info": f"file '{speechFile.filename}' saved at '{file_location}'"}
+    return {"info": f"file '{speechFile.filename}' saved at '{file_location}'", **meta}
 
-# Mount the tasks directory to serve static files
-app.mount("/tasks", StaticFiles(directory="/Users/guhansundar/Documents/GuData/ObjectiveSubjectiveHealth/tasks"), name="tasks")
+# Resumable uploads: POST /uploads, then PATCH chunks with an Upload-Offset header.
+# After a dropped connection, GET /uploads/{id} returns the offset to continue from.
+class UploadStart(BaseModel):
+    subject_id: str
+    session_id: str
+    prompt_id: str
+    filename: str
+    size: Optional[int] = Field(None, ge=0)
+
+async def upload_status(upload_id):
+    status = await uploads.status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return status
+
+async def finish_upload(upload_id, status):
+    tmp_path, sha256, size = await uploads.finish(upload_id)
+    try:
+        file_location, meta = await store_speech(tmp_path, sha256, size, status["subject_id"], status["session_id"], status["prompt_id"], status["filename"])
+    finally:
+        await uploads.discard(upload_id)
+    return {"upload_id": upload_id, "offset": size, "complete": True, "path": file_location, **meta}
+
+@router.post("/uploads")
+async def start_upload(body: UploadStart):
+    upload_id = await uploads.create(body.dict())
+    return {"upload_id": upload_id, "offset": 0}
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    status = await upload_status(upload_id)
+    return JSONResponse({"upload_id": upload_id, "offset": status["offset"], "size": status["size"]}, headers={"Upload-Offset": str(status["offset"])})
+
+@router.patch("/uploads/{upload_id}")
+async def append_upload(upload_id: str, request: Request, upload_offset: int = Header(..., alias="Upload-Offset")):
+    await upload_status(upload_id)
+    async with uploads.lock(upload_id):
+        status = await upload_status(upload_id)
+        try:
+            offset = await uploads.append(upload_id, upload_offset, request.stream())
+        except UploadOffsetMismatch as e:
+            raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+        if status["size"] is not None and offset > status["size"]:
+            await uploads.discard(upload_id)
+            raise HTTPException(status_code=400, detail=f"Upload exceeds its declared size of {status['size']} bytes")
+        if status["size"] is not None and offset == status["size"]:
+            return await finish_upload(upload_id, status)
+    return JSONResponse({"upload_id": upload_id, "offset": offset, "complete": False}, headers={"Upload-Offset": str(offset)})
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str):
+    # Only needed when the size was not declared up front
+    await upload_status(upload_id)
+    async with uploads.lock(upload_id):
+        return await finish_upload(upload_id, await upload_status(upload_id))
 
 # Ensure the session complete event includes a summary of the survey
-@app.post("/submit-survey")
+@router.post("/submit-survey")
 async def submit_survey(form_data: Dict[str, Any]):
     event_index = 0
     for key, value in form_data.items():
@@ -220,7 +548,7 @@ async def submit_survey(form_data: Dict[str, Any]):
     )
     return {"status": "success"} 
 
-@app.post("/sessions/start")
+@router.post("/sessions/start")
 async def start_session(session: SessionStart):
     # Generate values
     session_id = str(uuid.uuid4())
@@ -229,144 +557,299 @@ async def start_session(session: SessionStart):
 
     # Insert session row (subject table optional; do best-effort insert if exists)
     try:
-        cursor.execute('''
-        INSERT INTO sessions (subject_id, session_id, app_id, app_type, started_ts_utc, tz, summary, events_count)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (session.subject_id, session_id, session.app_id, session.app_type, ts_start, tz_val, None, None))
-        conn.commit()
+        meta_json = json.dumps(session.session_meta) if session.session_meta is not None else None
+        await submit_write(session.subject_id, timed('session_insert', lambda cur: cur.execute('''
+        INSERT INTO sessions (subject_id, session_id, app_id, app_type, app_version, ts_start_utc, tz, device_info, meta_json, summary, events_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (session.subject_id, session_id, session.app_id, session.app_type, session.app_version, ts_start, tz_val, session.device_info, meta_json, None, None))))
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Failed to create session: {e}")
+    session_cache.put(session_id, SessionState(session.subject_id, session.app_id, session.app_type, app_version=session.app_version,
+                                               summary=new_summary(session.app_id, session.app_type)))
 
     logging.info(f"Session started: subject_id={session.subject_id}, session_id={session_id}, app_id={session.app_id}")
     return {"session_id": session_id, "ts_start_utc": ts_start, "tz": tz_val}
 
-@app.post("/events")
+@router.post("/events")
 async def log_event(event: EventLog, idempotency_key: Optional[str] = Header(None)):
     # Resolve session metadata
-    cursor.execute('SELECT subject_id, app_id, app_type FROM sessions WHERE session_id = ?', (event.session_id,))
-    row = cursor.fetchone()
-    if not row:
+    state = await resolve_session(event.session_id)
+    if not state:
         raise HTTPException(status_code=404, detail="Session not found")
-    subject_id, app_id, app_type = row
+    subject_id, app_id, app_type = state.subject_id, state.app_id, state.app_type
+
+    # Reject items the app does not define and payloads that fail its validator
+    error = item_registry.validate(app_id, state.app_version, event.item_id, event.payload_json)
+    if error:
+        raise HTTPException(status_code=422, detail=error)
+
+    # Idempotency check against the cached event indexes; marking before the
+    # write makes a concurrent retry of the same event see it as a duplicate
+    was_seen = state.has_event(event.event_index)
+    if idempotency_key and was_seen:
+        event_log(lambda: f"Duplicate event ignored: session_id={event.session_id}, event_index={event.event_index}")
+        return {"status": "duplicate event ignored"}
+    state.mark_event(event.event_index)
+
+    def write(cur):
+        _insert_event(cur, subject_id, app_id, app_type, event)
+        if state.finished:
+            invalidate_session(cur, event.session_id)
 
-    # Best-effort item validation
-    try:
-        if not is_valid_item(app_id, event.item_id):
-            logging.warning(f"Unknown item_id '{event.item_id}' for app_id '{app_id}'")
-    except Exception:
-        pass
-
-    # Idempotency check (simple)
-    if idempotency_key:
-        cursor.execute('''
-        SELECT id FROM events WHERE session_id = ? AND event_index = ?
-        ''', (event.session_id, event.event_index))
-        if cursor.fetchone():
-            logging.info(f"Duplicate event ignored: session_id={event.session_id}, event_index={event.event_index}")
-            return {"status": "duplicate event ignored"}
-
-    server_ts = datetime.utcnow().isoformat() + 'Z'
-    tz_val = event.tz or 'UTC'
     try:
-        cursor.execute('''
-        INSERT INTO events (subject_id, session_id, app_id, app_type, event_type, event_index, ts_utc, tz, payload)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (subject_id, event.session_id, app_id, app_type, event.event_type, event.event_index, event.ts_utc, tz_val, json.dumps({"item_id": event.item_id, **event.payload_json})))
-        conn.commit()
-        logging.info(f"Event logged: session_id={event.session_id}, event_index={event.event_index}, item_id={event.item_id}")
+        await submit_write(subject_id, timed('event_insert', write))
     except sqlite3.IntegrityError as e:
+        # UNIQUE(session_id, event_index) catches duplicates the cache could not see
+        # (e.g. written by another worker process)
+        if idempotency_key:
+            event_log(lambda: f"Duplicate event ignored: session_id={event.session_id}, event_index={event.event_index}")
+            return {"status": "duplicate event ignored"}
+        if not was_seen:
+            state.unmark_event(event.event_index)
         raise HTTPException(status_code=400, detail=f"Event insert failed: {e}")
+    except Exception:
+        if not was_seen:
+            state.unmark_event(event.event_index)
+        raise
+    # Fold into the running summary only once the event is committed
+    state.summary.add(event.item_id, event.payload_json)
+    if state.finished:
+        await update_summaries({event.session_id: state})
+    event_log(lambda: f"Event logged: session_id={event.session_id}, event_index={event.event_index}, item_id={event.item_id}")
     return {"status": "event logged"}
 
-@app.post("/sessions/finish")
+def _insert_event(cur, subject_id, app_id, app_type, event: EventLog):
+    # Stage one event row; the caller owns the commit
+    tz_val = event.tz or 'UTC'
+    server_ts = datetime.utcnow().isoformat() + 'Z'
+    cur.execute('''
+    INSERT INTO events (subject_id, session_id, app_id, app_type, event_type, event_index, ts_utc, tz, server_ts, item_id, payload_json)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (subject_id, event.session_id, app_id, app_type, event.event_type, event.event_index, event.ts_utc, tz_val, server_ts, event.item_id, json.dumps({"item_id": event.item_id, **event.payload_json})))
+
+@router.post("/events/batch")
+async def log_events_batch(events: List[EventLog], idempotency_key: Optional[str] = Header(None)):
+    # Write a buffered batch of events in one transaction, reporting status per item
+    results = [None] * len(events)
+    accepted = []
+    for i, event in enumerate(events):
+        state = await resolve_session(event.session_id)
+        if not state:
+            results[i] = {"event_index": event.event_index, "status": "error", "detail": "Session not found"}
+            continue
+        error = item_registry.validate(state.app_id, state.app_version, event.item_id, event.payload_json)
+        if error:
+            results[i] = {"event_index": event.event_index, "status": "error", "detail": error}
+            continue
+        was_seen = state.has_event(event.event_index)
+        if idempotency_key and was_seen:
+            results[i] = {"event_index": event.event_index, "status": "duplicate event ignored"}
+            continue
+        state.mark_event(event.event_index)
+        accepted.append((i, event, state, was_seen))
+
+    def group_write(group):
+        def run(cur):
+            failed = {}
+            for i, event, state, _ in group:
+                try:
+                    _insert_event(cur, state.subject_id, state.app_id, state.app_type, event)
+                except sqlite3.IntegrityError as e:
+                    failed[i] = f"Event insert failed: {e}"
+            for session_id in {event.session_id for _, event, state, _ in group if state.finished}:
+                invalidate_session(cur, session_id)
+            return failed
+        return timed('event_batch_insert', run)
+
+    # One transaction per shard the batch touches, committed concurrently
+    groups = {}
+    for item in accepted:
+        groups.setdefault(store.for_subject(item[2].subject_id), []).append(item)
+    outcomes = await asyncio.gather(*[submit_to(shard, group_write(group)) for shard, group in groups.items()], return_exceptions=True)
+    failed, shard_errors = {}, {}
+    for group, outcome in zip(groups.values(), outcomes):
+        if not isinstance(outcome, Exception):
+            failed.update(outcome)
+            continue
+        detail = outcome.detail if isinstance(outcome, HTTPException) else f"Batch insert failed: {outcome}"
+        for i, event, state, was_seen in group:
+            shard_errors[i] = detail
+            if not was_seen:
+                state.unmark_event(event.event_index)
+    if groups and len(shard_errors) == len(accepted):
+        # Nothing was written: fail the request as a whole
+        error = next(outcome for outcome in outcomes if isinstance(outcome, Exception))
+        if isinstance(error, sqlite3.Error):
+            raise HTTPException(status_code=500, detail=f"Batch insert failed: {error}")
+        raise error
+
+    for i, event, state, was_seen in accepted:
+        if i in shard_errors:
+            results[i] = {"event_index": event.event_index, "status": "error", "detail": shard_errors[i]}
+        elif i in failed and idempotency_key:
+            results[i] = {"event_index": event.event_index, "status": "duplicate event ignored"}
+        elif i in failed:
+            results[i] = {"event_index": event.event_index, "status": "error", "detail": failed[i]}
+            if not was_seen:
+                state.unmark_event(event.event_index)
+        else:
+            results[i] = {"event_index": event.event_index, "status": "event logged"}
+            state.summary.add(event.item_id, event.payload_json)
+    finished = {event.session_id: state for i, event, state, _ in accepted if state.finished and i not in failed and i not in shard_errors}
+    if finished:
+        await update_summaries(finished)
+
+    logged = sum(1 for r in results if r["status"] == "event logged")
+    event_log(lambda: f"Event batch logged: {logged}/{len(events)} events")
+    return {"status": "batch processed", "logged": logged, "results": results}
+
+@router.post("/sessions/finish")
 async def finish_session(session: SessionFinish):
-    # Check if the session exists
-    cursor.execute('''
-    SELECT session_id FROM sessions WHERE session_id = ?
-    ''', (session.session_id,))
-    result = cursor.fetchone()
-    if not result:
+    # Update the session end time, store the running summary and fold the session into
+    # the wide table; no matching row means the session does not exist
+    try:
+        utc_key(session.ts_end_utc)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ts_end_utc must be an ISO 8601 timestamp")
+    state = await resolve_session(session.session_id)
+    if not state:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Update the session end time
-    cursor.execute('''
-    UPDATE sessions SET ended_ts_utc = ? WHERE session_id = ?
-    ''', (session.ts_end_utc, session.session_id))
-    conn.commit()
+    summary = summary_dict(state.summary)
+    def write(cur):
+        cur.execute('''
+        UPDATE sessions SET ts_end_utc = ?, summary = ? WHERE session_id = ?
+        ''', (session.ts_end_utc, json.dumps(summary), session.session_id))
+        if not cur.rowcount:
+            return False
+        complete_slot(cur, session.session_id, state.subject_id, state.app_id, session.ts_end_utc)
+        return fold_session(cur, session.session_id)
+
+    updated = await submit_write(state.subject_id, timed('session_finish', write))
+    if not updated:
+        raise HTTPException(status_code=404, detail="Session not found")
+    # Only a committed finish makes later events update the stored summary themselves;
+    # events committed while it was in flight are folded in here
+    state.finished = True
+    if summary_dict(state.summary) != summary:
+        await update_summaries({session.session_id: state})
+    session_cache.evict(session.session_id)
     
     # Log the session finish
     logging.info(f"Session finished: session_id={session.session_id}")
-    return {"status": "session finished"}
-
-@app.get("/wide")
-async def get_wide_table(subject_id: str, app_id: str, app_version: Optional[int] = None):
-    # Load events for the subject and app
-    query = '''
-    SELECT e.session_id, e.event_index, e.ts_utc, e.event_type, e.item_id, e.payload_json, s.ts_start_utc, s.ts_end_utc, s.app_id, s.app_version
-    FROM events e
-    JOIN sessions s ON e.session_id = s.session_id
-    WHERE s.subject_id = ? AND s.app_id = ?
-    '''
-    params = [subject_id, app_id]
-    if app_version is not None:
-        query += " AND s.app_version = ?"
-        params.append(app_version)
-    query += " ORDER BY s.ts_start_utc"
-    
-    df = pd.read_sql_query(query, conn, params=params)
-    
-    # Pivot the table
-    if df.empty:
+    return {"status": "session finished", "summary": summary}
+
+@analytics.get("/wide")
+async def get_wide_table(
+    subject_id: str,
+    app_id: str,
+    app_version: Optional[int] = None,
+    columns: Optional[List[str]] = Query(None),
+    ts_from: Optional[str] = None,
+    ts_to: Optional[str] = None,
+):
+    # Fold any finished sessions the materialized table has not seen yet
+    shard = store.for_subject(subject_id)
+    with db_seconds.labels('wide_pending').time():
+        pending = pending_sessions(shard.cursor, subject_id, app_id)
+    if pending:
+        await submit_to(shard, timed('wide_fold', lambda cur: [fold_session(cur, session_id) for session_id in pending]))
+
+    # columns accepts repeated parameters or a comma-separated list of item_id__field names
+    if columns is not None:
+        columns = [col for value in columns for col in value.split(',') if col]
+    with db_seconds.labels('wide_read').time():
+        rows = read_wide_rows(shard.cursor, subject_id, app_id, app_version, columns, ts_from, ts_to)
+    wide_rows_returned.observe(len(rows))
+    if not rows:
         return JSONResponse(content={"message": "No data found"}, status_code=404)
-    
-    df['payload'] = df['payload_json'].apply(lambda x: eval(x))  # Convert JSON string to dict
-    df = df.drop(columns=['payload_json'])
-    
-    # Flatten payload and create wide format
-    payload_df = pd.json_normalize(df['payload'])
-    df = df.drop(columns=['payload'])
-    wide_df = pd.concat([df, payload_df], axis=1)
-    
-    # Create column names with item_id and field name
-    wide_df.columns = [f"{item_id}__{col}" if col not in ['session_id', 'ts_start_utc', 'ts_end_utc', 'app_id', 'app_version'] else col for item_id, col in zip(df['item_id'], wide_df.columns)]
-    
-    # Group by session_id and take the last non-null value for each item_id__field
-    wide_df = wide_df.groupby(['session_id', 'ts_start_utc', 'ts_end_utc', 'app_id', 'app_version']).last().reset_index()
-    
-    # Sort by ts_start_utc
-    wide_df = wide_df.sort_values(by='ts_start_utc')
-    
-    return JSONResponse(content=wide_df.to_dict(orient='records')) 
+    return JSONResponse(content=rows)
 
-@app.get("/health")
+@router.get("/subjects/{subject_id}/due")
+async def get_due_tasks(subject_id: str, at: Optional[str] = None):
+    # What the subject should do now: the scheduled tasks whose window is open (at, default
+    # now), soonest to close first, and the next task to open; served from task_slots
+    try:
+        now = utc_key(at) if at else datetime.utcnow().strftime(TS_FORMAT)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="at must be an ISO 8601 timestamp")
+    shard = store.for_subject(subject_id)
+    with db_seconds.labels('due_slots').time():
+        due = due_slots(shard.cursor, subject_id, now)
+        upcoming = next_slot(shard.cursor, subject_id, now)
+    return {"subject_id": subject_id, "at": now, "due": due, "next": upcoming}
+
+@router.get("/health")
 async def health_check():
-    return {"status": "healthy"} 
-
-@app.get("/subjects", response_model=Page[dict])
-async def list_subjects():
-    cursor.execute('''
-    SELECT subject_id, created_at_utc, demographics_json, meta_json FROM subjects
-    ''')
-    subjects = cursor.fetchall()
-    return paginate([dict(zip([column[0] for column in cursor.description], row)) for row in subjects])
-
-@app.get("/sessions", response_model=Page[dict])
-async def list_sessions(subject_id: Optional[str] = None):
-    query = '''
-    SELECT session_id, subject_id, app_id, app_version, ts_start_utc, ts_end_utc, tz, device_info, meta_json FROM sessions
-    '''
-    params = []
-    if subject_id:
-        query += " WHERE subject_id = ?"
-        params.append(subject_id)
-    cursor.execute(query, params)
-    sessions = cursor.fetchall()
-    return paginate([dict(zip([column[0] for column in cursor.description], row)) for row in sessions])
-
-@app.get("/apps", response_model=Page[dict])
-async def list_apps():
-    cursor.execute('''
-    SELECT app_id, app_type, app_version, schema_json FROM apps
-    ''')
-    apps = cursor.fetchall()
-    return paginate([dict(zip([column[0] for column in cursor.description], row)) for row in apps]) 
\ No newline at end of file
+    # Time a read on every shard's shared connection and a no-op through every writer
+    # queue (queue wait plus an empty group commit); unhealthy if any of them fails
+    try:
+        start = time.perf_counter()
+        for shard in store.shards:
+            shard.cursor.execute('SELECT 1 FROM sessions LIMIT 1').fetchall()
+        read_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        await asyncio.gather(*[submit_to(shard, lambda cur: cur.execute('SELECT 1').fetchall()) for shard in store.shards])
+        write_ms = (time.perf_counter() - start) * 1000
+    except (sqlite3.Error, HTTPException) as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        return JSONResponse(content={"status": "unhealthy", "detail": detail}, status_code=503)
+    return {"status": "healthy", "db_read_ms": round(read_ms, 3), "db_write_ms": round(write_ms, 3), "ingest_queue_depth": store.depth, "shards": len(store)}
+
+@router.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+async def list_page(scope, select, key_cols, filters=(), cursor=None, size=DEFAULT_PAGE_SIZE, page=None, include_total=False, shards=None):
+    # With several shards the page is read from all of them at once and merged; in
+    # OFFSET mode each shard has to supply every row up to the end of the page
+    shards = shards or store.shards
+    try:
+        if len(shards) == 1:
+            return keyset_page(shards[0].cursor, scope, select, key_cols, filters, cursor, size, page, include_total)
+        shard_size, shard_page = (size, None) if cursor else (size * (page or 1), 1)
+        pages = await store.fan_out(keyset_page, scope, select, key_cols, filters, cursor, shard_size, shard_page, include_total, shards=shards)
+        return merge_pages(pages, scope, key_cols, filters, size, None if cursor else page or 1)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Listings page in SQL: pass next_cursor back as ?cursor= for the next page
+@analytics.get("/subjects", response_model=KeysetPage)
+async def list_subjects(cursor: Optional[str] = None, size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        page: Optional[int] = Query(None, ge=1), include_total: bool = False):
+    return await list_page('subjects', *LISTINGS['subjects'], cursor=cursor, size=size, page=page, include_total=include_total)
+
+@analytics.get("/sessions", response_model=KeysetPage)
+async def list_sessions(subject_id: Optional[str] = None, app_id: Optional[str] = None,
+                        ts_from: Optional[str] = None, ts_to: Optional[str] = None,
+                        cursor: Optional[str] = None, size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        page: Optional[int] = Query(None, ge=1), include_total: bool = False):
+    return await list_page('sessions', *LISTINGS['sessions'], session_filters(subject_id, app_id, ts_from, ts_to),
+                           cursor=cursor, size=size, page=page, include_total=include_total,
+                           shards=[store.for_subject(subject_id)] if subject_id else None)
+
+@analytics.get("/apps", response_model=KeysetPage)
+async def list_apps(cursor: Optional[str] = None, size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    page: Optional[int] = Query(None, ge=1), include_total: bool = False):
+    return await list_page('apps', *LISTINGS['apps'], cursor=cursor, size=size, page=page, include_total=include_total, shards=[store.home])
+
+@router.post("/apps/reload")
+async def reload_item_registry():
+    # Recompile the item registry now instead of waiting for the periodic check
+    return {"status": "reloaded", "schemas": await run_in_threadpool(with_read_conn, store.home, item_registry.reload)}
+
+@analytics.get("/export")
+async def export(table: str = Query('events', pattern='^(events|sessions)$'),
+                 format: str = Query('ndjson', pattern='^(ndjson|parquet|arrow)$'),
+                 subject_id: Optional[str] = None, app_id: Optional[str] = None,
+                 ts_from: Optional[str] = None, ts_to: Optional[str] = None,
+                 batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=100000)):
+    # Streamed from read-only connections, one per shard read concurrently (just the
+    # subject's shard when subject_id is given); the sync generator runs in the threadpool
+    paths = [store.for_subject(subject_id).path] if subject_id else store.layout.paths
+    try:
+        chunks = export_chunks(paths, table, format, batch_size, subject_id=subject_id, app_id=app_id, ts_from=ts_from, ts_to=ts_to)
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    media_type, extension = FORMATS[format]
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{table}.{extension}"'})
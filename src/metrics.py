@@ -0,0 +1,278 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics rendered in the Prometheus text format (version 0.0.4).
+#
+# Counters and histograms are updated on the request path (and from the ingest
+# writer thread), so an update is a dict lookup, a bisect and an add under a lock.
+# Values that already live elsewhere (queue depth, cache hits) are read by a
+# callback only when /metrics is scraped.
+#
+#   metrics = Registry()
+#   requests = metrics.counter('http_requests_total', 'Requests served', ['route', 'status'])
+#   requests.labels('/events', '200').inc()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; spans a cached lookup up to a slow group commit
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        # The child for one combination of label values, created on first use
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock):
+        self.value = 0
+        self._lock = lock
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = self.header()
+        for values, child in sorted(self._children.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}')
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets, lock):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = lock
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets, self._lock)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self):
+        lines = self.header()
+        for values, child in sorted(self._children.items()):
+            with self._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, values)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, values)} {count}')
+        return lines
+
+
+class Callback(_Metric):
+    """Gauge or counter whose value is read from fn() at scrape time.
+
+    fn returns a number, or a {label values tuple: number} dict for labelled metrics.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), kind='gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        lines = self.header()
+        try:
+            value = self.fn()
+        except Exception as e:
+            logging.warning(f"Metric {self.name} could not be read: {e}")
+            return lines
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        for values, sample in sorted(samples):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(sample)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, fn, labelnames=()):
+        return self._register(Callback(name, documentation, fn, labelnames, 'gauge'))
+
+    def counter_callback(self, name, documentation, fn, labelnames=()):
+        return self._register(Callback(name, documentation, fn, labelnames, 'counter'))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and status per route template.
+
+    Requests are labelled by the matched route's path (/uploads/{upload_id}, not the
+    raw URL), so the number of series stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app, latency, responses):
+        self.app = app
+        self.latency = latency
+        self.responses = responses
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            self.latency.labels(scope['method'], path).observe(time.perf_counter() - start)
+            self.responses.labels(scope['method'], path, str(status)).inc()
+
+
+class SampledLog:
+    """Rate limit for a high-volume log line.
+
+    At most rate_per_s records are emitted per second; the rest are counted and the
+    count is reported on the next record that gets through. The message is passed as
+    a callable so suppressed records are never formatted.
+    """
+
+    def __init__(self, rate_per_s, level=logging.INFO):
+        self.rate_per_s = rate_per_s
+        self.level = level
+        self.suppressed = 0
+        self._pending = 0
+        self._window_end = 0.0
+        self._sent = 0
+
+    def __call__(self, message):
+        now = time.monotonic()
+        if now >= self._window_end:
+            self._window_end = now + 1.0
+            self._sent = 0
+        if self._sent >= self.rate_per_s:
+            self._pending += 1
+            self.suppressed += 1
+            return
+        self._sent += 1
+        text = message()
+        if self._pending:
+            text = f"{text} ({self._pending} similar suppressed)"
+            self._pending = 0
+        logging.log(self.level, text)
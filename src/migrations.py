@@ -0,0 +1,361 @@
+import logging
+import re
+import sqlite3
+import sys
+
+# Versioned schema migrations. The applied version is stored in PRAGMA user_version;
+# each migration runs in its own transaction and bumps the version when it commits.
+
+
+def _columns(cur, table):
+    return {row[1] for row in cur.execute(f'PRAGMA table_info({table})').fetchall()}
+
+
+def _add_missing_columns(cur, table, columns):
+    existing = _columns(cur, table)
+    for name, decl in columns:
+        if name not in existing:
+            cur.execute(f'ALTER TABLE {table} ADD COLUMN {name} {decl}')
+
+
+def _unify_schema(cur):
+    # One schema for the API and the analysis scripts. Older databases come in two
+    # layouts: the one main.py used to create (payload, started_ts_utc, autoincrement
+    # ids) and the one database.py created (payload_json, ts_start_utc, subjects/apps).
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS subjects (
+        subject_id TEXT PRIMARY KEY,
+        created_at_utc TEXT NOT NULL,
+        demographics_json TEXT,
+        meta_json TEXT
+    )
+    ''')
+
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS apps (
+        app_id TEXT PRIMARY KEY,
+        app_type TEXT CHECK(app_type IN ('survey', 'task')) NOT NULL,
+        app_version INTEGER DEFAULT 1,
+        schema_json TEXT
+    )
+    ''')
+
+    # Renaming a legacy table must not rewrite foreign keys that point at its name
+    cur.execute('PRAGMA legacy_alter_table = ON')
+
+    sessions_legacy = 'started_ts_utc' in _columns(cur, 'sessions')
+    if sessions_legacy:
+        cur.execute('ALTER TABLE sessions RENAME TO sessions_v0')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        subject_id TEXT,
+        app_id TEXT,
+        app_type TEXT,
+        app_version INTEGER,
+        ts_start_utc TEXT NOT NULL,
+        ts_end_utc TEXT,
+        tz TEXT,
+        device_info TEXT,
+        meta_json TEXT,
+        summary TEXT,
+        events_count INTEGER,
+        session_file_path TEXT,
+        server_ts TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(subject_id) REFERENCES subjects(subject_id),
+        FOREIGN KEY(app_id) REFERENCES apps(app_id)
+    )
+    ''')
+    _add_missing_columns(cur, 'sessions', [
+        ('app_type', 'TEXT'),
+        ('summary', 'TEXT'),
+        ('events_count', 'INTEGER'),
+        ('session_file_path', 'TEXT'),
+        ('server_ts', 'TEXT'),
+    ])
+    if sessions_legacy:
+        # Later rows (e.g. a session_complete after a start) win for the same session_id
+        cur.execute('''
+        INSERT OR REPLACE INTO sessions (session_id, subject_id, app_id, app_type, ts_start_utc, ts_end_utc, tz, summary, events_count, session_file_path, server_ts)
+        SELECT session_id, subject_id, app_id, app_type, COALESCE(started_ts_utc, server_ts, ''), ended_ts_utc, tz, summary, events_count, session_file_path, server_ts
+        FROM sessions_v0
+        WHERE session_id IS NOT NULL
+        ORDER BY id
+        ''')
+        cur.execute('DROP TABLE sessions_v0')
+
+    events_legacy = 'payload' in _columns(cur, 'events')
+    if events_legacy:
+        cur.execute('ALTER TABLE events RENAME TO events_v0')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        subject_id TEXT,
+        app_id TEXT,
+        app_type TEXT,
+        event_index INTEGER,
+        ts_utc TEXT NOT NULL,
+        tz TEXT,
+        server_ts TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        event_type TEXT NOT NULL,
+        item_id TEXT NOT NULL,
+        payload_json TEXT NOT NULL,
+        FOREIGN KEY(session_id) REFERENCES sessions(session_id),
+        UNIQUE(session_id, event_index)
+    )
+    ''')
+    _add_missing_columns(cur, 'events', [
+        ('subject_id', 'TEXT'),
+        ('app_id', 'TEXT'),
+        ('app_type', 'TEXT'),
+        ('tz', 'TEXT'),
+    ])
+    if events_legacy:
+        # The old table had no uniqueness on (session_id, event_index). Keep every row:
+        # the first one keeps its index, later collisions are stored with a NULL index.
+        cur.execute('CREATE INDEX events_v0_session_index ON events_v0(session_id, event_index, id)')
+        cur.execute('''
+        INSERT INTO events (session_id, subject_id, app_id, app_type, event_index, ts_utc, tz, server_ts, event_type, item_id, payload_json)
+        SELECT
+            session_id, subject_id, app_id, app_type,
+            CASE WHEN id = (SELECT MIN(l.id) FROM events_v0 l WHERE l.session_id = e.session_id AND l.event_index = e.event_index)
+                 THEN event_index END,
+            COALESCE(ts_utc, ''), tz, COALESCE(server_ts, CURRENT_TIMESTAMP), COALESCE(event_type, ''),
+            COALESCE(CASE WHEN json_valid(payload) THEN json_extract(payload, '$.item_id') END, ''),
+            COALESCE(payload, '{}')
+        FROM events_v0 e
+        ORDER BY id
+        ''')
+        cur.execute('DROP TABLE events_v0')
+    cur.execute('PRAGMA legacy_alter_table = OFF')
+
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS assets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subject_id TEXT,
+        session_id TEXT,
+        modality TEXT,
+        subtype TEXT,
+        ts_utc TEXT,
+        tz TEXT,
+        path TEXT,
+        meta_json TEXT,
+        server_ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _hot_path_indexes(cur):
+    # sessions(session_id) and events(session_id, event_index) are already covered
+    # by the primary key and the UNIQUE constraint
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sessions_subject_app_start ON sessions(subject_id, app_id, ts_start_utc)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_events_app ON events(app_id, session_id, event_index)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_assets_session ON assets(session_id)')
+
+
+def _wide_rows(cur):
+    # Materialized /wide rows: one flattened item__field record per finished session
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS wide_rows (
+        session_id TEXT PRIMARY KEY,
+        subject_id TEXT,
+        app_id TEXT,
+        app_version INTEGER,
+        ts_start_utc TEXT,
+        ts_end_utc TEXT,
+        row_json TEXT NOT NULL
+    )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_wide_rows_subject_app_start ON wide_rows(subject_id, app_id, ts_start_utc)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sessions_subject_app_end ON sessions(subject_id, app_id, ts_end_utc)')
+
+
+def _asset_hashes(cur):
+    # Uploads store their SHA-256 in assets.meta_json; dedup looks files up by it
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assets_sha256 ON assets(json_extract(meta_json, '$.sha256'))")
+
+
+def _session_keyset_indexes(cur):
+    # /sessions pages by (ts_start_utc, session_id), optionally filtered by subject and/or app
+    cur.execute('DROP INDEX IF EXISTS idx_sessions_subject_app_start')
+    cur.execute('CREATE INDEX idx_sessions_subject_app_start ON sessions(subject_id, app_id, ts_start_utc, session_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sessions_subject_start ON sessions(subject_id, ts_start_utc, session_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sessions_app_start ON sessions(app_id, ts_start_utc, session_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions(ts_start_utc, session_id)')
+
+
+def _archived_sessions(cur):
+    # Manifest of the per-session event archives written by src/archive.py
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS archived_sessions (
+        session_id TEXT PRIMARY KEY,
+        subject_id TEXT,
+        app_id TEXT,
+        ts_start_utc TEXT,
+        path TEXT NOT NULL,
+        events_count INTEGER NOT NULL,
+        min_event_id INTEGER,
+        max_event_id INTEGER,
+        min_ts_utc TEXT,
+        max_ts_utc TEXT,
+        bytes INTEGER,
+        archived_at_utc TEXT NOT NULL
+    )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archived_sessions_subject_app ON archived_sessions(subject_id, app_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_archived_sessions_app ON archived_sessions(app_id, max_event_id)')
+    # The compactor looks for sessions by end time
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_sessions_end ON sessions(ts_end_utc)')
+
+
+def _task_slots(cur):
+    # Approved experiment plans and the per-subject task slots compiled from them (src/schedule.py)
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS experiment_plans (
+        plan_id TEXT PRIMARY KEY,
+        title TEXT,
+        library_version TEXT,
+        plan_json TEXT NOT NULL,
+        approved_at_utc TEXT NOT NULL
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS task_slots (
+        slot_id INTEGER PRIMARY KEY,
+        subject_id TEXT NOT NULL,
+        plan_id TEXT NOT NULL,
+        day_index INTEGER NOT NULL,
+        local_date TEXT NOT NULL,
+        time_window TEXT,
+        library_id TEXT NOT NULL,
+        app_id TEXT,
+        estimated_minutes REAL,
+        instruction TEXT,
+        window_start_utc TEXT NOT NULL,
+        window_end_utc TEXT NOT NULL,
+        done_session_id TEXT,
+        done_at_utc TEXT,
+        UNIQUE(subject_id, plan_id, day_index, time_window, library_id),
+        FOREIGN KEY(plan_id) REFERENCES experiment_plans(plan_id)
+    )
+    ''')
+    # Only pending slots are looked up, so the indexes skip the done ones
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_task_slots_due ON task_slots(subject_id, window_end_utc) WHERE done_session_id IS NULL')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_task_slots_next ON task_slots(subject_id, window_start_utc) WHERE done_session_id IS NULL')
+
+
+def _events_by_subject(cur):
+    # Exports and load_data filtered by subject read events by subject_id in event_id order
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_events_subject ON events(subject_id)')
+
+
+def _events_by_app(cur):
+    # The feature store reads an app's events past its high-water mark (archive.new_sessions_query);
+    # with event_id after app_id that is a range search rather than a filter over every app row
+    cur.execute('DROP INDEX IF EXISTS idx_events_app')
+    cur.execute('CREATE INDEX idx_events_app ON events(app_id, event_id)')
+
+
+MIGRATIONS = [
+    (1, _unify_schema),
+    (2, _hot_path_indexes),
+    (3, _wide_rows),
+    (4, _asset_hashes),
+    (5, _session_keyset_indexes),
+    (6, _archived_sessions),
+    (7, _task_slots),
+    (8, _events_by_subject),
+    (9, _events_by_app),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    # Bring the database up to SCHEMA_VERSION in place; returns the resulting version
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        cur = conn.cursor()
+        version = schema_version(conn)
+        for target, upgrade in MIGRATIONS:
+            if target <= version:
+                continue
+            cur.execute('BEGIN')
+            try:
+                upgrade(cur)
+                cur.execute(f'PRAGMA user_version = {target}')
+                cur.execute('COMMIT')
+            except Exception:
+                cur.execute('ROLLBACK')
+                raise
+            logging.info(f"Database migrated to schema version {target} ({upgrade.__name__})")
+            version = target
+        return version
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def hot_queries():
+    # name -> (sql, params) of the queries on the ingest and read hot paths, none of which
+    # may fall back to a full scan. The SQL comes from the functions that run it; src/main.py
+    # adds the API's own lookups and listings. Imported here rather than at the top, as
+    # those modules are not needed to create or upgrade a schema.
+    from src.archive import (archive_paths_query, archived_path_query, closed_sessions_query, new_sessions_query,
+                             session_events_query)
+    from src.export import export_query
+    from src.schedule import due_slots_query, next_slot_query, slot_to_complete_query
+    from src.wide_table import pending_sessions_query, wide_rows_query
+    ts = '2025-01-01T00:00:00Z'
+    return {
+        'session_event_replay': session_events_query('s', ('event_index', 'item_id', 'payload_json')),
+        'session_events': session_events_query('s'),
+        # The UNIQUE(session_id, event_index) probe of every event insert, which dedups client retries
+        'event_by_index': ('SELECT event_id FROM events WHERE session_id = ? AND event_index = ?', ('s', 0)),
+        'wide_pending_sessions': pending_sessions_query('subj', 'app'),
+        'wide_rows': wide_rows_query('subj', 'app'),
+        'wide_rows_range': wide_rows_query('subj', 'app', 1, ts, ts),
+        'archived_session': archived_path_query('s'),
+        'archive_candidates': closed_sessions_query(ts, 100),
+        'archive_paths_by_subject': archive_paths_query(['subj'], 'app'),
+        'archive_paths_by_session': archive_paths_query(session_ids=['s1', 's2']),
+        'feature_store_new_sessions': new_sessions_query('app', 1000),
+        'due_slots': due_slots_query('subj', ts),
+        'next_slot': next_slot_query('subj', ts),
+        'slot_to_complete': slot_to_complete_query('subj', ['lib1', 'lib2'], ts, ts),
+        'export_events_by_subject': export_query('events', subject_id='subj'),
+        'export_events_by_subject_range': export_query('events', subject_id='subj', ts_from=ts, ts_to=ts),
+        'export_events_by_app': export_query('events', app_id='app'),
+        'export_sessions_by_subject': export_query('sessions', subject_id='subj'),
+    }
+
+
+# Scans of a subquery's or a VALUES list's rows, which are already filtered, not of a table
+_INTERMEDIATE_SCAN = re.compile(r'SCAN (CONSTANT ROW|\(subquery-\d+\)|SUBQUERY \d+)')
+
+
+def full_scans(conn, queries=None):
+    # Map query name -> plan steps that scan a whole table or index
+    scans = {}
+    for name, (sql, params) in (queries or hot_queries()).items():
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        steps = [row[-1] for row in plan if row[-1].startswith('SCAN') and not _INTERMEDIATE_SCAN.match(row[-1])]
+        if steps:
+            scans[name] = steps
+    return scans
+
+
+if __name__ == '__main__':
+    # python -m src.migrations <database.db>: upgrade in place and fail if a hot query scans
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = sqlite3.connect(sys.argv[1])
+    print(f"schema version {migrate(conn)}")
+    scans = full_scans(conn)
+    for name, steps in scans.items():
+        print(f"full scan in {name}: {'; '.join(steps)}")
+    sys.exit(1 if scans else 0)
@@ -0,0 +1,112 @@
+import base64
+import binascii
+import heapq
+import json
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+# Keyset pagination done in SQL.
+#
+# Rows are ordered by a unique key (e.g. ts_start_utc, session_id) and a page is
+# "key > last key of the previous page ORDER BY key LIMIT size", so a page costs the
+# same however deep it is and rows inserted meanwhile never shift or repeat a page.
+# The last key travels back to the client as an opaque cursor.
+#
+# Responses keep the fields of fastapi_pagination's Page (items, total, page, size,
+# pages) and add next_cursor. Clients that still send ?page=N get an OFFSET page.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPage(BaseModel):
+    items: List[Dict[str, Any]]
+    total: Optional[int] = None
+    page: Optional[int] = None
+    size: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not issued for this listing."""
+
+
+def encode_cursor(scope, key):
+    raw = json.dumps([scope, list(key)], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(scope, cursor, n_keys):
+    try:
+        cursor_scope, key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if cursor_scope != scope or not isinstance(key, list) or len(key) != n_keys:
+        raise InvalidCursor("Cursor does not belong to this listing")
+    return key
+
+
+def keyset_query(select, key_cols, filters=(), key=None, size=DEFAULT_PAGE_SIZE, offset=0):
+    # (sql, params) of one page: the rows after key, or from offset when there is no key;
+    # one row more than size is read to tell whether another page follows
+    conditions = [condition for condition, _ in filters]
+    params = [value for _, value in filters]
+    if key is not None:
+        conditions.append(f"({', '.join(key_cols)}) > ({', '.join('?' * len(key_cols))})")
+        params.extend(key)
+    where = ' AND '.join(conditions)
+    return f"{select}{' WHERE ' + where if where else ''} ORDER BY {', '.join(key_cols)} LIMIT ? OFFSET ?", params + [size + 1, offset]
+
+
+def count_query(select, filters=()):
+    where = ' AND '.join(condition for condition, _ in filters)
+    return f"SELECT COUNT(*) FROM ({select}{' WHERE ' + where if where else ''})", [value for _, value in filters]
+
+
+def keyset_page(cur, scope, select, key_cols, filters=(), cursor=None, size=DEFAULT_PAGE_SIZE, page=None, include_total=False):
+    # One page of `select` (a SELECT ... FROM ... without WHERE) ordered by key_cols.
+    # filters is a list of (sql condition, value) pairs. Cursors are bound to the scope
+    # name and the filter values, so one cannot be replayed against a different query.
+    scope = [scope] + [value for _, value in filters]
+
+    total = None
+    if include_total:
+        total = cur.execute(*count_query(select, filters)).fetchone()[0]
+
+    key, offset = None, 0
+    if cursor:
+        key = decode_cursor(scope, cursor, len(key_cols))
+        page = None
+    else:
+        page = page or 1
+        offset = (page - 1) * size
+
+    rows = cur.execute(*keyset_query(select, key_cols, filters, key, size, offset)).fetchall()
+    columns = [column[0] for column in cur.description]
+    items = [dict(zip(columns, row)) for row in rows[:size]]
+
+    next_cursor = None
+    if len(rows) > size:
+        next_cursor = encode_cursor(scope, [items[-1][col.split('.')[-1]] for col in key_cols])
+    pages = -(-total // size) if total is not None else None
+    return KeysetPage(items=items, total=total, page=page, size=size, pages=pages, next_cursor=next_cursor)
+
+
+def merge_pages(pages, scope, key_cols, filters=(), size=DEFAULT_PAGE_SIZE, page=None):
+    # One page out of the keyset_page results of the same query on several databases
+    # (shards). For a cursor page each holds up to size rows past the cursor; for OFFSET
+    # page N each holds its first N * size rows.
+    names = [col.split('.')[-1] for col in key_cols]
+    rows = list(heapq.merge(*[p.items for p in pages], key=lambda item: [item[name] for name in names]))
+    offset = (page - 1) * size if page else 0
+    items = rows[offset:offset + size]
+
+    next_cursor = None
+    if items and (len(rows) > offset + size or any(p.next_cursor for p in pages)):
+        next_cursor = encode_cursor([scope] + [value for _, value in filters], [items[-1][name] for name in names])
+    totals = [p.total for p in pages]
+    total = sum(totals) if None not in totals else None
+    pages_count = -(-total // size) if total is not None else None
+    return KeysetPage(items=items, total=total, page=page, size=size, pages=pages_count, next_cursor=next_cursor)
@@ -0,0 +1,343 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+
+from src.item_registry import LIBRARY_PATH, DEFAULTS_PATH
+from src.shards import ShardLayout
+
+# Due-task index compiled from the experiment plans written by experiment_LLM/ (see its
+# schema.json).
+#
+# An approved plan is stored in experiment_plans. Assigning it to a subject compiles it
+# into task_slots: one row per task per local day, with the time window converted to
+# UTC in the subject's time zone. The plan's schedule entries are used as written. A
+# schedule that only spans one week (day_index <= 7) repeats weekly. A plan with an
+# empty schedule is expanded from its instruments' frequencies. Days over the plan's
+# daily_burden_cap_minutes drop their later tasks.
+#
+# GET /subjects/{id}/due then reads open and upcoming slots from a partial index of the
+# pending ones. A finished session, or a speech upload with the library id as prompt_id,
+# marks the slot of its library entry whose window it overlaps as done.
+#
+#   python -m src.schedule path/to/database.db plan.json --subject S1 --subject S2 --start 2025-09-01 --tz Europe/Berlin
+
+TS_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+DEFAULT_WINDOWS = {'morning': '06:00-10:00', 'midday': '12:00-14:00', 'afternoon': '14:00-18:00', 'evening': '19:00-22:00'}
+ANYTIME = '00:00-24:00'
+# Windows are at most a day long, so an open slot ends within MAX_WINDOW of now
+MAX_WINDOW = timedelta(days=1)
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+_RANGE = re.compile(r'(\d{1,2}):(\d{2})\s*(?:-|–|—|to)\s*(\d{1,2}):(\d{2})')
+_PER_WEEK = re.compile(r'(\d)\s*x?_?(?:per_|/|_)?week')
+# Tunables that set how many days a week an instrument runs
+_DAYS_PER_WEEK_TUNABLES = {'cog.pvt': 'pvt_days_per_week', 'cog.stroop': 'stroop_days_per_week', 'speech': 'speech_days_per_week'}
+
+_warned = set()
+
+SLOT_COLUMNS = ['slot_id', 'plan_id', 'day_index', 'local_date', 'time_window', 'library_id', 'app_id',
+                'estimated_minutes', 'instruction', 'window_start_utc', 'window_end_utc']
+
+
+def utc_key(ts):
+    # An ISO timestamp in the fixed-width UTC form slots are stored in, so they compare as
+    # text; ValueError if ts is not one
+    value = ts.strip().replace(' ', 'T')
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        # e.g. fractional seconds Python 3.8's fromisoformat does not read
+        key = value[:19] + 'Z'
+        datetime.strptime(key, TS_FORMAT)
+        return key
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime(TS_FORMAT)
+
+
+def load_library(path=LIBRARY_PATH):
+    # {library id: entry}, with each entry's modality added
+    with open(path) as f:
+        library = json.load(f)
+    entries = {}
+    for section, modality in (('surveys', 'survey'), ('cognition', 'cognition'), ('speech', 'speech')):
+        for entry in library.get(section, []):
+            entries[entry['id']] = dict(entry, modality=modality)
+    return entries
+
+
+def library_apps(defaults_path=DEFAULTS_PATH):
+    # {library id: [app_id, ...]} for the apps in app_schemas.json that name a library_id
+    apps = {}
+    if os.path.exists(defaults_path):
+        with open(defaults_path) as f:
+            for app_id, schema in json.load(f).items():
+                if schema.get('library_id'):
+                    apps.setdefault(schema['library_id'], []).append(app_id)
+    return apps
+
+
+def completed_by(app_id, apps):
+    # Library ids a session of app_id can complete: its own id (apps may log under the
+    # library id itself) and the library entry it implements
+    return [app_id] + [library_id for library_id, app_ids in apps.items() if app_id in app_ids and library_id != app_id]
+
+
+def _minutes(hour, minute):
+    return int(hour) * 60 + int(minute)
+
+
+def window_range(time_window, windows):
+    # (start, end) in minutes after local midnight; end may pass midnight, by at most a day
+    name = (time_window or '').strip().lower()
+    spec = windows.get(name, name)
+    match = _RANGE.search(spec)
+    if match is None:
+        if name not in ('', 'any', 'anytime', 'any_time', 'all_day') and name not in _warned:
+            _warned.add(name)
+            logging.warning(f"Unknown time window '{time_window}'; scheduling it for the whole day")
+        match = _RANGE.search(ANYTIME)
+    start, end = _minutes(*match.group(1, 2)), _minutes(*match.group(3, 4))
+    return start, end if end > start else end + 24 * 60
+
+
+def _windows(tunables):
+    windows = dict(DEFAULT_WINDOWS)
+    for name in list(windows):
+        if tunables.get(f'{name}_window'):
+            windows[name] = tunables[f'{name}_window']
+    return windows
+
+
+def _spread(n):
+    # n weekday offsets spread over a week, e.g. 3 -> 0, 2, 4
+    return {round(i * 7 / n) % 7 for i in range(n)} if n > 0 else set()
+
+
+def _instrument_days(instrument, entry, tunables, start_date, duration_days):
+    schedule = instrument.get('schedule', {})
+    frequency = (schedule.get('frequency') or entry.get('default_frequency') or 'daily').lower()
+    weekdays = {WEEKDAYS.index(day[:3].lower()) for day in schedule.get('days_of_week', []) if day[:3].lower() in WEEKDAYS}
+    per_week = None
+    for prefix, tunable in _DAYS_PER_WEEK_TUNABLES.items():
+        if instrument['library_id'].startswith(prefix) and tunables.get(tunable) is not None:
+            per_week = tunables[tunable]
+    if per_week is None and not weekdays:
+        match = _PER_WEEK.search(frequency)
+        per_week = int(match.group(1)) if match else 1 if 'week' in frequency else 7
+    if per_week is not None:
+        # Counted from the subject's first day, not the calendar week
+        offsets = _spread(min(per_week, 7))
+        return [day for day in range(1, duration_days + 1) if (day - 1) % 7 in offsets]
+    return [day for day in range(1, duration_days + 1) if (start_date + timedelta(days=day - 1)).weekday() in weekdays]
+
+
+def _instrument_windows(instrument, entry):
+    times = instrument.get('schedule', {}).get('times_of_day') or []
+    if times:
+        return times
+    frequency = entry.get('default_frequency') or ''
+    if '_' in frequency and frequency.rsplit('_', 1)[1] in DEFAULT_WINDOWS:
+        return [frequency.rsplit('_', 1)[1]]
+    return entry.get('recommended_times_of_day', [])[:1] or ['anytime']
+
+
+def plan_entries(plan, library, start_date):
+    # The plan's schedule as (day_index, time_window, library_id, minutes, instruction)
+    # over its whole duration
+    tunables = plan.get('metadata', {}).get('tunables', {})
+    duration_days = tunables.get('plan_duration_days') or plan['design']['duration_days']
+    used = {item['task_library_id'] for item in plan.get('schedule', [])} | {item['library_id'] for item in plan.get('instruments', [])}
+    unknown = sorted(used - set(library))
+    if unknown:
+        raise ValueError(f"Plan uses ids that are not in the library: {', '.join(unknown)}")
+
+    entries = []
+    schedule = plan.get('schedule', [])
+    if schedule:
+        period = 7 if max(item['day_index'] for item in schedule) <= 7 < duration_days else duration_days
+        for item in schedule:
+            for day_index in range(item['day_index'], duration_days + 1, period):
+                entries.append((day_index, item['time_window'], item['task_library_id'],
+                                item.get('estimated_minutes'), item.get('instruction')))
+    else:
+        for instrument in plan['instruments']:
+            entry = library[instrument['library_id']]
+            minutes = entry.get('approx_burden_minutes', entry.get('expected_duration_seconds', 0) / 60)
+            for day_index in _instrument_days(instrument, entry, tunables, start_date, duration_days):
+                for time_window in _instrument_windows(instrument, entry):
+                    entries.append((day_index, time_window, instrument['library_id'], minutes, None))
+    return entries
+
+
+def _localize(local_times, tz):
+    # Naive local datetimes -> UTC keys; ambiguous times take standard time and times in a
+    # DST gap move forward
+    import numpy as np
+    import pandas as pd
+    index = pd.DatetimeIndex(local_times)
+    try:
+        utc = index.tz_localize(tz, ambiguous=np.zeros(len(index), dtype=bool), nonexistent='shift_forward').tz_convert('UTC')
+    except Exception as e:
+        raise ValueError(f"Unknown time zone '{tz}': {e}")
+    return list(utc.strftime(TS_FORMAT))
+
+
+def compile_plan(plan, library, start_date, tz='UTC', apps=None):
+    # Slot rows (day_index, local_date, time_window, library_id, app_id, estimated_minutes,
+    # instruction, window_start_utc, window_end_utc) for one subject starting on start_date
+    apps = library_apps() if apps is None else apps
+    tunables = plan.get('metadata', {}).get('tunables', {})
+    windows = _windows(tunables)
+    cap = tunables.get('daily_burden_cap_minutes')
+
+    # Each day's tasks in window order, so the cap drops the latest ones
+    entries = sorted(((entry[0], window_range(entry[1], windows), entry) for entry in plan_entries(plan, library, start_date)),
+                     key=lambda item: item[:2])
+    kept, burden, dropped = [], {}, 0
+    for _, window, entry in entries:
+        minutes = entry[3] or 0
+        if cap is not None and burden.get(entry[0], 0) + minutes > cap:
+            dropped += 1
+            continue
+        burden[entry[0]] = burden.get(entry[0], 0) + minutes
+        kept.append((entry, window))
+    if dropped:
+        logging.warning(f"Dropped {dropped} scheduled tasks over the daily burden cap of {cap} minutes")
+
+    local_times = []
+    for entry, (start, end) in kept:
+        midnight = datetime.combine(start_date + timedelta(days=entry[0] - 1), datetime.min.time())
+        local_times += [midnight + timedelta(minutes=start), midnight + timedelta(minutes=end)]
+    utc = _localize(local_times, tz) if local_times else []
+
+    slots = []
+    for i, ((day_index, time_window, library_id, minutes, instruction), _) in enumerate(kept):
+        local_date = (start_date + timedelta(days=day_index - 1)).isoformat()
+        app_id = (apps.get(library_id) or [library_id])[0]
+        slots.append((day_index, local_date, time_window, library_id, app_id, minutes, instruction, utc[2 * i], utc[2 * i + 1]))
+    return slots
+
+
+def store_plan(cur, plan_id, plan):
+    cur.execute('''
+    INSERT OR REPLACE INTO experiment_plans (plan_id, title, library_version, plan_json, approved_at_utc)
+    VALUES (?, ?, ?, ?, ?)
+    ''', (plan_id, plan.get('title'), plan.get('metadata', {}).get('library_version'), json.dumps(plan),
+          datetime.utcnow().strftime(TS_FORMAT)))
+
+
+def assign_plan(cur, subject_id, plan_id, slots):
+    # Replaces the subject's pending slots of the plan; slots already done are kept.
+    # Returns the number of slots added
+    cur.execute('DELETE FROM task_slots WHERE subject_id = ? AND plan_id = ? AND done_session_id IS NULL', (subject_id, plan_id))
+    cur.executemany('''
+    INSERT OR IGNORE INTO task_slots (subject_id, plan_id, day_index, local_date, time_window, library_id, app_id,
+        estimated_minutes, instruction, window_start_utc, window_end_utc)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(subject_id, plan_id, *slot) for slot in slots])
+    return cur.rowcount
+
+
+def due_slots_query(subject_id, now):
+    until = (datetime.strptime(now, TS_FORMAT) + MAX_WINDOW).strftime(TS_FORMAT)
+    return f'''
+    SELECT {', '.join(SLOT_COLUMNS)} FROM task_slots
+    WHERE subject_id = ? AND done_session_id IS NULL AND window_end_utc > ? AND window_end_utc <= ? AND window_start_utc <= ?
+    ORDER BY window_end_utc
+    ''', (subject_id, now, until, now)
+
+
+def due_slots(cur, subject_id, now):
+    # Pending slots whose window contains now (a UTC key), soonest to close first
+    return [dict(zip(SLOT_COLUMNS, row)) for row in cur.execute(*due_slots_query(subject_id, now)).fetchall()]
+
+
+def next_slot_query(subject_id, now):
+    return f'''
+    SELECT {', '.join(SLOT_COLUMNS)} FROM task_slots
+    WHERE subject_id = ? AND done_session_id IS NULL AND window_start_utc > ?
+    ORDER BY window_start_utc LIMIT 1
+    ''', (subject_id, now)
+
+
+def next_slot(cur, subject_id, now):
+    row = cur.execute(*next_slot_query(subject_id, now)).fetchone()
+    return dict(zip(SLOT_COLUMNS, row)) if row else None
+
+
+def slot_to_complete_query(subject_id, library_ids, ts_start, ts_end):
+    # ts_start and ts_end are UTC keys
+    until = (datetime.strptime(ts_end, TS_FORMAT) + MAX_WINDOW).strftime(TS_FORMAT)
+    return f'''
+    SELECT slot_id FROM task_slots
+    WHERE subject_id = ? AND library_id IN ({', '.join('?' * len(library_ids))}) AND done_session_id IS NULL
+        AND window_end_utc >= ? AND window_end_utc <= ? AND window_start_utc <= ?
+    ORDER BY window_end_utc LIMIT 1
+    ''', (subject_id, *library_ids, ts_start, until, ts_end)
+
+
+def mark_done(cur, subject_id, library_ids, ts_start, ts_end, session_id):
+    # Marks the first-closing pending slot of library_ids whose window overlaps
+    # [ts_start, ts_end]; returns its slot_id or None. Sessions with timestamps that are
+    # not ISO 8601 (legacy clients send any string) complete nothing
+    try:
+        ts_start, ts_end = utc_key(ts_start), utc_key(ts_end)
+    except ValueError:
+        logging.warning(f"Session {session_id} has no ISO 8601 start or end time; no task slot marked done")
+        return None
+    row = cur.execute(*slot_to_complete_query(subject_id, library_ids, ts_start, ts_end)).fetchone()
+    if row is None:
+        return None
+    cur.execute('UPDATE task_slots SET done_session_id = ?, done_at_utc = ? WHERE slot_id = ?', (session_id, ts_end, row[0]))
+    return row[0]
+
+
+def subject_tz(cur, subject_id):
+    # Time zone of the subject's latest session, if any
+    row = cur.execute('SELECT tz FROM sessions WHERE subject_id = ? AND tz IS NOT NULL ORDER BY ts_start_utc DESC LIMIT 1', (subject_id,)).fetchone()
+    return row[0] if row else None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Approve an experiment plan and compile it into task slots for subjects.')
+    parser.add_argument('database')
+    parser.add_argument('plan', help='experiment plan JSON (experiment_LLM/schema.json)')
+    parser.add_argument('--plan-id', help='default: the plan file name without .json')
+    parser.add_argument('--subject', action='append', default=[], help='subject to assign the plan to (repeatable)')
+    parser.add_argument('--start', type=date.fromisoformat, default=date.today(), help='local date of day 1 (default: today)')
+    parser.add_argument('--tz', help="subjects' time zone (default: the tz of their latest session, else UTC)")
+    parser.add_argument('--library', default=LIBRARY_PATH)
+    args = parser.parse_args()
+
+    with open(args.plan) as f:
+        plan = json.load(f)
+    plan_id = args.plan_id or os.path.splitext(os.path.basename(args.plan))[0]
+    library = load_library(args.library)
+    # A sharded layout keeps a copy of the plan in every shard and each subject's slots in theirs
+    layout = ShardLayout.load(args.database) if os.path.isdir(args.database) else ShardLayout.single(args.database)
+    conns = [sqlite3.connect(path, isolation_level=None, timeout=30) for path in layout.paths]
+    try:
+        # Compile everything before writing, so a bad plan or time zone changes nothing
+        compiled = {}
+        for subject_id in args.subject:
+            tz = args.tz or subject_tz(conns[layout.shard_of(subject_id)].cursor(), subject_id) or 'UTC'
+            compiled[subject_id] = compile_plan(plan, library, args.start, tz)
+        for i, conn in enumerate(conns):
+            cur = conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            store_plan(cur, plan_id, plan)
+            for subject_id, slots in compiled.items():
+                if layout.shard_of(subject_id) == i:
+                    assign_plan(cur, subject_id, plan_id, slots)
+            cur.execute('COMMIT')
+    finally:
+        for conn in conns:
+            conn.close()
+    print(f"Plan '{plan_id}' stored; {sum(len(slots) for slots in compiled.values())} slots for {len(compiled)} subjects")
@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+
+# Event indexes beyond this are tracked in a plain set instead of growing the bitmap
+MAX_BITMAP_INDEX = 1 << 20
+
+
+class SessionState:
+    """Cached metadata for a session, a bitmap of logged event indexes and its running summary."""
+
+    __slots__ = ('subject_id', 'app_id', 'app_type', 'app_version', 'finished', 'summary', 'expires_at', '_bitmap', '_overflow')
+
+    def __init__(self, subject_id, app_id, app_type, event_indexes=(), finished=False, app_version=None, summary=None):
+        self.subject_id = subject_id
+        self.app_id = app_id
+        self.app_type = app_type
+        self.app_version = app_version
+        self.finished = finished
+        self.summary = summary
+        self.expires_at = 0.0
+        self._bitmap = bytearray()
+        self._overflow = set()
+        for event_index in event_indexes:
+            self.mark_event(event_index)
+
+    def has_event(self, event_index):
+        if 0 <= event_index < MAX_BITMAP_INDEX:
+            byte = event_index >> 3
+            return byte < len(self._bitmap) and bool(self._bitmap[byte] & (1 << (event_index & 7)))
+        return event_index in self._overflow
+
+    def mark_event(self, event_index):
+        if 0 <= event_index < MAX_BITMAP_INDEX:
+            byte = event_index >> 3
+            if byte >= len(self._bitmap):
+                self._bitmap.extend(bytes(byte + 1 - len(self._bitmap)))
+            self._bitmap[byte] |= 1 << (event_index & 7)
+        else:
+            self._overflow.add(event_index)
+
+    def unmark_event(self, event_index):
+        if 0 <= event_index < MAX_BITMAP_INDEX:
+            byte = event_index >> 3
+            if byte < len(self._bitmap):
+                self._bitmap[byte] &= ~(1 << (event_index & 7)) & 0xFF
+        else:
+            self._overflow.discard(event_index)
+
+
+class SessionCache:
+    """LRU cache of SessionState keyed by session_id, with a per-entry TTL."""
+
+    def __init__(self, max_sessions=10000, ttl_s=6 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_id):
+        state = self._entries.get(session_id)
+        if state is None or state.expires_at < time.monotonic():
+            if state is not None:
+                del self._entries[session_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        state.expires_at = time.monotonic() + self.ttl_s
+        self.hits += 1
+        return state
+
+    def put(self, session_id, state):
+        state.expires_at = time.monotonic() + self.ttl_s
+        self._entries[session_id] = state
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+        return state
+
+    def setdefault(self, session_id, state):
+        # put, unless a live entry was stored meanwhile (lookups await the database,
+        # so two misses for one session can race); the entry kept is returned
+        current = self._entries.get(session_id)
+        if current is not None and current.expires_at >= time.monotonic():
+            return current
+        return self.put(session_id, state)
+
+    def evict(self, session_id):
+        self._entries.pop(session_id, None)
@@ -0,0 +1,182 @@
+import math
+
+# Per-session scores kept up to date as events are logged, so /sessions/finish can store
+# and return them without another pass over the events. They match
+# scripts/parse_database.py:
+#   stroop       accuracy, mean RT of correct trials, interference and IES by congruency
+#                (test trials), as score_stroop
+#   other tasks  rt_ms of the non-practice trials, as parse_pvt
+#   surveys      the last value logged per item, as parse_survey_data
+# Task trials are also kept per phase (and congruency) with Welford running statistics,
+# so a summary's size does not depend on the number of trials.
+
+SUMMARY_VERSION = 1
+SURVEY_DROP_ITEMS = frozenset(['subject_id', 'session_id', 'start_timestamp'])
+
+
+def _number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def _phase(payload):
+    return 'practice' if payload.get('phase') == 'practice' else 'test'
+
+
+class RunningStats:
+    """Count, mean, variance (Welford), min and max of a stream of numbers."""
+
+    __slots__ = ('n', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def sd(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+
+    def to_dict(self):
+        if not self.n:
+            return {'n': 0, 'mean': None, 'sd': None, 'min': None, 'max': None}
+        return {'n': self.n, 'mean': self.mean, 'sd': self.sd, 'min': self.min, 'max': self.max}
+
+
+def _stats(groups, key):
+    stats = groups.get(key)
+    if stats is None:
+        stats = groups[key] = RunningStats()
+    return stats
+
+
+def _mean(groups, key):
+    stats = groups.get(key)
+    return stats.mean if stats is not None and stats.n else None
+
+
+def _difference(a, b):
+    return a - b if a is not None and b is not None else None
+
+
+def _ratio(a, b):
+    return a / b if a is not None and b else None
+
+
+class StroopSummary:
+    kind = 'stroop'
+
+    def __init__(self):
+        self.events = 0
+        self.correct = {}  # (phase, condition) -> stats of 0/1 correctness
+        self.rt = {}  # (phase, condition) -> stats of rt_ms over correct trials
+
+    def add(self, item_id, payload):
+        self.events += 1
+        expected = payload.get('expected_key')
+        if expected is None:
+            return
+        word, color = payload.get('word'), payload.get('font_color')
+        condition = 'congruent' if word is not None and color is not None and str(word).lower() == str(color).lower() else 'incongruent'
+        key = (_phase(payload), condition)
+        correct = payload.get('key_pressed') == expected
+        _stats(self.correct, key).add(1.0 if correct else 0.0)
+        rt = _number(payload.get('rt_ms'))
+        if correct and rt is not None:
+            _stats(self.rt, key).add(rt)
+
+    def scores(self):
+        test = [stats for (phase, _), stats in self.correct.items() if phase == 'test']
+        n = sum(stats.n for stats in test)
+        scores = {'acc_overall': sum(stats.mean * stats.n for stats in test) / n if n else None}
+        for condition in ('congruent', 'incongruent'):
+            scores[f'acc_{condition}'] = _mean(self.correct, ('test', condition))
+        scores['acc_interference'] = _difference(scores['acc_incongruent'], scores['acc_congruent'])
+        for condition in ('congruent', 'incongruent'):
+            scores[f'rt_mean_{condition}'] = _mean(self.rt, ('test', condition))
+        scores['rt_interference'] = _difference(scores['rt_mean_incongruent'], scores['rt_mean_congruent'])
+        for condition in ('congruent', 'incongruent'):
+            scores[f'ies_{condition}'] = _ratio(scores[f'rt_mean_{condition}'], scores[f'acc_{condition}'])
+        scores['ies_interference'] = _difference(scores['ies_incongruent'], scores['ies_congruent'])
+        return scores
+
+    def trials(self):
+        return {f'{phase}_{condition}': {'correct': stats.to_dict(), 'rt_ms': _stats(self.rt, (phase, condition)).to_dict()}
+                for (phase, condition), stats in sorted(self.correct.items())}
+
+
+class ReactionTimeSummary:
+    kind = 'reaction_time'
+
+    def __init__(self):
+        self.events = 0
+        self.correct = {}  # phase -> stats of 0/1 correct
+        self.rt = {}  # phase -> stats of rt_ms
+
+    def add(self, item_id, payload):
+        self.events += 1
+        phase = _phase(payload)
+        correct = _number(payload.get('correct'))
+        if correct is not None:
+            _stats(self.correct, phase).add(correct)
+        rt = _number(payload.get('rt_ms'))
+        if rt is not None:
+            _stats(self.rt, phase).add(rt)
+
+    def scores(self):
+        return {'rt_ms': _mean(self.rt, 'test'), 'acc_overall': _mean(self.correct, 'test')}
+
+    def trials(self):
+        phases = sorted(set(self.correct) | set(self.rt))
+        return {phase: {'correct': _stats(self.correct, phase).to_dict(), 'rt_ms': _stats(self.rt, phase).to_dict()} for phase in phases}
+
+
+class SurveySummary:
+    kind = 'survey'
+
+    def __init__(self):
+        self.events = 0
+        self.values = {}
+
+    def add(self, item_id, payload):
+        self.events += 1
+        if item_id and item_id not in SURVEY_DROP_ITEMS and 'value' in payload:
+            self.values[item_id] = payload['value']
+
+    def scores(self):
+        return dict(self.values)
+
+    def trials(self):
+        return None
+
+
+def new_summary(app_id, app_type):
+    if app_id == 'stroop':
+        return StroopSummary()
+    if app_type == 'task':
+        return ReactionTimeSummary()
+    return SurveySummary()
+
+
+def summary_dict(summary):
+    # JSON-ready summary stored in sessions.summary and returned by /sessions/finish
+    out = {'version': SUMMARY_VERSION, 'kind': summary.kind, 'events': summary.events, 'scores': summary.scores()}
+    trials = summary.trials()
+    if trials is not None:
+        out['trials'] = trials
+    return out
@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+
+from src.ingest import IngestWriter
+from src.migrations import migrate, full_scans
+
+# Sharded storage: each subject's sessions, events, assets, wide rows, archive manifest
+# and task slots live in one of N SQLite files, so writes for different subjects do not
+# wait on one write lock. The subject's shard is a stable hash of subject_id, unless the
+# layout pins it to a shard (e.g. to keep one study's subjects together).
+#
+# A layout is a directory holding shards.json and the shard files:
+#   {"version": 1, "shards": ["shard-00.db", ...], "pins": {"<subject_id>": 2}}
+# apps and experiment_plans are copied to every shard; the first shard's apps table is
+# the one the item registry reads.
+#
+# Every shard has its own read connections and its own ingest writer thread. Event and
+# asset ids stay unique across shards: shard i numbers them from i << ID_BITS.
+#
+# A single database file is a layout with one shard. To move one into a sharded layout:
+#   python -m src.shards split data/database.db data/shards --shards 4 [--pin S1=0]
+
+LAYOUT = 'shards.json'
+LAYOUT_VERSION = 1
+ID_BITS = 40
+ID_TABLES = ('events', 'assets')
+# Tables whose rows belong to one subject, and tables every shard gets a copy of
+SUBJECT_TABLES = ('subjects', 'sessions', 'events', 'assets', 'wide_rows', 'archived_sessions', 'task_slots')
+SHARED_TABLES = ('apps', 'experiment_plans')
+
+
+def shard_index(subject_id, n_shards):
+    # crc32 rather than hash(): it must not change between processes or Python versions
+    return zlib.crc32((subject_id or '').encode('utf-8')) % n_shards
+
+
+class ShardLayout:
+    def __init__(self, paths, pins=None, root=None):
+        self.paths = list(paths)
+        self.pins = dict(pins or {})
+        self.root = root
+
+    @classmethod
+    def single(cls, db_path):
+        return cls([db_path])
+
+    @classmethod
+    def load(cls, root):
+        with open(os.path.join(root, LAYOUT)) as f:
+            layout = json.load(f)
+        if layout.get('version') != LAYOUT_VERSION:
+            raise ValueError(f"Unsupported shard layout version {layout.get('version')} in {root}")
+        return cls([os.path.join(root, name) for name in layout['shards']], layout.get('pins'), root)
+
+    @classmethod
+    def create(cls, root, n_shards, pins=None):
+        if os.path.exists(os.path.join(root, LAYOUT)):
+            raise FileExistsError(f"{root} already holds a shard layout")
+        os.makedirs(root, exist_ok=True)
+        names = [f'shard-{i:02d}.db' for i in range(n_shards)]
+        layout = cls([os.path.join(root, name) for name in names], pins, root)
+        for subject_id, shard in layout.pins.items():
+            if not 0 <= shard < n_shards:
+                raise ValueError(f"Subject '{subject_id}' is pinned to shard {shard}, but there are {n_shards}")
+        with open(os.path.join(root, LAYOUT + '.tmp'), 'w') as f:
+            json.dump({'version': LAYOUT_VERSION, 'shards': names, 'pins': layout.pins}, f, indent=2)
+        os.replace(os.path.join(root, LAYOUT + '.tmp'), os.path.join(root, LAYOUT))
+        return layout
+
+    @classmethod
+    def open(cls, path, n_shards=None):
+        # A layout directory (created with n_shards shards if it does not exist yet) or a
+        # single database file
+        if os.path.exists(os.path.join(path, LAYOUT)):
+            layout = cls.load(path)
+            if n_shards is not None and n_shards != len(layout.paths):
+                logging.warning(f"{path} has {len(layout.paths)} shards, not {n_shards}; re-split to change the count")
+            return layout
+        if os.path.isdir(path) or n_shards is not None:
+            return cls.create(path, n_shards or 1)
+        return cls.single(path)
+
+    def shard_of(self, subject_id):
+        pinned = self.pins.get(subject_id)
+        return pinned if pinned is not None else shard_index(subject_id, len(self.paths))
+
+    def path_of(self, subject_id):
+        return self.paths[self.shard_of(subject_id)]
+
+
+def reserve_ids(cur, shard, floor=0):
+    # Start the shard's event and asset ids at shard << ID_BITS (or after floor)
+    start = max(shard << ID_BITS, floor)
+    for table in ID_TABLES:
+        row = cur.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        if row is None:
+            cur.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, start))
+        elif row[0] < start:
+            cur.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (start, table))
+
+
+def prepare_shard(path, shard, queries=None):
+    # Create or upgrade a shard's schema, check queries (default: the hot queries) for full
+    # scans and reserve the shard's id range
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        migrate(conn)
+        for name, steps in full_scans(conn, queries).items():
+            logging.warning(f"Hot query '{name}' falls back to a full scan in {path}: {'; '.join(steps)}")
+        if shard:
+            conn.execute('BEGIN IMMEDIATE')
+            reserve_ids(conn.cursor(), shard)
+            conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """Read connections to one shard for worker threads, at most ``size`` open at once."""
+
+    def __init__(self, path, size=4):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class Shard:
+    def __init__(self, index, path, pool_size=4, **writer_options):
+        self.index = index
+        self.path = path
+        # Shared connection for reads on the event loop; worker threads use the pool
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.cursor = self.conn.cursor()
+        self.pool = ConnectionPool(path, pool_size)
+        self.writer = IngestWriter(path, **writer_options)
+
+    def close(self):
+        self.writer.stop()
+        self.pool.close()
+        self.conn.close()
+
+
+class ShardedStore:
+    """The open shards of a layout, and where a subject's or a session's rows live."""
+
+    def __init__(self, layout, pool_size=4, queries=None, **writer_options):
+        self.layout = layout
+        for i, path in enumerate(layout.paths):
+            prepare_shard(path, i, queries)
+        self.shards = [Shard(i, path, pool_size, **writer_options) for i, path in enumerate(layout.paths)]
+        # apps (the item registry) and other shared tables are read from here
+        self.home = self.shards[0]
+
+    def __len__(self):
+        return len(self.shards)
+
+    @property
+    def depth(self):
+        return sum(shard.writer.depth for shard in self.shards)
+
+    def for_subject(self, subject_id):
+        return self.shards[self.layout.shard_of(subject_id)]
+
+    async def fan_out(self, fn, *args, shards=None):
+        # [fn(cursor, *args) for each shard], run at once on pooled connections in worker threads
+        loop = asyncio.get_running_loop()
+
+        def run(shard):
+            with shard.pool.connection() as conn:
+                return fn(conn.cursor(), *args)
+        return await asyncio.gather(*[loop.run_in_executor(None, run, shard) for shard in (shards or self.shards)])
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def _table_columns(cur, schema, table):
+    return [row[1] for row in cur.execute(f'PRAGMA {schema}.table_info({table})').fetchall()]
+
+
+def split(db_path, root, n_shards, pins=None):
+    # Copy a single-file database into a new layout of n_shards shards; returns
+    # {table: rows copied}. The source is upgraded to the current schema first and is
+    # otherwise left as it is.
+    source = sqlite3.connect(db_path)
+    migrate(source)
+    max_ids = {table: source.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0] for table in ID_TABLES}
+    source.close()
+
+    layout = ShardLayout.create(root, n_shards, pins)
+    copied = {}
+    for i, path in enumerate(layout.paths):
+        prepare_shard(path, i)
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.create_function('shard_of', 1, layout.shard_of, deterministic=True)
+            conn.execute('ATTACH DATABASE ? AS source', (db_path,))
+            cur = conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            for table in SUBJECT_TABLES + SHARED_TABLES:
+                columns = [column for column in _table_columns(cur, 'source', table) if column in _table_columns(cur, 'main', table)]
+                where = ' WHERE shard_of(subject_id) = ?' if table in SUBJECT_TABLES else ''
+                cur.execute(f"INSERT OR REPLACE INTO main.{table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM source.{table}{where}",
+                            (i,) if where else ())
+                copied[table] = copied.get(table, 0) + cur.rowcount
+            # Ids already used by any shard stay unused by the others
+            reserve_ids(cur, i, max(max_ids.values()))
+            cur.execute('COMMIT')
+            cur.execute('DETACH DATABASE source')
+        finally:
+            conn.close()
+        logging.info(f"Shard {i} written to {path}")
+    for table in SHARED_TABLES:
+        copied[table] //= n_shards
+    return copied
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Manage sharded SQLite layouts.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    split_parser = commands.add_parser('split', help='copy a single database file into a new sharded layout')
+    split_parser.add_argument('database')
+    split_parser.add_argument('root', help='new layout directory, e.g. data/shards')
+    split_parser.add_argument('--shards', type=int, default=4)
+    split_parser.add_argument('--pin', action='append', default=[], metavar='SUBJECT=SHARD',
+                              help='place a subject on a given shard instead of its hash (repeatable)')
+    show_parser = commands.add_parser('show', help="print a layout's shards and where a subject lives")
+    show_parser.add_argument('root')
+    show_parser.add_argument('subject_id', nargs='*')
+    args = parser.parse_args()
+
+    if args.command == 'split':
+        pins = {subject_id: int(shard) for subject_id, shard in (pin.split('=', 1) for pin in args.pin)}
+        copied = split(args.database, args.root, args.shards, pins)
+        print(f"{args.database} split into {args.shards} shards under {args.root}: "
+              + ', '.join(f'{table} {n}' for table, n in copied.items()))
+    else:
+        layout = ShardLayout.load(args.root)
+        for i, path in enumerate(layout.paths):
+            print(f"shard {i}: {path}")
+        for subject_id in args.subject_id:
+            print(f"{subject_id}: shard {layout.shard_of(subject_id)}")
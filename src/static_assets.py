@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+
+# Serving side of the precompressed task pages built by scripts/build_tasks.py.
+#
+# The build directory mirrors tasks/ and adds content-hashed copies of the shared
+# scripts and stylesheets under assets/, each with .gz and (when brotli is installed)
+# .br variants next to it, plus a manifest. Everything listed in the manifest is
+# loaded into memory once; a request is a dict lookup, an Accept-Encoding choice and
+# one send. Hashed assets never change, so they are served as immutable and repeat
+# visits make no request for them at all; pages keep their URLs and carry an ETag
+# so an expired page costs a 304.
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+IMMUTABLE = 'public, max-age=31536000, immutable'
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]  # in order of preference
+
+
+def accepted_encodings(header):
+    # Content codings the client accepts (q > 0) from an Accept-Encoding header value
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+class _Entry:
+    __slots__ = ('content_type', 'cache_control', 'etag', 'variants')
+
+    def __init__(self, content_type, cache_control, etag, variants):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = etag
+        self.variants = variants  # {coding or None: bytes}
+
+
+class PrecompressedStatic:
+    """ASGI app serving a scripts/build_tasks.py build directory from memory."""
+
+    def __init__(self, directory, page_max_age_s=600):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported static manifest version {manifest.get('version')} in {directory}")
+        page_cache = f'public, max-age={page_max_age_s}'
+        self.entries = {}
+        n_bytes = 0
+        for rel_path, info in manifest['files'].items():
+            path = os.path.join(directory, rel_path)
+            variants = {}
+            with open(path, 'rb') as f:
+                variants[None] = f.read()
+            for coding, suffix in ENCODINGS:
+                if coding in info['encodings']:
+                    with open(path + suffix, 'rb') as f:
+                        variants[coding] = f.read()
+            n_bytes += sum(len(data) for data in variants.values())
+            cache_control = IMMUTABLE if info['immutable'] else page_cache
+            self.entries['/' + rel_path] = _Entry(info['content_type'], cache_control, info['etag'], variants)
+        logging.info(f"Serving {len(self.entries)} precompressed static files ({n_bytes} bytes) from {directory}")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        if scope['method'] not in ('GET', 'HEAD'):
+            await _send(send, 405, [(b'allow', b'GET, HEAD')], b'Method Not Allowed')
+            return
+        # Under a Mount the path may still carry the mount prefix (root_path)
+        path, root_path = scope['path'], scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        entry = self.entries.get(path)
+        if entry is None:
+            await _send(send, 404, [], b'Not Found')
+            return
+
+        headers = dict(scope['headers'])
+        accepted = accepted_encodings(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        coding = next((coding for coding, _ in ENCODINGS if coding in accepted and coding in entry.variants), None)
+        # One ETag per representation, so caches never mix up encodings
+        etag = f'"{entry.etag}-{coding}"' if coding else f'"{entry.etag}"'
+        response_headers = [
+            (b'content-type', entry.content_type.encode()),
+            (b'cache-control', entry.cache_control.encode()),
+            (b'etag', etag.encode()),
+            (b'vary', b'Accept-Encoding'),
+        ]
+        if _etag_matches(headers.get(b'if-none-match', b'').decode('latin-1'), etag):
+            await _send(send, 304, response_headers, b'')
+            return
+
+        body = entry.variants[coding]
+        if coding:
+            response_headers.append((b'content-encoding', coding.encode()))
+        await _send(send, 200, response_headers, b'' if scope['method'] == 'HEAD' else body, len(body))
+
+
+def _etag_matches(if_none_match, etag):
+    # Weak comparison, as If-None-Match calls for
+    tags = [tag.strip() for tag in if_none_match.split(',') if tag.strip()]
+    return any(tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+async def _send(send, status, headers, body, content_length=None):
+    if status != 304:
+        headers = headers + [(b'content-length', str(len(body) if content_length is None else content_length).encode())]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+# Chunked, hashed file uploads that never hold a whole recording in memory.
+#
+# Bytes are written in CHUNK_SIZE pieces on a worker thread, so the event loop keeps
+# serving other requests while a long recording is written. Files are assembled under
+# a temporary name and only renamed into place once complete.
+#
+# Resumable uploads live in <root>/.uploads as <upload_id>.part plus an <upload_id>.json
+# sidecar with the upload metadata; the number of bytes received is the size of the
+# .part file, so a dropped client asks for the offset and continues from there.
+
+CHUNK_SIZE = 1 << 20
+
+
+class UploadOffsetMismatch(Exception):
+    """Raised when a resumed upload does not continue at the stored offset."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload continues at offset {offset}")
+        self.offset = offset
+
+
+def _hash_file(path, hasher):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def remove_files(*paths):
+    # Delete whichever of paths exist; blocking, so callers on the event loop run it in a worker thread
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def write_chunks(chunks, path, mode='wb', hasher=None):
+    # Write an async iterator of byte chunks to path off the event loop; returns (hasher, bytes written)
+    hasher = hasher or hashlib.sha256()
+    size = 0
+    f = await run_in_threadpool(open, path, mode)
+    try:
+        pending = bytearray()
+        async for chunk in chunks:
+            pending += chunk
+            if len(pending) >= CHUNK_SIZE:
+                await run_in_threadpool(f.write, pending)
+                hasher.update(pending)
+                size += len(pending)
+                pending = bytearray()
+        if pending:
+            await run_in_threadpool(f.write, pending)
+            hasher.update(pending)
+            size += len(pending)
+        await run_in_threadpool(f.flush)
+    finally:
+        await run_in_threadpool(f.close)
+    return hasher, size
+
+
+async def read_upload_file(upload_file):
+    # Async chunk iterator over a Starlette UploadFile
+    while True:
+        chunk = await upload_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+class UploadStore:
+    def __init__(self, root):
+        self.partial_dir = os.path.join(root, '.uploads')
+        # upload_id -> (offset, sha256 of the first offset bytes) for uploads in progress
+        self._hashers = {}
+        self._locks = {}
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial_dir, f'{upload_id}.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.partial_dir, f'{upload_id}.json')
+
+    def _create(self, meta):
+        os.makedirs(self.partial_dir, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        with open(self._meta_path(upload_id), 'w') as f:
+            json.dump(meta, f)
+        open(self._part_path(upload_id), 'wb').close()
+        return upload_id
+
+    async def create(self, meta):
+        # Start a resumable upload; meta is stored as given (size may be None)
+        return await run_in_threadpool(self._create, meta)
+
+    def _status(self, upload_id):
+        if not all(c in '0123456789abcdef' for c in upload_id) or not os.path.exists(self._meta_path(upload_id)):
+            return None
+        with open(self._meta_path(upload_id)) as f:
+            meta = json.load(f)
+        meta['offset'] = os.path.getsize(self._part_path(upload_id))
+        return meta
+
+    async def status(self, upload_id):
+        # Upload metadata plus the current offset, or None for an unknown upload_id
+        return await run_in_threadpool(self._status, upload_id)
+
+    def lock(self, upload_id):
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    async def _hasher(self, upload_id, offset):
+        # Hash state at offset; rebuilt from the .part file after a restart
+        cached = self._hashers.get(upload_id)
+        if cached and cached[0] == offset:
+            return cached[1]
+        return await run_in_threadpool(_hash_file, self._part_path(upload_id), hashlib.sha256())
+
+    async def append(self, upload_id, offset, chunks):
+        # Append chunks at offset (must equal the bytes already received); returns the new offset
+        current = await run_in_threadpool(os.path.getsize, self._part_path(upload_id))
+        if offset != current:
+            raise UploadOffsetMismatch(current)
+        hasher = await self._hasher(upload_id, current)
+        self._hashers.pop(upload_id, None)
+        hasher, size = await write_chunks(chunks, self._part_path(upload_id), mode='ab', hasher=hasher)
+        self._hashers[upload_id] = (current + size, hasher)
+        return current + size
+
+    async def finish(self, upload_id):
+        # Hand over a completed upload: returns (path of the assembled file, sha256, size).
+        # The caller moves or deletes the file, then calls discard().
+        size = await run_in_threadpool(os.path.getsize, self._part_path(upload_id))
+        hasher = await self._hasher(upload_id, size)
+        return self._part_path(upload_id), hasher.hexdigest(), size
+
+    async def discard(self, upload_id):
+        self._hashers.pop(upload_id, None)
+        self._locks.pop(upload_id, None)
+        await run_in_threadpool(remove_files, self._part_path(upload_id), self._meta_path(upload_id))
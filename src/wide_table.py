@@ -0,0 +1,103 @@
+import json
+
+from src.archive import session_events
+
+# Incrementally materialized wide table behind GET /wide. Each finished session is
+# folded once into a wide_rows record of item_id__field -> last non-null value;
+# reads only fold the finished sessions that have no record yet. Folding reads archived
+# events too, so a late event for an archived session rebuilds the full record.
+
+SESSION_COLUMNS = ['session_id', 'ts_start_utc', 'ts_end_utc', 'app_id', 'app_version']
+
+
+def _flatten(payload, prefix, out):
+    # Same column naming as pd.json_normalize: nested keys are joined with '.'
+    for key, value in payload.items():
+        if isinstance(value, dict):
+            _flatten(value, f"{prefix}{key}.", out)
+        else:
+            out[f"{prefix}{key}"] = value
+
+
+def decode_payload(payload_json):
+    # Payloads are JSON text; anything that does not decode to an object is skipped
+    try:
+        payload = json.loads(payload_json)
+    except (TypeError, ValueError):
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def fold_session(cur, session_id):
+    # (Re)build the wide record for one session; returns False if the session is unknown
+    cur.execute('''
+    SELECT subject_id, app_id, app_version, ts_start_utc, ts_end_utc FROM sessions WHERE session_id = ?
+    ''', (session_id,))
+    session = cur.fetchone()
+    if not session:
+        return False
+    subject_id, app_id, app_version, ts_start_utc, ts_end_utc = session
+
+    row = {}
+    for item_id, payload_json in session_events(cur, session_id):
+        fields = {}
+        _flatten(decode_payload(payload_json), '', fields)
+        for field, value in fields.items():
+            if field != 'item_id' and value is not None:
+                row[f"{item_id}__{field}"] = value
+
+    cur.execute('''
+    INSERT OR REPLACE INTO wide_rows (session_id, subject_id, app_id, app_version, ts_start_utc, ts_end_utc, row_json)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (session_id, subject_id, app_id, app_version, ts_start_utc, ts_end_utc, json.dumps(row)))
+    return True
+
+
+def invalidate_session(cur, session_id):
+    # Events that arrive after a session was folded make its record stale
+    cur.execute('DELETE FROM wide_rows WHERE session_id = ?', (session_id,))
+
+
+def pending_sessions_query(subject_id, app_id):
+    return '''
+    SELECT s.session_id FROM sessions s
+    LEFT JOIN wide_rows w ON w.session_id = s.session_id
+    WHERE s.subject_id = ? AND s.app_id = ? AND s.ts_end_utc IS NOT NULL AND w.session_id IS NULL
+    ''', (subject_id, app_id)
+
+
+def pending_sessions(cur, subject_id, app_id):
+    # Finished sessions that are not folded yet
+    cur.execute(*pending_sessions_query(subject_id, app_id))
+    return [row[0] for row in cur.fetchall()]
+
+
+def wide_rows_query(subject_id, app_id, app_version=None, ts_from=None, ts_to=None):
+    query = '''
+    SELECT session_id, ts_start_utc, ts_end_utc, app_id, app_version, row_json
+    FROM wide_rows
+    WHERE subject_id = ? AND app_id = ?
+    '''
+    params = [subject_id, app_id]
+    if app_version is not None:
+        query += " AND app_version = ?"
+        params.append(app_version)
+    if ts_from is not None:
+        query += " AND ts_start_utc >= ?"
+        params.append(ts_from)
+    if ts_to is not None:
+        query += " AND ts_start_utc < ?"
+        params.append(ts_to)
+    query += " ORDER BY ts_start_utc"
+    return query, params
+
+
+def read_wide_rows(cur, subject_id, app_id, app_version=None, columns=None, ts_from=None, ts_to=None):
+    # Wide records ordered by session start, optionally projected and limited to a start-time range
+    records = []
+    for *session, row_json in cur.execute(*wide_rows_query(subject_id, app_id, app_version, ts_from, ts_to)).fetchall():
+        row = json.loads(row_json)
+        if columns is not None:
+            row = {col: row.get(col) for col in columns}
+        records.append({**dict(zip(SESSION_COLUMNS, session)), **row})
+    return records
@@ -31,27 +31,149 @@
     });
   }
 
+  // Events are buffered and sent to /events/batch once EVENT_BATCH_SIZE are waiting,
+  // before finishing the session and when the page is hidden. The timer is only a
+  // backstop for a page left open mid-task.
+  const EVENT_BATCH_SIZE = 50;
+  const EVENT_FLUSH_MS = 20000;
+  // Batches that fail with a network error, 429 or 5xx are retried with backoff (or
+  // after Retry-After); any other error status means the request itself was rejected
+  const MAX_SEND_ATTEMPTS = 5;
+  const RETRY_BASE_MS = 1000;
+  const RETRY_MAX_MS = 30000;
+  // Browsers refuse keepalive requests whose bodies exceed 64 KiB
+  const KEEPALIVE_MAX_BYTES = 60000;
+  let eventBuffer = [];
+  let inFlight = [];
+  let flushTimer = null;
+  let flushing = null;
+  let failedAttempts = 0;
+
+  function scheduleFlush(delayMs) {
+    if (flushTimer) clearTimeout(flushTimer);
+    flushTimer = setTimeout(flushEvents, delayMs);
+  }
+
+  function retryDelay(res) {
+    const retryAfter = res ? Number(res.headers.get('Retry-After')) : 0;
+    if (retryAfter > 0) return Math.min(retryAfter * 1000, RETRY_MAX_MS);
+    return Math.min(RETRY_BASE_MS * 2 ** (failedAttempts - 1), RETRY_MAX_MS);
+  }
+
   async function logEventGeneric({ eventType, itemId, eventIndex, payload }) {
     if (!window.current_session_id) throw new Error('Session not started');
     const tz = Intl.DateTimeFormat().resolvedOptions().timeZone;
     const ts = new Date().toISOString();
-    await fetch('/events', {
+    eventBuffer.push({
+      session_id: window.current_session_id,
+      event_index: eventIndex,
+      ts_utc: ts,
+      tz: tz,
+      event_type: eventType,
+      item_id: itemId,
+      payload_json: payload || {}
+    });
+    // While a retry is pending its timer sends the buffer
+    if (eventBuffer.length >= EVENT_BATCH_SIZE && !failedAttempts) {
+      await flushEvents();
+    } else if (!flushTimer) {
+      scheduleFlush(EVENT_FLUSH_MS);
+    }
+  }
+
+  function postBatch(batch, keepalive) {
+    return fetch('/events/batch', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        session_id: window.current_session_id,
-        event_index: eventIndex,
-        ts_utc: ts,
-        tz: tz,
-        event_type: eventType,
-        item_id: itemId,
-        payload_json: payload || {}
-      })
+      // Resent events are deduplicated server-side on (session_id, event_index)
+      headers: { 'Content-Type': 'application/json', 'Idempotency-Key': uuid.v4() },
+      body: JSON.stringify(batch),
+      keepalive: keepalive
     });
   }
 
+  async function flushEvents() {
+    if (flushTimer) {
+      clearTimeout(flushTimer);
+      flushTimer = null;
+    }
+    // Serialize flushes so batches arrive in order
+    while (flushing) await flushing;
+    if (!eventBuffer.length) return;
+    const batch = eventBuffer;
+    eventBuffer = [];
+    inFlight = batch;
+    flushing = (async () => {
+      let res = null;
+      try {
+        res = await postBatch(batch, false);
+      } catch (err) {
+        console.error(err);
+      }
+      inFlight = [];
+      if (res && res.ok) {
+        failedAttempts = 0;
+        return;
+      }
+      if (res && res.status !== 429 && res.status < 500) {
+        // Per-event errors come back as 200, so sending this batch again cannot succeed
+        console.error('Dropped ' + batch.length + ' events: ' + res.status + ' ' + await res.text());
+        failedAttempts = 0;
+        return;
+      }
+      failedAttempts += 1;
+      if (failedAttempts >= MAX_SEND_ATTEMPTS) {
+        console.error('Dropped ' + batch.length + ' events after ' + failedAttempts + ' attempts');
+        failedAttempts = 0;
+        return;
+      }
+      // Put the batch back in front of anything logged meanwhile and retry after a pause
+      eventBuffer = batch.concat(eventBuffer);
+      scheduleFlush(retryDelay(res));
+    })();
+    try {
+      await flushing;
+    } finally {
+      flushing = null;
+    }
+  }
+
+  function keepaliveChunks(events) {
+    // Consecutive runs of events whose JSON array stays under KEEPALIVE_MAX_BYTES
+    const encoder = new TextEncoder();
+    const chunks = [];
+    let chunk = [];
+    let bytes = 2;
+    for (const event of events) {
+      const size = encoder.encode(JSON.stringify(event)).length + 1;
+      if (chunk.length && bytes + size > KEEPALIVE_MAX_BYTES) {
+        chunks.push(chunk);
+        chunk = [];
+        bytes = 2;
+      }
+      chunk.push(event);
+      bytes += size;
+    }
+    if (chunk.length) chunks.push(chunk);
+    return chunks;
+  }
+
+  function sendOnPageHide() {
+    // Sent at once: a flush still awaiting its response may never finish once the page is
+    // gone, so its events go out again here and the server drops the duplicates
+    if (flushTimer) {
+      clearTimeout(flushTimer);
+      flushTimer = null;
+    }
+    const events = inFlight.concat(eventBuffer);
+    eventBuffer = [];
+    for (const chunk of keepaliveChunks(events)) {
+      postBatch(chunk, true).catch((err) => console.error(err));
+    }
+  }
+
   async function finishSession() {
     if (!window.current_session_id) return;
+    await flushEvents();
     const tsEnd = new Date().toISOString();
     await fetch('/sessions/finish', {
       method: 'POST',
@@ -60,6 +182,8 @@
     });
   }
 
+  window.addEventListener('pagehide', sendOnPageHide);
+
   window.initializeSessionMetadata = async function(appId, appType) {
     if (!window.current_session_id) {
       await startSession(appId, appType);
@@ -67,4 +191,5 @@
   };
   window.logEventGeneric = logEventGeneric;
   window.finishSession = finishSession;
+  window.flushEvents = flushEvents;
 })();
@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from benchmarks.synthetic import make_database
+from src.migrations import full_scans, hot_queries, migrate
+import src.main as main
+
+
+@pytest.fixture(params=['empty', 'analyzed'])
+def conn(request, tmp_path):
+    # A fresh schema, and one with data and planner statistics (ANALYZE can change plans)
+    path = str(tmp_path / 'plans.db')
+    if request.param == 'empty':
+        conn = sqlite3.connect(path)
+        migrate(conn)
+    else:
+        make_database(path, n_subjects=40, n_days=2)
+        conn = sqlite3.connect(path)
+        conn.execute('ANALYZE')
+    yield conn
+    conn.close()
+
+
+def test_storage_queries_use_indexes(conn):
+    assert full_scans(conn) == {}
+
+
+def test_api_queries_use_indexes(conn):
+    queries = main.hot_queries()
+    # The listing and export queries come from the builders the endpoints use
+    assert {'sessions_page_subject_app_range', 'export_events_by_subject', 'wide_rows_range'} <= set(queries)
+    assert full_scans(conn, queries) == {}
+
+
+def test_feature_store_probe_is_a_range_search(conn):
+    # Not a scan is not enough: event_id must bound the search, not filter every row of the app
+    sql, params = hot_queries()['feature_store_new_sessions']
+    plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+    assert 'SEARCH events USING INDEX idx_events_app (app_id=? AND event_id>?)' in plan
+
+
+@pytest.mark.parametrize('index, queries', [
+    ('idx_events_subject', {'export_events_by_subject', 'export_events_by_subject_range'}),
+    ('idx_events_app', {'feature_store_new_sessions', 'export_events_by_app'}),
+])
+def test_dropped_index_is_reported(conn, index, queries):
+    conn.execute(f'DROP INDEX {index}')
+    assert set(full_scans(conn)) == queries
@@ -0,0 +1,142 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.config import Config
+from src.main import create_app
+from src.schedule import TS_FORMAT, assign_plan, compile_plan, load_library, store_plan, utc_key
+
+
+def make_plan(schedule, duration_days=2):
+    # The parts of an experiment_LLM/schema.json plan the compiler reads
+    return {
+        'metadata': {'tunables': {}},
+        'design': {'duration_days': duration_days},
+        'instruments': [],
+        'schedule': [{'day_index': day, 'time_window': window, 'task_library_id': library_id,
+                      'estimated_minutes': 1, 'instruction': library_id} for day, window, library_id in schedule],
+    }
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = Config(db_path=str(tmp_path / 'schedule.db'), speech_root=str(tmp_path / 'raw'))
+    with TestClient(create_app(config)) as client:
+        client.db_path = config.db_path
+        yield client
+
+
+def assign(db_path, subject_id, plan, start_date):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        slots = compile_plan(plan, load_library(), start_date)
+        cur = conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        store_plan(cur, 'test', plan)
+        assign_plan(cur, subject_id, 'test', slots)
+        cur.execute('COMMIT')
+    finally:
+        conn.close()
+    return slots
+
+
+def done_slots(db_path, subject_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT day_index, library_id, done_session_id FROM task_slots '
+                            'WHERE subject_id = ? AND done_session_id IS NOT NULL', (subject_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def start_session(app, subject_id, app_id):
+    response = app.post('/sessions/start', json={'subject_id': subject_id, 'app_id': app_id, 'app_type': 'survey'})
+    assert response.status_code == 200
+    return response.json()['session_id']
+
+
+def now_utc():
+    return datetime.utcnow().strftime(TS_FORMAT)
+
+
+def test_utc_key():
+    assert utc_key('2025-01-06T06:30:00-05:00') == '2025-01-06T11:30:00Z'
+    assert utc_key('2025-01-06 11:30:00.123Z') == '2025-01-06T11:30:00Z'
+    with pytest.raises(ValueError):
+        utc_key('garbage')
+
+
+def test_compile_plan_local_windows():
+    plan = make_plan([(1, 'morning', 'cog.pvt.v1'), (1, 'evening', 'survey.daily_core.v1'), (2, 'evening', 'survey.daily_core.v1')])
+    slots = compile_plan(plan, load_library(), date(2025, 1, 6), 'America/New_York')
+    assert [(slot[0], slot[2], slot[4], slot[7], slot[8]) for slot in slots] == [
+        (1, 'morning', 'pvt_1min_v1', '2025-01-06T11:00:00Z', '2025-01-06T15:00:00Z'),
+        (1, 'evening', 'daily_core', '2025-01-07T00:00:00Z', '2025-01-07T03:00:00Z'),
+        (2, 'evening', 'daily_core', '2025-01-08T00:00:00Z', '2025-01-08T03:00:00Z'),
+    ]
+
+
+def test_due_tasks(app):
+    today = datetime.utcnow().date()
+    assign(app.db_path, 'S1', make_plan([(1, 'anytime', 'survey.daily_core.v1'), (1, 'anytime', 'cog.pvt.v1'),
+                                         (2, 'anytime', 'cog.stroop.v1')]), today)
+
+    body = app.get('/subjects/S1/due').json()
+    assert sorted(slot['library_id'] for slot in body['due']) == ['cog.pvt.v1', 'survey.daily_core.v1']
+    assert body['next']['library_id'] == 'cog.stroop.v1'
+
+    tomorrow = (today + timedelta(days=1)).isoformat()
+    body = app.get('/subjects/S1/due', params={'at': f'{tomorrow}T12:00:00Z'}).json()
+    assert [slot['library_id'] for slot in body['due']] == ['cog.stroop.v1']
+    assert body['next'] is None
+
+    assert app.get('/subjects/S2/due').json()['due'] == []
+    assert app.get('/subjects/S1/due', params={'at': 'garbage'}).status_code == 400
+
+
+def test_finish_marks_one_slot(app):
+    today = datetime.utcnow().date()
+    assign(app.db_path, 'S1', make_plan([(1, 'anytime', 'survey.daily_core.v1'), (1, 'anytime', 'cog.pvt.v1'),
+                                         (2, 'anytime', 'survey.daily_core.v1')]), today)
+    session_id = start_session(app, 'S1', 'daily_core')
+    assert app.post('/sessions/finish', json={'session_id': session_id, 'ts_end_utc': now_utc()}).status_code == 200
+    assert done_slots(app.db_path, 'S1') == [(1, 'survey.daily_core.v1', session_id)]
+
+
+def test_finish_without_plan(app):
+    session_id = start_session(app, 'S1', 'daily_core')
+    assert app.post('/sessions/finish', json={'session_id': session_id, 'ts_end_utc': now_utc()}).status_code == 200
+    assert done_slots(app.db_path, 'S1') == []
+
+
+def test_finish_with_malformed_end_time(app):
+    assign(app.db_path, 'S1', make_plan([(1, 'anytime', 'survey.daily_core.v1')]), datetime.utcnow().date())
+    session_id = start_session(app, 'S1', 'daily_core')
+
+    response = app.post('/sessions/finish', json={'session_id': session_id, 'ts_end_utc': 'garbage'})
+    assert response.status_code == 400
+    conn = sqlite3.connect(app.db_path)
+    assert conn.execute('SELECT ts_end_utc FROM sessions WHERE session_id = ?', (session_id,)).fetchone() == (None,)
+    conn.close()
+    assert done_slots(app.db_path, 'S1') == []
+
+    # The session is still open: events are logged as before and a valid finish completes the slot
+    event = {'session_id': session_id, 'event_index': 0, 'ts_utc': now_utc(), 'event_type': 'response',
+             'item_id': 'happiness_1to5', 'payload_json': {'value': 4}}
+    assert app.post('/events', json=event).json() == {'status': 'event logged'}
+    response = app.post('/sessions/finish', json={'session_id': session_id, 'ts_end_utc': now_utc()})
+    assert response.status_code == 200
+    assert response.json()['summary']['events'] == 1
+    assert done_slots(app.db_path, 'S1') == [(1, 'survey.daily_core.v1', session_id)]
+
+
+def test_legacy_complete_with_malformed_end_time(app):
+    assign(app.db_path, 'S1', make_plan([(1, 'anytime', 'survey.daily_core.v1')]), datetime.utcnow().date())
+    response = app.post('/api/session_complete', json={
+        'subject_id': 'S1', 'session_id': 'legacy-1', 'app_id': 'daily_core', 'app_type': 'survey',
+        'started_ts_utc': now_utc(), 'ended_ts_utc': 'garbage', 'tz': 'UTC', 'summary': {}, 'events_count': 0})
+    # Legacy clients may send any string; it is stored, and no slot is marked done
+    assert response.status_code == 200
+    assert done_slots(app.db_path, 'S1') == []
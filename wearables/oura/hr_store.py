@@ -0,0 +1,169 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from wearables.oura.oura import HR_KEY, read_export
+
+# Per-subject heart-rate store on a fixed one-minute UTC grid.
+#
+# <root>/<subject_id>/meta.json   grid start (epoch minutes) and length
+# <root>/<subject_id>/bpm.f32     float32 mean bpm per minute, NaN where there is no data
+# <root>/<subject_id>/source.i8   int8 source code of the last sample in the minute, -1 where there is no data
+#
+# The grid always covers whole UTC days, so every resolution up to daily is a reshape
+# of the memory-mapped arrays. New exports are merged in place; minutes they cover
+# replace what was stored before.
+
+SOURCE_CODES = {'awake': 1, 'rest': 2, 'sleep': 3, 'session': 4, 'live': 5, 'workout': 6}
+SOURCE_NAMES = {code: name for name, code in SOURCE_CODES.items()}
+NO_DATA = -1
+UNKNOWN_SOURCE = 0
+
+MINUTES_PER_DAY = 1440
+RESOLUTIONS = {'raw': 1, '5min': 5, 'hourly': 60, 'daily': MINUTES_PER_DAY}
+
+
+def _epoch_minutes(ts):
+    ts = pd.Timestamp(ts)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return int(ts.to_datetime64().astype('datetime64[m]').astype(np.int64))
+
+
+class HeartRateStore:
+    def __init__(self, root, subject_id):
+        self.path = os.path.join(root, str(subject_id))
+        self._meta_path = os.path.join(self.path, 'meta.json')
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {'start_minute': None, 'n_minutes': 0}
+
+    @property
+    def start_minute(self):
+        return self.meta['start_minute']
+
+    @property
+    def n_minutes(self):
+        return self.meta['n_minutes']
+
+    def _array_path(self, name):
+        return os.path.join(self.path, {'bpm': 'bpm.f32', 'source': 'source.i8'}[name])
+
+    def _open(self, name, mode='r'):
+        dtype = np.float32 if name == 'bpm' else np.int8
+        return np.memmap(self._array_path(name), dtype=dtype, mode=mode, shape=(self.n_minutes,))
+
+    def _save_meta(self):
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _resize(self, first_minute, last_minute):
+        # Grow the grid (whole days) so it covers [first_minute, last_minute]
+        start = first_minute - first_minute % MINUTES_PER_DAY
+        end = last_minute - last_minute % MINUTES_PER_DAY + MINUTES_PER_DAY
+        if self.start_minute is not None:
+            start = min(start, self.start_minute)
+            end = max(end, self.start_minute + self.n_minutes)
+        n_minutes = end - start
+        if self.start_minute == start and self.n_minutes == n_minutes:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        prepend = 0 if self.start_minute is None else self.start_minute - start
+        append = n_minutes - self.n_minutes - prepend
+        for name, fill in (('bpm', np.float32(np.nan)), ('source', np.int8(NO_DATA))):
+            path = self._array_path(name)
+            if prepend:
+                # Rare: data older than the grid start; rewrite the file shifted
+                old = np.fromfile(path, dtype=type(fill))
+                np.concatenate([np.full(prepend, fill), old, np.full(append, fill)]).tofile(path)
+            else:
+                with open(path, 'ab') as f:
+                    np.full(append, fill).tofile(f)
+        self.meta.update(start_minute=start, n_minutes=n_minutes)
+        self._save_meta()
+
+    def append(self, hrdf):
+        # Merge raw samples (timestamp, bpm, source) into the grid; returns the number of minutes written
+        if hrdf.empty:
+            return 0
+        timestamps = pd.to_datetime(hrdf['timestamp'], format='ISO8601', utc=True)
+        minutes = timestamps.dt.tz_localize(None).to_numpy().astype('datetime64[m]').astype(np.int64)
+        bpm = hrdf['bpm'].to_numpy(dtype='float64')
+        sources = hrdf['source'].astype(object).map(SOURCE_CODES).fillna(UNKNOWN_SOURCE).to_numpy(dtype=np.int8)
+
+        order = np.argsort(minutes, kind='stable')
+        minutes, bpm, sources = minutes[order], bpm[order], sources[order]
+        unique_minutes, first, counts = np.unique(minutes, return_index=True, return_counts=True)
+        valid = ~np.isnan(bpm)
+        sums = np.add.reduceat(np.where(valid, bpm, 0), first)
+        n_valid = np.add.reduceat(valid.astype(np.int64), first)
+        minute_bpm = np.where(n_valid > 0, sums / np.maximum(n_valid, 1), np.nan)
+        minute_source = sources[first + counts - 1]
+
+        self._resize(int(unique_minutes[0]), int(unique_minutes[-1]))
+        offsets = unique_minutes - self.start_minute
+        bpm_map, source_map = self._open('bpm', 'r+'), self._open('source', 'r+')
+        bpm_map[offsets] = minute_bpm
+        source_map[offsets] = minute_source
+        bpm_map.flush()
+        source_map.flush()
+        return len(unique_minutes)
+
+    def ingest_export(self, data_dir):
+        # Append the heart-rate CSV of an Oura export folder or .zip
+        return self.append(read_export(data_dir, [HR_KEY])[HR_KEY])
+
+    def _slice(self, name, first, last, fill):
+        # Values for grid offsets [first, last), padded with fill outside the stored range
+        out = np.full(last - first, fill, dtype=np.float32 if name == 'bpm' else np.int8)
+        lo, hi = max(first, 0), min(last, self.n_minutes)
+        if lo < hi:
+            out[lo - first:hi - first] = self._open(name)[lo:hi]
+        return out
+
+    def window(self, start, end, resolution='raw'):
+        # Heart rate for [start, end) at 'raw', '5min', 'hourly' or 'daily' resolution.
+        # Bins are aligned to the resolution in UTC; the minute count and compliance
+        # of each bin are the number and share of its minutes with data.
+        step = RESOLUTIONS[resolution]
+        first = _epoch_minutes(start)
+        last = _epoch_minutes(end)
+        first -= first % step
+        last += -last % step
+        index = pd.DatetimeIndex(np.arange(first, last, step).astype('datetime64[m]'), name='timestamp').tz_localize('UTC')
+        if self.start_minute is None:
+            return pd.DataFrame({'bpm': np.nan, 'minutes_with_data': 0, 'compliance': 0.0}, index=index)
+
+        bpm = self._slice('bpm', first - self.start_minute, last - self.start_minute, np.nan)
+        if step == 1:
+            source = self._slice('source', first - self.start_minute, last - self.start_minute, NO_DATA)
+            return pd.DataFrame({
+                'bpm': bpm,
+                'source': pd.Categorical.from_codes(np.where(source > 0, source - 1, -1), categories=list(SOURCE_CODES)),
+            }, index=index)
+
+        bins = bpm.reshape(-1, step)
+        has_data = ~np.isnan(bins)
+        minutes_with_data = has_data.sum(axis=1)
+        sums = np.where(has_data, bins, 0).sum(axis=1, dtype=np.float64)
+        mean_bpm = np.divide(sums, minutes_with_data, out=np.full(len(bins), np.nan), where=minutes_with_data > 0)
+        return pd.DataFrame({
+            'bpm': mean_bpm,
+            'minutes_with_data': minutes_with_data,
+            'compliance': minutes_with_data / step,
+        }, index=index)
+
+    def compliance(self, start=None, end=None):
+        # Daily minutes with data and compliance over the whole store or a date range
+        if self.start_minute is None:
+            return pd.DataFrame(columns=['minutes_with_data', 'compliance'])
+        start = start if start is not None else pd.Timestamp(self.start_minute, unit='m', tz='UTC')
+        end = end if end is not None else pd.Timestamp(self.start_minute + self.n_minutes, unit='m', tz='UTC')
+        return self.window(start, end, 'daily')[['minutes_with_data', 'compliance']]
@@ -1,36 +1,100 @@
-import pandas as pd
+import hashlib
+import json
 import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+USE_KEYS = ['dailysleep', 'dailyresilience', 'dailystress', 'dailyreadiness', 'sleep', 'dailyspo2', 'dailycardiovascularage', 'dailyactivity']
+HR_KEY = 'heartrate'
+
+# Explicit dtypes: heart rate is the big file, and the sleep series strings are digit
+# runs that would otherwise be parsed as (overflowing) integers
+READ_KWARGS = {
+    HR_KEY: {'usecols': ['timestamp', 'bpm', 'source'], 'dtype': {'timestamp': str, 'bpm': 'float32', 'source': 'category'}},
+    'sleep': {'dtype': {'movement_30_sec': str, 'sleep_phase_5_min': str}},
+}
+
+# Bump when the parsing below changes so old cache entries are not reused
+CACHE_VERSION = 1
+
+
+def _file_key(path, stamps):
+    # Content hash of a file, only recomputed when its size or mtime changes
+    stat = os.stat(path)
+    stamp = stamps.get(path)
+    if stamp and stamp['size'] == stat.st_size and stamp['mtime_ns'] == stat.st_mtime_ns:
+        return stamp['sha256']
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    stamps[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha.hexdigest()}
+    return stamps[path]['sha256']
+
+
+def _find_sources(data_dir, stamps, families=None):
+    # {family: (member or path, content key)} for the CSV families that are used.
+    # Zip members are keyed by their stored CRC and size, so nothing is decompressed.
+    families = set(families or USE_KEYS + [HR_KEY])
+    sources = {}
+    if zipfile.is_zipfile(data_dir):
+        with zipfile.ZipFile(data_dir) as zf:
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                key = name.split('_')[0]
+                if name.endswith('.csv') and key in families:
+                    sources[key] = (info.filename, f"{info.CRC:08x}-{info.file_size}")
+    else:
+        for file in os.listdir(data_dir):
+            key = file.split('_')[0]
+            if file.endswith('.csv') and key in families:
+                path = os.path.join(data_dir, file)
+                sources[key] = (path, _file_key(path, stamps) if stamps is not None else None)
+    return sources
+
 
+def _read_sources(data_dir, sources):
+    # Only the families in sources are read; zip members are streamed without extracting
+    frames = {}
+    if zipfile.is_zipfile(data_dir):
+        with zipfile.ZipFile(data_dir) as zf:
+            for key, (member, _) in sources.items():
+                with zf.open(member) as f:
+                    frames[key] = pd.read_csv(f, **READ_KWARGS.get(key, {}))
+    else:
+        for key, (path, _) in sources.items():
+            frames[key] = pd.read_csv(path, **READ_KWARGS.get(key, {}))
+    return frames
 
-def load_oura_data(data_dir):
-    files = os.listdir(data_dir)
-    csv_files = [os.path.join(data_dir, file) for file in files if file.endswith('.csv')]
-    use_keys = ['dailysleep', 'dailyresilience', 'dailystress', 'dailyreadiness', 'sleep', 'dailyspo2', 'dailycardiovascularage', 'dailyactivity']
-    hr_key = ['heartrate']
-
-    df_dict = {}
-    for fn in csv_files:
-        tdf = pd.read_csv(fn)
-        key = fn.split('/')[-1].split('_')[0]
-        if key in use_keys:
-            df_dict[key] = tdf
-        elif key in hr_key:
-            hrdf = tdf
-
-    # Format Heartrate
-    hrdf['timestamp'] = pd.to_datetime(hrdf['timestamp'])
-    hrdf['day'] = hrdf['timestamp'].dt.date
-    hrdf['minute'] = hrdf['timestamp'].dt.floor('T')  # Floor to the nearest minute
-    unique_minutes = hrdf.groupby(['day', 'minute']).size().reset_index(name='count')
-    compliance = unique_minutes.groupby('day').size().reset_index(name='minutes_with_data')
-    compliance['compliance'] = (compliance['minutes_with_data'] / 1440)  # 1440 minutes in a day
-    mean_bpm = hrdf.groupby('day')['bpm'].mean().reset_index(name='bpm')
-    hr_daily = pd.merge(mean_bpm, compliance, on='day').set_index('day')
 
+def read_export(data_dir, families):
+    # {family: raw DataFrame} for the requested CSV families of an export folder or .zip
+    return _read_sources(data_dir, _find_sources(data_dir, None, families))
 
+
+def daily_heart_rate(hrdf):
+    # Daily (UTC) mean bpm and compliance: the share of the 1440 minutes with at least one sample
+    timestamps = pd.to_datetime(hrdf['timestamp'], format='ISO8601', utc=True)
+    minutes = timestamps.dt.tz_localize(None).to_numpy().astype('datetime64[m]').astype(np.int64)
+    days = minutes // 1440
+
+    hr_daily = pd.DataFrame({'bpm': pd.Series(hrdf['bpm'].to_numpy(dtype='float64')).groupby(days).mean()})
+    minute_days, minutes_with_data = np.unique(np.unique(minutes) // 1440, return_counts=True)
+    hr_daily['minutes_with_data'] = pd.Series(minutes_with_data, index=minute_days)
+    hr_daily['compliance'] = hr_daily['minutes_with_data'] / 1440  # 1440 minutes in a day
+    hr_daily.index = pd.Index(pd.to_datetime(hr_daily.index, unit='D').date, name='day')
+    return hr_daily
+
+
+def _combine(frames):
     # Combine and merge for each day
-    processed_dfs = [hr_daily]
-    for key, df in df_dict.items():
+    processed_dfs = [daily_heart_rate(frames[HR_KEY])]
+    for key in USE_KEYS:
+        if key not in frames:
+            continue
+        df = frames[key]
         df['day'] = pd.to_datetime(df['day']).dt.date
         numeric_cols = df.select_dtypes(include='number').columns
         if len(numeric_cols) == 0: continue
@@ -38,7 +102,45 @@ def load_oura_data(data_dir):
         df_renamed = df.rename(columns={col: f"{col}-{key}" for col in numeric_cols})
         processed_dfs.append(df_renamed)
 
-    combined_df = pd.concat(processed_dfs, axis=1)
-    return combined_df
+    return pd.concat(processed_dfs, axis=1)
 
 
+def load_oura_data(data_dir, cache_dir=None):
+    # data_dir is an extracted Oura export folder or the export .zip itself. The combined
+    # daily frame is cached as Parquet keyed by the content hashes of the files used.
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_dir)), '.oura_cache')
+    stamps_path = os.path.join(cache_dir, 'stamps.json')
+    stamps = {}
+    if os.path.exists(stamps_path):
+        with open(stamps_path) as f:
+            stamps = json.load(f)
+
+    known_stamps = dict(stamps)
+    sources = _find_sources(data_dir, stamps)
+    if stamps != known_stamps:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(stamps_path, 'w') as f:
+            json.dump(stamps, f)
+    if HR_KEY not in sources:
+        raise FileNotFoundError(f"No {HR_KEY}_*.csv in {data_dir}")
+    cache_key = hashlib.sha256(json.dumps([CACHE_VERSION, sorted((k, v[1]) for k, v in sources.items())]).encode()).hexdigest()[:24]
+    cache_path = os.path.join(cache_dir, f'daily-{cache_key}.parquet')
+
+    if os.path.exists(cache_path):
+        try:
+            combined_df = pd.read_parquet(cache_path)
+            combined_df.index = pd.Index(pd.to_datetime(combined_df.index).date, name='day')
+            return combined_df
+        except ImportError:
+            pass
+
+    combined_df = _combine(_read_sources(data_dir, sources))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        combined_df.set_axis(pd.to_datetime(combined_df.index), axis=0).to_parquet(cache_path)
+    except ImportError:
+        # No Parquet engine installed: still works, just without the cache
+        pass
+    return combined_df
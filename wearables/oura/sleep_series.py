@@ -0,0 +1,302 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from wearables.oura.oura import read_export
+
+# Per-night series of the Oura sleep_*.csv export, decoded into flat arrays.
+#
+# heart_rate and hrv are Python-repr dicts ({'interval': 300.0, 'items': [...], 'timestamp': ...})
+# and sleep_phase_5_min / movement_30_sec are digit strings. Each series is kept CSR-style:
+# one flat values array for all nights plus offsets, so night i is values[offsets[i]:offsets[i + 1]],
+# sampled every interval[i] seconds from start[i] (epoch seconds, UTC).
+#
+# Nothing is eval'd: the dicts are split with regexes and all nights of a column are parsed
+# by a single numpy call, so a cohort-year of nights is a few vectorized passes.
+
+# name: (dtype, interval in seconds for the digit strings; the dicts carry their own)
+SERIES = {
+    'heart_rate': (np.float32, None),
+    'hrv': (np.float32, None),
+    'sleep_phase_5_min': (np.int8, 300.0),
+    'movement_30_sec': (np.int8, 30.0),
+}
+PHASE_CODES = {'deep': 1, 'light': 2, 'rem': 3, 'awake': 4}
+RESTLESS_MOVEMENT = 3  # movement codes run from 1 (still) to 4 (restless)
+STORE_VERSION = 1
+
+NIGHT_COLUMNS = ['id', 'day', 'type', 'bedtime_start', 'bedtime_end', 'utc_offset_min']
+
+
+def _epoch_seconds(strings):
+    timestamps = pd.to_datetime(strings, format='ISO8601', utc=True)
+    return timestamps.dt.tz_localize(None).to_numpy().astype('datetime64[s]').astype(np.int64)
+
+
+def _utc_offset_minutes(strings):
+    # Local offset of ISO timestamps like 2025-07-17T01:04:28-07:00 ('Z' and missing are UTC)
+    parts = strings.str.extract(r'([+-])(\d\d):?(\d\d)$')
+    sign = np.where(parts[0] == '-', -1, 1)
+    minutes = parts[1].astype(float).fillna(0) * 60 + parts[2].astype(float).fillna(0)
+    return (sign * minutes).to_numpy(dtype=np.int16)
+
+
+def _parse_dict_series(strings, fallback_start):
+    # {'interval': ..., 'items': [...], 'timestamp': ...} strings -> (values, lengths, start, interval)
+    strings = strings.fillna('').astype(str)
+    items = strings.str.extract(r"'items':\s*\[([^\]]*)\]")[0].fillna('').str.strip()
+    interval = strings.str.extract(r"'interval':\s*([0-9.eE+-]+)")[0].astype(float).to_numpy()
+    timestamps = strings.str.extract(r"'timestamp':\s*'([^']*)'")[0].fillna(fallback_start)
+
+    lengths = np.where(items == '', 0, items.str.count(',') + 1)
+    joined = ','.join(items[lengths > 0]).replace('None', 'nan')
+    values = np.fromstring(joined, dtype=np.float32, sep=',') if joined else np.empty(0, np.float32)
+    if len(values) != lengths.sum():
+        raise ValueError("Malformed sleep series items")
+    return values, lengths, _epoch_seconds(timestamps), interval
+
+
+def _parse_digit_series(strings):
+    # '4441114...' strings -> (int8 values, lengths); one byte per sample
+    strings = strings.fillna('').astype(str)
+    joined = ''.join(strings).encode('ascii')
+    values = (np.frombuffer(joined, dtype=np.uint8) - ord('0')).astype(np.int8)
+    if ((values < 0) | (values > 9)).any():
+        raise ValueError("Non-digit sample in sleep series")
+    return values, strings.str.len().to_numpy()
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def parse_sleep(sleepdf):
+    # SleepSeries for a raw sleep_*.csv frame (one row per sleep period)
+    sleepdf = sleepdf.reset_index(drop=True)
+    bedtime_start = sleepdf['bedtime_start'].astype(str)
+    nights = pd.DataFrame({
+        'id': sleepdf['id'].astype(str),
+        'day': sleepdf['day'].astype(str),
+        'type': sleepdf['type'].astype(str),
+        'bedtime_start': _epoch_seconds(bedtime_start),
+        'bedtime_end': _epoch_seconds(sleepdf['bedtime_end'].astype(str)),
+        'utc_offset_min': _utc_offset_minutes(bedtime_start),
+    })
+
+    arrays = {}
+    for name, (dtype, interval) in SERIES.items():
+        if name not in sleepdf:
+            values, lengths = np.empty(0, dtype), np.zeros(len(sleepdf), dtype=np.int64)
+            start, intervals = nights['bedtime_start'].to_numpy(), np.full(len(sleepdf), np.nan)
+        elif interval is None:
+            values, lengths, start, intervals = _parse_dict_series(sleepdf[name], bedtime_start)
+        else:
+            values, lengths = _parse_digit_series(sleepdf[name])
+            start, intervals = nights['bedtime_start'].to_numpy(), np.full(len(sleepdf), interval)
+        arrays[name] = {
+            'values': values.astype(dtype, copy=False),
+            'offsets': _offsets(lengths),
+            'start': start,
+            'interval': intervals.astype(np.float32),
+        }
+    return SleepSeries(nights, arrays)
+
+
+def load_sleep_series(data_dir):
+    # SleepSeries for an Oura export folder or .zip
+    frames = read_export(data_dir, ['sleep'])
+    if 'sleep' not in frames:
+        raise FileNotFoundError(f"No sleep_*.csv in {data_dir}")
+    return parse_sleep(frames['sleep'])
+
+
+def _segments(arr):
+    # Night number and position within the night of every value of a series
+    lengths = np.diff(arr['offsets'])
+    night = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(len(arr['values'])) - np.repeat(arr['offsets'][:-1], lengths)
+    return lengths, night, position
+
+
+def _first_position(night, position, mask, n_nights, last=False):
+    # Position of the first (or last) value per night where mask holds, -1 if none
+    out = np.full(n_nights, -1, dtype=np.int64)
+    idx = np.flatnonzero(mask)
+    if last:
+        idx = idx[::-1]
+    nights_hit, first = np.unique(night[idx], return_index=True)
+    out[nights_hit] = position[idx[first]]
+    return out
+
+
+def _nan_stats(arr, n_nights):
+    # Per-night count, mean and least-squares slope (per hour) of the non-NaN values
+    _, night, position = _segments(arr)
+    values = arr['values'].astype(np.float64)
+    valid = ~np.isnan(values)
+    night, values = night[valid], values[valid]
+    hours = position[valid] * arr['interval'][night].astype(np.float64) / 3600
+
+    n = np.bincount(night, minlength=n_nights).astype(np.float64)
+    sum_y = np.bincount(night, weights=values, minlength=n_nights)
+    sum_t = np.bincount(night, weights=hours, minlength=n_nights)
+    sum_tt = np.bincount(night, weights=hours * hours, minlength=n_nights)
+    sum_ty = np.bincount(night, weights=hours * values, minlength=n_nights)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sum_y / n
+        slope = (n * sum_ty - sum_t * sum_y) / (n * sum_tt - sum_t * sum_t)
+    slope[n < 2] = np.nan
+    return n, mean, slope, (night, values, position[valid])
+
+
+class SleepSeries:
+    def __init__(self, nights, arrays):
+        self.nights = nights
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.nights)
+
+    def save(self, path):
+        # One .npz per subject; strings are stored as fixed-width unicode so no pickling is needed
+        columns = {f'nights.{col}': self.nights[col].to_numpy(dtype=str if col in ('id', 'day', 'type') else None)
+                   for col in NIGHT_COLUMNS}
+        for name, arr in self.arrays.items():
+            columns.update({f'{name}.{key}': value for key, value in arr.items()})
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, version=STORE_VERSION, **columns)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != STORE_VERSION:
+                raise ValueError(f"{path} has sleep store version {int(data['version'])}, expected {STORE_VERSION}")
+            nights = pd.DataFrame({col: data[f'nights.{col}'] for col in NIGHT_COLUMNS})
+            for col in ('id', 'day', 'type'):
+                nights[col] = nights[col].astype(str)
+            arrays = {name: {key: data[f'{name}.{key}'] for key in ('values', 'offsets', 'start', 'interval')}
+                      for name in SERIES}
+        return cls(nights, arrays)
+
+    @classmethod
+    def concat(cls, items):
+        # Merge several exports; a night present in more than one keeps its latest copy
+        items = [item for item in items if len(item)]
+        if not items:
+            return parse_sleep(pd.DataFrame(columns=['id', 'day', 'type', 'bedtime_start', 'bedtime_end']))
+        nights = pd.concat([item.nights for item in items], ignore_index=True)
+        kept = np.flatnonzero(~nights['id'].duplicated(keep='last').to_numpy())
+        order = kept[np.argsort(nights['bedtime_start'].to_numpy()[kept], kind='stable')]
+
+        arrays = {}
+        for name in SERIES:
+            parts = [item.arrays[name] for item in items]
+            lengths = np.concatenate([np.diff(part['offsets']) for part in parts])[order]
+            starts = np.concatenate([part['offsets'][:-1] for part in parts])
+            shift = np.repeat(np.cumsum([0] + [len(part['values']) for part in parts[:-1]]), [len(item) for item in items])
+            starts = (starts + shift)[order]
+            values = np.concatenate([part['values'] for part in parts])
+            take = np.repeat(starts - _offsets(lengths)[:-1], lengths) + np.arange(lengths.sum())
+            arrays[name] = {
+                'values': values[take],
+                'offsets': _offsets(lengths),
+                'start': np.concatenate([part['start'] for part in parts])[order],
+                'interval': np.concatenate([part['interval'] for part in parts])[order],
+            }
+        return cls(nights.iloc[order].reset_index(drop=True), arrays)
+
+    def series(self, name, night):
+        # One night of a series as a Series indexed by local timestamps
+        arr = self.arrays[name]
+        values = arr['values'][arr['offsets'][night]:arr['offsets'][night + 1]]
+        offset = pd.Timedelta(minutes=int(self.nights['utc_offset_min'].iat[night]))
+        seconds = arr['start'][night] + np.arange(len(values)) * float(arr['interval'][night])
+        index = pd.to_datetime(seconds, unit='s') + offset
+        return pd.Series(values, index=pd.DatetimeIndex(index, name='timestamp'), name=name)
+
+    def night_features(self):
+        # One row per night, computed over all nights at once
+        n_nights = len(self)
+        features = self.nights[['id', 'day', 'type']].copy()
+
+        phases = self.arrays['sleep_phase_5_min']
+        phase_lengths, night, position = _segments(phases)
+        epoch_min = phases['interval'].astype(np.float64) / 60
+        counts = np.bincount(night * 5 + np.clip(phases['values'], 0, 4), minlength=n_nights * 5).reshape(n_nights, 5)
+        for phase, code in PHASE_CODES.items():
+            features[f'{phase}_min'] = counts[:, code] * epoch_min
+        asleep = (phases['values'] > 0) & (phases['values'] != PHASE_CODES['awake'])
+        features['sleep_min'] = counts[:, 1:4].sum(axis=1) * epoch_min
+        features['time_in_bed_min'] = phase_lengths * epoch_min
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features['efficiency'] = features['sleep_min'] / features['time_in_bed_min']
+
+        onset = _first_position(night, position, asleep, n_nights)
+        final = _first_position(night, position, asleep, n_nights, last=True)
+        first_rem = _first_position(night, position, phases['values'] == PHASE_CODES['rem'], n_nights)
+        features['sleep_onset_min'] = np.where(onset >= 0, onset * epoch_min, np.nan)
+        features['rem_latency_min'] = np.where(first_rem >= 0, (first_rem - onset) * epoch_min, np.nan)
+        in_sleep = (position >= onset[night]) & (position <= final[night])
+        awake_in_sleep = np.bincount(night[in_sleep & ~asleep], minlength=n_nights)
+        features['waso_min'] = np.where(onset >= 0, awake_in_sleep * epoch_min, np.nan)
+        changes = np.flatnonzero(np.diff(phases['values']) != 0) + 1
+        changes = changes[position[changes] > 0]
+        features['phase_transitions'] = np.bincount(night[changes], minlength=n_nights)
+
+        movement = self.arrays['movement_30_sec']
+        movement_lengths, movement_night, _ = _segments(movement)
+        restless = np.bincount(movement_night[movement['values'] >= RESTLESS_MOVEMENT], minlength=n_nights)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features['restless_share'] = restless / movement_lengths
+
+        hr = self.arrays['heart_rate']
+        n_hr, features['hr_mean'], features['hr_slope'], (hr_night, hr_values, hr_position) = _nan_stats(hr, n_nights)
+        # Nadir: lowest bpm per night, earliest sample if it repeats
+        order = np.lexsort((hr_position, hr_values, hr_night))
+        nights_hit, first = np.unique(hr_night[order], return_index=True)
+        nadir, nadir_position = np.full(n_nights, np.nan), np.full(n_nights, np.nan)
+        nadir[nights_hit] = hr_values[order[first]]
+        nadir_position[nights_hit] = hr_position[order[first]]
+        hr_lengths = np.diff(hr['offsets'])
+        nadir_seconds = nadir_position * hr['interval'].astype(np.float64)
+        local_start = hr['start'] + self.nights['utc_offset_min'].to_numpy(dtype=np.int64) * 60
+        features['hr_nadir'] = nadir
+        features['hr_nadir_min'] = (hr['start'] - self.nights['bedtime_start'].to_numpy() + nadir_seconds) / 60
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features['hr_nadir_fraction'] = nadir_position / (hr_lengths - 1)
+        features['hr_nadir_clock'] = ((local_start + nadir_seconds) % 86400) / 3600
+        features['hr_coverage'] = np.divide(n_hr, hr_lengths, out=np.full(n_nights, np.nan), where=hr_lengths > 0)
+
+        _, features['hrv_mean'], features['hrv_slope'], _ = _nan_stats(self.arrays['hrv'], n_nights)
+        return features.set_index('id')
+
+
+def cross_night_features(night_features, window=7, baseline=28, sleep_type='long_sleep'):
+    # Trends across nights of one subject: the main sleep of each day compared with a trailing
+    # baseline of earlier nights, plus rolling least-squares slopes per day over `window` nights
+    nights = night_features
+    if sleep_type is not None:
+        nights = nights[nights['type'] == sleep_type]
+    nights = nights.sort_values('time_in_bed_min').groupby('day').tail(1)
+    nights = nights.set_index(pd.to_datetime(nights['day'])).sort_index()
+    nights.index.name = 'day'
+
+    trends = pd.DataFrame(index=nights.index)
+    day_number = pd.Series((nights.index - pd.Timestamp(0)).days.astype(float), index=nights.index)
+    min_periods = max(2, window // 2)
+    for col in ('hrv_mean', 'hr_nadir', 'hr_nadir_min', 'sleep_min', 'efficiency', 'deep_min', 'rem_min'):
+        values = nights[col].astype(float)
+        history = values.shift(1).rolling(baseline, min_periods=min_periods)
+        trends[col] = values
+        trends[f'{col}_baseline'] = history.mean()
+        trends[f'{col}_z'] = (values - trends[f'{col}_baseline']) / history.std()
+        days = day_number.where(values.notna())
+        trends[f'{col}_trend'] = (values.rolling(window, min_periods=min_periods).cov(days)
+                                  / days.rolling(window, min_periods=min_periods).var())
+    return trends